@@ -0,0 +1,355 @@
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from datetime import date
+
+from indexes import day_ordinal
+
+# ------------------------------
+# Exam analytics: report cards and class statistics
+# Attendance analytics: percentages, defaulters, daily rates, absence streaks
+# ------------------------------
+# Exams are packed into parallel typed arrays (one column per field, subjects
+# interned to small ints) with running per-student / per-subject sums next to
+# them. add() folds a new record into the sums and remove_student() takes a
+# student's share back out, so nothing is recomputed from scratch when marks are
+# entered or a student leaves. Class averages are running sums of the students'
+# percentages, moved by class_changed() when a student changes class.
+
+def attach(db):
+    # registers on a storage.Database next to the indexes (see indexes.attach)
+    db.derive('exam_analytics', lambda db: ExamAnalytics(db.exams, db.student_index))
+    db.derive('attendance_analytics', lambda db: AttendanceAnalytics(db))
+
+def pct(marks, max_marks):
+    return 100.0 * marks / max_marks if max_marks else 0.0
+
+class ExamAnalytics:
+    def __init__(self, exams=(), student_index=None):
+        self.source = exams
+        self.student_index = student_index
+        self.built = False
+
+    def rebuild(self, exams):
+        self.built = True
+        self.ids = array('q')
+        self.student = array('q')
+        self.subject = array('I')   # index into self.subjects
+        self.marks = array('d')
+        self.max_marks = array('d')
+        self.subjects = []          # interned subject names
+        self.subject_code = {}      # name -> index
+        self.by_student = {}        # sid -> [marks, max] totals
+        self.by_subject = {}        # subject code -> [marks, max] totals
+        self.by_student_subject = {}  # (sid, code) -> [marks, max]
+        self.rows = {}              # (sid, code) -> number of exam rows
+        self.subject_rows = {}      # subject code -> number of exam rows
+        self.removed = 0            # rows of removed students still in the columns
+        self.scores = []            # sorted overall percentages, one per student
+        self.classes = {}           # sid -> class their percentage is counted under
+        self.class_sums = {}        # class -> [sum of the students' overall percentages, students]
+        for e in exams:
+            self._add(e, rank=False)
+        self.scores = sorted(self.percentage(sid) for sid in self.by_student)
+        for sid in self.by_student:
+            self._tally(sid, self.percentage(sid), 1)
+
+    def _ensure(self):
+        if not self.built:
+            self.rebuild(self.source)
+
+    def _code(self, subject):
+        code = self.subject_code.get(subject)
+        if code is None:
+            code = self.subject_code[subject] = len(self.subjects)
+            self.subjects.append(subject)
+        return code
+
+    def add(self, e):
+        if self.built:  # otherwise picked up from the source list when first built
+            self._add(e, rank=True)
+
+    def _add(self, e, rank):
+        sid, code = e['student_id'], self._code(e['subject'])
+        self.ids.append(e['id'])
+        self.student.append(sid)
+        self.subject.append(code)
+        self.marks.append(e['marks'])
+        self.max_marks.append(e['max_marks'])
+        if rank and sid in self.by_student:
+            old = self.percentage(sid)
+            self._unrank(old)
+            self._tally(sid, old, -1)
+        for totals in (self.by_student.setdefault(sid, [0.0, 0.0]), self.by_subject.setdefault(code, [0.0, 0.0]),
+                       self.by_student_subject.setdefault((sid, code), [0.0, 0.0])):
+            totals[0] += e['marks']
+            totals[1] += e['max_marks']
+        self.rows[(sid, code)] = self.rows.get((sid, code), 0) + 1
+        self.subject_rows[code] = self.subject_rows.get(code, 0) + 1
+        if rank:
+            score = self.percentage(sid)
+            insort(self.scores, score)
+            self._tally(sid, score, 1)
+
+    def _unrank(self, score):
+        i = bisect_left(self.scores, score)
+        if i < len(self.scores) and self.scores[i] == score:
+            del self.scores[i]
+
+    def _tally(self, sid, score, n):
+        # n = 1 counts the student's overall percentage towards their class average, -1 takes it out
+        clazz = self.classes.get(sid)
+        if clazz is None:
+            stu = self.student_index.get(sid) if self.student_index else None
+            clazz = self.classes[sid] = stu['clazz'] if stu else '?'
+        acc = self.class_sums.setdefault(clazz, [0.0, 0])
+        acc[0] += n * score
+        acc[1] += n
+        if not acc[1]:
+            del self.class_sums[clazz]
+
+    def class_changed(self, sid, clazz):
+        # clazz: the student's new class, '?' once they are deleted
+        if self.built and sid in self.by_student:
+            score = self.percentage(sid)
+            self._tally(sid, score, -1)
+            self.classes[sid] = clazz
+            self._tally(sid, score, 1)
+
+    def remove_student(self, sid):
+        # takes the student's totals back out of the subject sums, the ranking and their class
+        if not self.built or sid not in self.by_student:
+            return
+        score = pct(*self.by_student.pop(sid))
+        self._unrank(score)
+        self._tally(sid, score, -1)
+        del self.classes[sid]
+        for code in range(len(self.subjects)):
+            totals = self.by_student_subject.pop((sid, code), None)
+            if totals is None:
+                continue
+            n = self.rows.pop((sid, code))
+            self.removed += n
+            self.subject_rows[code] -= n
+            if self.subject_rows[code]:
+                self.by_subject[code][0] -= totals[0]
+                self.by_subject[code][1] -= totals[1]
+            else:
+                del self.by_subject[code], self.subject_rows[code]
+        if self.removed > len(self.ids) // 2:
+            # drop the removed students' rows from the columns once they are half of them
+            keep = [i for i, s in enumerate(self.student) if s in self.by_student]
+            for name in ('ids', 'student', 'subject', 'marks', 'max_marks'):
+                col = getattr(self, name)
+                setattr(self, name, array(col.typecode, [col[i] for i in keep]))
+            self.removed = 0
+
+    # ---------- queries ----------
+    def percentage(self, sid):
+        self._ensure()
+        totals = self.by_student.get(sid)
+        return pct(*totals) if totals else None
+
+    def rank(self, sid):
+        # -> (rank, out of, percentile); rank 1 is the best, ties share a rank
+        self._ensure()
+        score = self.percentage(sid)
+        if score is None:
+            return None
+        n = len(self.scores)
+        higher = n - bisect_right(self.scores, score)
+        lower = bisect_left(self.scores, score)
+        return higher + 1, n, 100.0 * lower / n
+
+    def subject_averages(self):
+        self._ensure()
+        return {self.subjects[code]: pct(*t) for code, t in self.by_subject.items()}
+
+    def class_averages(self):
+        # mean of the students' overall percentages, per class
+        self._ensure()
+        return {c: s / n for c, (s, n) in self.class_sums.items()}
+
+    def _ordered(self, n, best):
+        self._ensure()
+        scored = [(pct(*t), sid) for sid, t in self.by_student.items()]
+        scored.sort(key=lambda x: (-x[0], x[1]) if best else (x[0], x[1]))
+        return [(sid, score) for score, sid in scored[:n]]
+
+    def top(self, n=10):
+        return self._ordered(n, True)
+
+    def bottom(self, n=10):
+        return self._ordered(n, False)
+
+    def report_card(self, sid):
+        self._ensure()
+        subjects = []
+        for code, name in enumerate(self.subjects):
+            t = self.by_student_subject.get((sid, code))
+            if t:
+                subjects.append({'subject': name, 'marks': t[0], 'max_marks': t[1], 'percentage': pct(*t)})
+        stu = self.student_index.get(sid) if self.student_index else None
+        card = {'student_id': sid, 'name': stu['name'] if stu else None, 'clazz': stu['clazz'] if stu else None,
+                'subjects': subjects, 'percentage': self.percentage(sid), 'rank': None, 'out_of': None, 'percentile': None}
+        ranked = self.rank(sid)
+        if ranked:
+            card['rank'], card['out_of'], card['percentile'] = ranked
+        if stu:
+            sums = self.class_sums.get(stu['clazz'])
+            card['class_average'] = sums[0] / sums[1] if sums else None
+        return card
+
+    def __len__(self):
+        self._ensure()
+        return len(self.ids) - self.removed
+
+# ---------- attendance ----------
+# AttendanceIndex already holds attendance as a student x day matrix in both
+# directions: a status byte row per student (over the days they were marked)
+# and a present / marked bitset column per day. The queries below run on
+# those with bytes.count / bytes.split and int popcounts rather than per-mark
+# Python loops. Results are cached per date range; saving attendance for a day
+# only drops the cached ranges that contain that day. A range reaching into a
+# closed academic year also reads that year's archived index.
+
+def ordinal_range(start=None, end=None):
+    lo = day_ordinal(start) if start else None
+    hi = day_ordinal(end) if end else None
+    return (lo if lo is not None else 0), (hi if hi is not None else date.max.toordinal())
+
+class AttendanceAnalytics:
+    def __init__(self, db):
+        self.db = db  # uses db.attendance_index / db.student_index when first queried
+        self.cache = {}  # (query, lo, hi, extra) -> result
+
+    def invalidate(self, dates=None):
+        # dates=None drops everything (e.g. after a student is deleted)
+        if dates is None:
+            self.cache.clear()
+            return
+        ords = [o for o in map(day_ordinal, dates) if o is not None]
+        for key in [k for k in self.cache if any(k[1] <= o <= k[2] for o in ords)]:
+            del self.cache[key]
+
+    def _cached(self, query, start, end, extra, compute):
+        lo, hi = ordinal_range(start, end)
+        key = (query, lo, hi, extra)
+        if key not in self.cache:
+            self.cache[key] = compute(lo, hi)
+        return self.cache[key]
+
+    def _indexes(self, lo, hi):
+        # indexes of the closed years overlapping [lo, hi] (see archive.py), oldest first, then the live one
+        archive = self.db.archive if 'archive' in self.db.derived else None
+        years = archive.years_between(lo, hi) if archive else ()
+        return [archive.attendance_index(y) for y in years] + [self.db.attendance_index]
+
+    def _row(self, sid, lo, hi, indexes=None):
+        # the student's status bytes for days in [lo, hi]
+        rows = []
+        for idx in indexes or self._indexes(lo, hi):
+            days, marks = idx.by_student.get(sid, ((), b''))
+            rows.append(marks[bisect_left(days, lo):bisect_right(days, hi)])
+        return rows[0] if len(rows) == 1 else b''.join(rows)
+
+    def _students(self, clazz, indexes):
+        if clazz:
+            return self.db.student_index.by_class.get(clazz, ())
+        if len(indexes) == 1:
+            return indexes[0].by_student.keys()
+        return set().union(*(idx.by_student for idx in indexes))
+
+    def percentages(self, start=None, end=None, clazz=None):
+        # -> {sid: (percent present, days present, days marked)}
+        def compute(lo, hi):
+            out = {}
+            indexes = self._indexes(lo, hi)
+            for sid in self._students(clazz, indexes):
+                row = self._row(sid, lo, hi, indexes)
+                if row:
+                    present = row.count(b'P')
+                    out[sid] = (100.0 * present / len(row), present, len(row))
+            return out
+        return self._cached('percentages', start, end, clazz, compute)
+
+    def student_percentage(self, sid, start=None, end=None):
+        row = self._row(sid, *ordinal_range(start, end))
+        return 100.0 * row.count(b'P') / len(row) if row else None
+
+    def defaulters(self, threshold=75.0, start=None, end=None, clazz=None):
+        # -> [(sid, percent, present, marked)] below threshold, worst first
+        rows = [(sid, *v) for sid, v in self.percentages(start, end, clazz).items() if v[0] < threshold]
+        return sorted(rows, key=lambda r: (r[1], r[0]))
+
+    def absence_streaks(self, start=None, end=None, clazz=None):
+        # -> {sid: longest run of consecutive absent marks}
+        def compute(lo, hi):
+            out = {}
+            indexes = self._indexes(lo, hi)
+            for sid in self._students(clazz, indexes):
+                row = self._row(sid, lo, hi, indexes)
+                if row:
+                    out[sid] = max(map(len, row.split(b'P')))
+            return out
+        return self._cached('streaks', start, end, clazz, compute)
+
+    def daily_rates(self, start=None, end=None, clazz=None):
+        # -> [(iso date, present, marked)] per marked day, optionally for one class
+        def compute(lo, hi):
+            mask = None
+            if clazz:
+                mask = 0
+                for sid in self.db.student_index.by_class.get(clazz, ()):
+                    mask |= 1 << sid
+            days = {}  # day ordinal -> [present, marked] as ints, over the live and archived indexes' bitmaps
+            for idx in self._indexes(lo, hi):
+                for o, bits in idx.marked.items():
+                    if lo <= o <= hi:
+                        day = days.setdefault(o, [0, 0])
+                        day[0] |= int.from_bytes(idx.present.get(o, b''), 'little')
+                        day[1] |= int.from_bytes(bits, 'little')
+            out = []
+            for o in sorted(days):
+                present, marked = days[o]
+                if mask is not None:
+                    present, marked = present & mask, marked & mask
+                if marked:
+                    out.append((date.fromordinal(o).isoformat(), present.bit_count(), marked.bit_count()))
+            return out
+        return self._cached('daily', start, end, clazz, compute)
+
+    def summary(self, start=None, end=None, clazz=None, threshold=75.0):
+        days = self.daily_rates(start, end, clazz)
+        present = sum(p for _, p, _ in days)
+        marked = sum(m for _, _, m in days)
+        return {'days': len(days), 'average_rate': 100.0 * present / marked if marked else None,
+                'students': len(self.percentages(start, end, clazz)),
+                'defaulters': len(self.defaulters(threshold, start, end, clazz))}
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    from services import open_db
+
+    ap = argparse.ArgumentParser(description='Exam report cards, class statistics and attendance defaulters')
+    ap.add_argument('command', choices=['report', 'summary', 'defaulters'])
+    ap.add_argument('student_id', nargs='?', type=int)
+    ap.add_argument('--start', help='YYYY-MM-DD (defaulters)')
+    ap.add_argument('--end', help='YYYY-MM-DD (defaulters)')
+    ap.add_argument('--clazz', help='limit to one class (defaulters)')
+    ap.add_argument('--threshold', type=float, default=75.0, help='percent present (defaulters)')
+    args = ap.parse_args()
+    db = open_db()
+    ea = db.exam_analytics
+    if args.command == 'defaulters':
+        aa = db.attendance_analytics
+        out = {'summary': aa.summary(args.start, args.end, args.clazz, args.threshold),
+               'defaulters': aa.defaulters(args.threshold, args.start, args.end, args.clazz)}
+    elif args.command == 'report':
+        if args.student_id is None:
+            ap.error('report needs a student_id')
+        out = ea.report_card(args.student_id)
+    else:
+        out = {'records': len(ea), 'subject_averages': ea.subject_averages(), 'class_averages': ea.class_averages(),
+               'top': ea.top(5), 'bottom': ea.bottom(5)}
+    print(json.dumps(out, indent=2))
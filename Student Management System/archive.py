@@ -0,0 +1,268 @@
+import json
+import os
+import re
+import time
+from datetime import date
+
+import columnar
+import profiling
+from analytics import ExamAnalytics
+from indexes import AttendanceIndex, day_ordinal
+from profiling import timed
+from records import ValidationError
+from storage import DATA_DIR, load_pickle, record, compact_all
+
+# ------------------------------
+# Closed academic years
+# ------------------------------
+# close() moves a finished academic year's attendance marks, exam records and
+# fee payments out of the live stores into data/archive/<year>/, so loading and
+# saving the live stores only pays for the open years. Archives are read-only:
+# a year's files are opened when a report asks for a range inside it, and new
+# marks / exams / payments dated in a closed year are refused. Fee totals and
+# the running 'paid' amount stay on the live account; only the payment lines move.
+#
+#   data/archive/index.json           year -> record counts, the highest exam id and student id
+#   data/archive/<year>/attendance.col, exams.col, fees.col   see columnar.py
+#
+# Years closed before payments were archived as columns keep a fees.pkl
+# (student_id -> [{date, amount}]), which is still read. Student and exam ids
+# that appear in an archive are never given out again, so a student deleted
+# after their year was closed does not pass their archived records on.
+#
+# An academic year starts on the 1st of YEAR_START and is named after the two
+# calendar years it spans, e.g. '2024-25'.
+YEAR_START = 4  # April
+ARCHIVE_DIR = os.path.join(DATA_DIR, 'archive')
+FILES = {'attendance': 'attendance.col', 'exams': 'exams.col', 'fees': 'fees.col'}
+OLD_FEES = 'fees.pkl'
+
+def attach(db):
+    # registers on a storage.Database next to the indexes (see indexes.attach)
+    db.derive('archive', lambda db: Archive(db))
+
+def year_of(d):
+    # 'YYYY-MM-DD' -> academic year label, None for anything that is not a date
+    o = day_ordinal(d)
+    if o is None:
+        return None
+    day = date.fromordinal(o)
+    y = day.year if day.month >= YEAR_START else day.year - 1
+    return f'{y}-{(y + 1) % 100:02d}'
+
+def year_range(year):
+    # label -> (first, last) day ordinal of the year
+    m = re.fullmatch(r'(\d{4})-(\d{2})', str(year))
+    if not m or int(m.group(2)) != (int(m.group(1)) + 1) % 100:
+        raise ValidationError(f'Academic year must look like {year_of(date.today().isoformat())}')
+    y = int(m.group(1))
+    return date(y, YEAR_START, 1).toordinal(), date(y + 1, YEAR_START, 1).toordinal() - 1
+
+def _read_index(root):
+    path = os.path.join(root, 'index.json')
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+def _write_index(root, index):
+    path = os.path.join(root, 'index.json')
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+
+class Archive:
+    # Read-only view of data/archive. Only index.json is read up front; a year's
+    # stores are loaded on first use and kept, its .col files are also read in
+    # slices for single-student queries.
+    def __init__(self, db, root=ARCHIVE_DIR):
+        self.db = db
+        self.root = root
+        # year -> {'attendance': n, 'exams': n, 'payments': n, 'max_exam_id': id, 'max_student_id': id}
+        self.index = _read_index(root)
+        self.years = sorted(self.index)
+        self.ranges = {y: year_range(y) for y in self.years}
+        self.stores = {}  # (year, name) -> loaded store
+        self.views = {}   # (year, name) -> AttendanceIndex / ExamAnalytics over that store
+        missing = [y for y in self.years if 'max_student_id' not in self.index[y]]
+        if missing:  # years closed before it was recorded: counted once and written back
+            for year in missing:
+                self.index[year]['max_student_id'] = _max_student_id(self.store(year, 'attendance'),
+                                                                     self.store(year, 'exams'), self.store(year, 'fees'))
+            _write_index(root, self.index)
+        self.max_exam_id = max((v['max_exam_id'] for v in self.index.values()), default=0)
+        self.max_student_id = max((v['max_student_id'] for v in self.index.values()), default=0)
+
+    def path(self, year, name):
+        return os.path.join(self.root, year, FILES[name])
+
+    def check_open(self, d):
+        year = year_of(d)
+        if year in self.index:
+            raise ValidationError(f'{d} is in {year}, which is closed (read only)')
+
+    def years_between(self, lo, hi):
+        # closed years overlapping day ordinals [lo, hi], oldest first
+        return [y for y in self.years if self.ranges[y][0] <= hi and lo <= self.ranges[y][1]]
+
+    def store(self, year, name):
+        key = (year, name)
+        if key not in self.stores:
+            path = self.path(year, name)
+            t0 = time.perf_counter()
+            if os.path.exists(path):
+                self.stores[key] = columnar.load(name, path)
+            elif name == 'fees':
+                path = os.path.join(self.root, year, OLD_FEES)
+                self.stores[key] = load_pickle(path, {})
+            else:
+                self.stores[key] = [] if name == 'exams' else {}
+            profiling.add('load', f'{year}/{name}', time.perf_counter() - t0,
+                          os.path.getsize(path) if os.path.exists(path) else 0)
+        return self.stores[key]
+
+    # ---------- attendance ----------
+    def attendance_index(self, year):
+        key = (year, 'attendance')
+        if key not in self.views:
+            idx = None
+            if key not in self.stores and os.path.exists(self.path(year, 'attendance')):
+                idx = AttendanceIndex.from_columns(columnar.open_file('attendance', self.path(year, 'attendance')))
+            self.views[key] = idx or AttendanceIndex(self.store(year, 'attendance'))
+        return self.views[key]
+
+    def attendance_history(self, sid, start=None, end=None):
+        lo, hi = (day_ordinal(start) if start else None), (day_ordinal(end) if end else None)
+        out = []
+        for year in self.years_between(lo or 0, hi or date.max.toordinal()):
+            if (year, 'attendance') in self.stores:
+                out += self.attendance_index(year).history(sid, start, end)
+            elif os.path.exists(self.path(year, 'attendance')):
+                out += columnar.AttendanceColumns(self.path(year, 'attendance')).history(sid, start, end)
+        return out
+
+    # ---------- exams ----------
+    def exam_analytics(self, year):
+        key = (year, 'exams')
+        if key not in self.views:
+            self.views[key] = ExamAnalytics(self.store(year, 'exams'), self.db.student_index)
+        return self.views[key]
+
+    def class_changed(self, sid, clazz):
+        # keeps the loaded years' class averages on the student's current class ('?' once deleted)
+        for (year, name), view in self.views.items():
+            if name == 'exams':
+                view.class_changed(sid, clazz)
+
+    def exams_for_student(self, sid, year):
+        if (year, 'exams') in self.stores:
+            return [e for e in self.stores[(year, 'exams')] if e['student_id'] == sid]
+        if not os.path.exists(self.path(year, 'exams')):
+            return []
+        return columnar.ExamColumns(self.path(year, 'exams')).for_student(sid)
+
+    # ---------- fees ----------
+    def fee_history(self, sid):
+        out = []
+        for year in self.years:
+            if (year, 'fees') not in self.stores and os.path.exists(self.path(year, 'fees')):
+                out += columnar.FeeColumns(self.path(year, 'fees')).history(sid)
+            else:
+                out += self.store(year, 'fees').get(sid, ())
+        return out
+
+def _max_student_id(attendance, exams, payments):
+    return max(max((sid for sid, _ in attendance), default=0), max((e['student_id'] for e in exams), default=0),
+               max(payments, default=0))
+
+@timed('mutation', 'archive.close')
+def close(db, year):
+    # -> {'year', 'attendance', 'exams', 'payments'}: how many records left the live stores
+    lo, hi = year_range(year)
+    if hi >= date.today().toordinal():
+        raise ValidationError(f'{year} has not finished yet')
+
+    def inside(d):
+        o = day_ordinal(d)
+        return o is not None and lo <= o <= hi
+
+    attendance = {k: v for k, v in db.attendance.items() if inside(k[1])}
+    exams = [e for e in db.exams if inside(e['date'])]
+    payments = {}
+    for sid, acc in db.fees.items():
+        old = [h for h in acc['history'] if inside(h['date'])]
+        if old:
+            payments[sid] = old
+
+    # the archive is complete on disk before anything leaves the live stores
+    archive = db.archive
+    saved_att, saved_exams, saved_fees = attendance, exams, payments
+    if year in archive.index:  # closed before (e.g. a late import): add to what is there
+        saved_att = {**archive.store(year, 'attendance'), **attendance}
+        ids = {e['id'] for e in exams}
+        saved_exams = [e for e in archive.store(year, 'exams') if e['id'] not in ids] + exams
+        saved_fees = dict(archive.store(year, 'fees'))
+        for sid, old in payments.items():
+            saved_fees[sid] = saved_fees.get(sid, []) + old
+    os.makedirs(os.path.join(archive.root, year), exist_ok=True)
+    columnar.save('attendance', archive.path(year, 'attendance'), saved_att)
+    columnar.save('exams', archive.path(year, 'exams'), saved_exams)
+    columnar.save('fees', archive.path(year, 'fees'), saved_fees)
+    index = _read_index(archive.root)
+    index[year] = {'attendance': len(saved_att), 'exams': len(saved_exams),
+                   'payments': sum(map(len, saved_fees.values())),
+                   'max_exam_id': max((e['id'] for e in saved_exams), default=0),
+                   'max_student_id': _max_student_id(saved_att, saved_exams, saved_fees)}
+    _write_index(archive.root, index)
+    old = os.path.join(archive.root, year, OLD_FEES)
+    if os.path.exists(old):
+        os.remove(old)  # its lines are in fees.col now
+
+    for k in attendance:
+        del db.attendance[k]
+    record('attendance', [('del', k) for k in attendance])
+    gone = {e['id'] for e in exams}
+    db.exams[:] = [e for e in db.exams if e['id'] not in gone]
+    record('exams', [('del', i) for i in gone])
+    for sid in payments:
+        acc = db.fees[sid]
+        acc['history'] = [h for h in acc['history'] if not inside(h['date'])]
+    record('fees', [('set', sid, db.fees[sid]) for sid in payments])
+    db.drop_derived()
+    compact_all()  # rewrite the live snapshots without the closed year
+    return {'year': year, 'attendance': len(attendance), 'exams': len(exams),
+            'payments': sum(map(len, payments.values()))}
+
+if __name__ == '__main__':
+    import argparse
+    import sys
+    import storage
+    from services import open_db
+
+    ap = argparse.ArgumentParser(description='Move finished academic years out of the live data into read-only archives')
+    ap.add_argument('command', choices=['list', 'close'])
+    ap.add_argument('year', nargs='?', help='academic year to close, e.g. 2024-25')
+    args = ap.parse_args()
+    if storage.backend.name == 'remote':
+        ap.error('archive on the machine that runs server.py, with the server stopped')
+
+    db = open_db()
+    if args.command == 'list':
+        print(f'current year: {year_of(date.today().isoformat())}')
+        for year in db.archive.years:
+            paths = [db.archive.path(year, n) for n in FILES] + [os.path.join(db.archive.root, year, OLD_FEES)]
+            size = sum(os.path.getsize(p) for p in paths if os.path.exists(p))
+            counts = db.archive.index[year]
+            print(f"{year}: {counts['attendance']:,} marks, {counts['exams']:,} exams, "
+                  f"{counts['payments']:,} payments, {size:,} bytes")
+    else:
+        if not args.year:
+            ap.error('close needs a year')
+        try:
+            out = close(db, args.year)
+        except ValidationError as e:
+            print(f'{e.title}: {e}', file=sys.stderr)
+            sys.exit(1)
+        print(json.dumps(out, indent=2))
@@ -0,0 +1,273 @@
+import json
+import os
+import platform
+import random
+import time
+from datetime import date, timedelta
+
+from indexes import StudentIndex
+
+# ------------------------------
+# Benchmarks for the data paths, with a synthetic data generator
+# ------------------------------
+#   python bench.py generate DIR [--students N] [--years Y]   writes DIR/data/*.pkl
+#   python bench.py run DIR [--out results.json]              times the data paths on DIR/data
+#   python bench.py compare OLD.json NEW.json                 per-benchmark change
+#   python bench.py index [N]                                 StudentIndex vs list scans
+# Results are seconds per operation. Attendance grows as students x school days
+# (about 200 a year), so 100k students x 5 years is ~100M marks: keep that product
+# within memory.
+
+CLASSES = [f'{g}-{s}' for g in range(1, 13) for s in 'ABCD']
+FIRST = ['Aarav', 'Vivaan', 'Aditya', 'Ananya', 'Diya', 'Ishaan', 'Kavya', 'Meera', 'Neha', 'Rohan',
+         'Sai', 'Tanvi', 'Arjun', 'Priya', 'Kabir', 'Riya', 'Dev', 'Saanvi', 'Aryan', 'Zara']
+LAST = ['Sharma', 'Verma', 'Gupta', 'Iyer', 'Khan', 'Patel', 'Reddy', 'Singh', 'Das', 'Nair',
+        'Joshi', 'Mehta', 'Bose', 'Rao', 'Kulkarni', 'Chopra']
+SUBJECTS = ['Maths', 'Science', 'English', 'Hindi', 'Social Studies', 'Computer']
+TERMS_PER_YEAR = 3
+
+def make_students(n):
+    return [{'id': i, 'roll': f'R{i:06d}', 'name': f'{random.choice(FIRST)} {random.choice(LAST)}',
+             'clazz': random.choice(CLASSES), 'contact': f'9{random.randrange(10**8, 10**9)}'} for i in range(1, n + 1)]
+
+def school_days(years, end=None):
+    end = end or date.today()
+    d = end - timedelta(days=365 * years)
+    days = []
+    while d <= end:
+        if d.weekday() < 5:
+            days.append(d.isoformat())
+        d += timedelta(days=1)
+    return days
+
+def generate(root, students=1000, years=1, seed=1):
+    # -> {store: record count}; writes root/data/<store>.pkl
+    from storage import save_pickle
+    random.seed(seed)
+    data_dir = os.path.join(root, 'data')
+    os.makedirs(data_dir, exist_ok=True)
+    stus = make_students(students)
+    days = school_days(years)
+    attendance = {}
+    for s in stus:
+        rate = random.uniform(0.6, 0.99)  # some students end up below the defaulter threshold
+        for d in days:
+            attendance[(s['id'], d)] = 'P' if random.random() < rate else 'A'
+    exams, fees = [], {}
+    per_year = len(days) // years
+    year_days = [days[i * per_year:(i + 1) * per_year] for i in range(years)]
+    for s in stus:
+        acc = fees[s['id']] = {'total': 0.0, 'paid': 0.0, 'history': []}
+        for ydays in year_days:
+            for term in range(TERMS_PER_YEAR):
+                d = ydays[min(len(ydays) - 1, (term + 1) * len(ydays) // TERMS_PER_YEAR - 1)]
+                for sub in SUBJECTS:
+                    exams.append({'id': len(exams) + 1, 'student_id': s['id'], 'subject': sub,
+                                  'marks': float(random.randint(20, 100)), 'max_marks': 100.0, 'date': d})
+            yearly = float(random.choice((24000, 36000, 48000)))
+            acc['total'] += yearly
+            for _ in range(random.randint(1, 4)):
+                amt = round(yearly / 4, 2)
+                acc['paid'] += amt
+                acc['history'].append({'date': random.choice(ydays), 'amount': amt})
+    stores = {'users': {'admin': {'password': '1234', 'role': 'admin'},
+                        'teacher': {'password': '1234', 'role': 'teacher'}},
+              'students': stus, 'attendance': attendance, 'exams': exams, 'fees': fees}
+    for name, value in stores.items():
+        save_pickle(os.path.join(data_dir, f'{name}.pkl'), value)
+    return {name: len(value) for name, value in stores.items()}
+
+def timed(fn, repeat):
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - t0) / repeat
+
+def once(fn):
+    t0 = time.perf_counter()
+    value = fn()
+    return time.perf_counter() - t0, value
+
+def run(root, repeat=20, deletes=20, seed=2, counts=None):
+    # -> {group: {benchmark: seconds}} measured on root/data; leaves root's data modified.
+    # counts ({} from the caller) gets each store's record count as loaded, before the run changes them
+    os.chdir(root)  # storage paths are relative to the working directory
+    import storage
+    from services import Services, open_db
+    random.seed(seed)
+    results = {}
+
+    # load / persist
+    r = results['load'] = {}
+    for name in storage.STORES:
+        r[f'load_pickle {name}'] = once(lambda: storage.load_pickle(storage.FILES[name], storage.EMPTY[name]()))[0]
+    db = open_db()
+    r['all stores (Database)'] = once(lambda: [getattr(db, name) for name in storage.STORES])[0]
+    if counts is not None:
+        counts.update((name, len(getattr(db, name))) for name in storage.STORES)
+    r = results['persist'] = {}
+    for name in storage.STORES:
+        r[f'full snapshot {name}'] = once(lambda: storage.save_pickle(storage.FILES[name], getattr(db, name)))[0]
+    stu = db.students[0]
+    def journal_one():
+        storage.record('students', [('set', stu['id'], stu)])
+        storage.flush()
+    r['one change (journal + flush)'] = timed(journal_one, repeat)
+
+    svc = Services(db)
+    today = max(d for _, d in db.attendance) if db.attendance else date.today().isoformat()
+    clazz = CLASSES[0]
+
+    # derived views, as built by the first screen that needs them
+    r = results['build'] = {}
+    for attr in ('student_index', 'exam_index', 'attendance_index', 'counters'):
+        r[attr] = once(lambda: getattr(db, attr))[0]
+    r['counters (first snapshot)'] = once(db.counters.snapshot)[0]
+    r['exam analytics'] = once(lambda: len(db.exam_analytics))[0]
+    r['search index'] = once(lambda: len(db.search_index))[0]
+
+    r = results['dashboard'] = {}
+    r['stats'] = timed(lambda: (db.counters.snapshot(), db.counters.present_count(today)), repeat)
+
+    r = results['attendance'] = {}
+    r['list (all students)'] = timed(lambda: svc.attendance.day(today), repeat)
+    r[f'list (class {clazz})'] = timed(lambda: svc.attendance.day(today, clazz), repeat)
+    r['defaulters (first)'] = once(lambda: db.attendance_analytics.defaulters())[0]
+    r['defaulters (cached)'] = timed(lambda: db.attendance_analytics.defaulters(), repeat)
+    r['daily rates (class)'] = once(lambda: db.attendance_analytics.daily_rates(clazz=clazz))[0]
+
+    r = results['exams'] = {}
+    def exam_join():
+        # the exam table's rows: each record joined to its student's name
+        get = db.student_index.get
+        return [(e['id'], e['student_id'], (get(e['student_id']) or {}).get('name', '?'), e['subject'],
+                 e['marks'], e['max_marks'], e['date']) for e in db.exams]
+    r['table join (all rows)'] = timed(exam_join, max(repeat // 4, 1))
+    sids = [s['id'] for s in random.sample(db.students, min(repeat, len(db.students)))]
+    probe = iter(sids * 2)
+    r['report card'] = timed(lambda: svc.exams.report_card(next(probe)), len(sids))
+
+    r = results['search'] = {}
+    names = [s['name'] for s in random.sample(db.students, min(repeat, len(db.students)))]
+    for label, queries in (('2-char prefix', [n[:2] for n in names]), ('substring', [n[1:5] for n in names]),
+                           ('full name', names), ('roll', [s['roll'] for s in db.students[:repeat]])):
+        q = iter(queries)
+        r[label] = timed(lambda: svc.students.search(next(q), 200), len(queries))
+
+    r = results['mutations'] = {}
+    victims = iter([s['id'] for s in random.sample(db.students, min(deletes, len(db.students)))])
+    r['cascade delete student'] = timed(lambda: svc.students.delete(next(victims)), min(deletes, len(db.students)))
+    marks = {s['id']: 'P' for s in db.student_index.in_class(clazz)}
+    r[f'mark attendance (class {clazz})'] = once(lambda: svc.attendance.mark(date.today().isoformat(), marks))[0]
+    r['add exam'] = timed(lambda: svc.exams.add({'student_id': sids[0], 'subject': 'Maths', 'marks': 50, 'max_marks': 100}), repeat)
+    r['payment'] = timed(lambda: svc.fees.pay(sids[0], 100), repeat)
+    r['flush queued writes'] = once(storage.flush)[0]
+    return results
+
+def meta(counts):
+    # counts: records per store, as filled in by run()
+    import storage
+    return {'records': counts, 'python': platform.python_version(), 'platform': platform.platform(),
+            'backend': storage.backend.name, 'when': time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+def compare(old, new):
+    # -> [(group, name, old seconds, new seconds, change %)]
+    out = []
+    for group, rows in new['results'].items():
+        for name, secs in rows.items():
+            before = old['results'].get(group, {}).get(name)
+            if before:
+                out.append((group, name, before, secs, 100.0 * (secs - before) / before))
+    return out
+
+def bench_student_index(n=100000, repeat=200):
+    students = make_students(n)
+    idx = StudentIndex(students)
+    probes = iter([random.randint(1, n) for _ in range(repeat)] * 2)
+    def lookup_scan():
+        sid = next(probes)
+        return next((s for s in students if s['id'] == sid), None)
+    results = {
+        'lookup by id (scan)': timed(lookup_scan, repeat),
+        'lookup by id (index)': timed(lambda: idx.get(next(probes)), repeat),
+    }
+    roll = f'R{n // 2:06d}'
+    results['roll unique check (scan)'] = timed(lambda: any(s['roll'] == roll for s in students), repeat)
+    results['roll unique check (index)'] = timed(lambda: idx.roll_taken(roll), repeat)
+    results['class members (scan)'] = timed(lambda: [s for s in students if s['clazz'] == '7-B'], 20)
+    results['class members (index)'] = timed(lambda: idx.in_class('7-B'), 20)
+    t0 = time.perf_counter()
+    StudentIndex(students)
+    results['index rebuild'] = time.perf_counter() - t0
+
+    # delete: old list rebuild vs index removal + list.remove
+    victims = iter(random.sample(range(1, n + 1), 40))
+    def delete_scan():
+        sid = next(victims)
+        students[:] = [s for s in students if s['id'] != sid]
+    def delete_indexed():
+        stu = idx.remove(next(victims))
+        if stu is not None:
+            students.remove(stu)
+    results['delete (list rebuild)'] = timed(delete_scan, 20)
+    results['delete (index)'] = timed(delete_indexed, 20)
+    return results
+
+if __name__ == '__main__':
+    import argparse
+    import shutil
+    import tempfile
+
+    ap = argparse.ArgumentParser(description='Benchmarks for the Student Management System data paths')
+    sub = ap.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('generate', help='write synthetic data to DIR/data')
+    p.add_argument('dir')
+    p.add_argument('--students', type=int, default=1000)
+    p.add_argument('--years', type=int, default=1)
+    p.add_argument('--seed', type=int, default=1)
+    p = sub.add_parser('run', help='time the data paths on DIR/data (works on a copy)')
+    p.add_argument('dir')
+    p.add_argument('--out', help='write the JSON here instead of stdout')
+    p.add_argument('--repeat', type=int, default=20)
+    p = sub.add_parser('compare', help='change per benchmark between two runs')
+    p.add_argument('old')
+    p.add_argument('new')
+    p = sub.add_parser('index', help='StudentIndex vs list scans')
+    p.add_argument('n', nargs='?', type=int, default=100000)
+    args = ap.parse_args()
+
+    if args.command == 'generate':
+        t0 = time.perf_counter()
+        counts = generate(args.dir, args.students, args.years, args.seed)
+        print(json.dumps({'records': counts, 'seconds': round(time.perf_counter() - t0, 2)}, indent=2))
+    elif args.command == 'run':
+        # the run deletes students and adds records, so it works on a scratch copy
+        src = os.path.abspath(args.dir)
+        out_path = os.path.abspath(args.out) if args.out else None
+        work = tempfile.mkdtemp(prefix='sms-bench-')
+        try:
+            shutil.copytree(os.path.join(src, 'data'), os.path.join(work, 'data'),
+                            ignore=shutil.ignore_patterns('*.journal', '*.db*'))
+            counts = {}
+            results = run(work, args.repeat, counts=counts)  # imports storage only once inside work/
+            report = {'meta': meta(counts), 'results': results}
+        finally:
+            os.chdir(src)
+            shutil.rmtree(work, ignore_errors=True)
+        text = json.dumps(report, indent=2)
+        if out_path:
+            with open(out_path, 'w') as f:
+                f.write(text + '\n')
+        else:
+            print(text)
+    elif args.command == 'compare':
+        with open(args.old) as f:
+            old = json.load(f)
+        with open(args.new) as f:
+            new = json.load(f)
+        for group, name, before, after, change in compare(old, new):
+            print(f'{group:<11} {name:<34} {before * 1e3:10.3f} ms {after * 1e3:10.3f} ms {change:+7.1f}%')
+    else:
+        print(f'StudentIndex, {args.n} students')
+        for name, secs in bench_student_index(args.n).items():
+            print(f'  {name:<28} {secs * 1e6:12.1f} us')
@@ -0,0 +1,398 @@
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date
+
+# ------------------------------
+# Columnar snapshot files for attendance and exams (<name>.col)
+# ------------------------------
+# Layout (little-endian):
+#   header   b'SMSC', format version (u16), kind (u16), section count (u32)
+#   sections name (8s), typecode (2s), offset (u64), length in bytes (u64) each
+#   payload  each section 8-byte aligned: a raw array ('q', 'i', 'I', 'd', 'B') or UTF-8 JSON ('j')
+#
+# attendance: marks grouped by student, days sorted within each student
+#   students q  sorted student ids          offsets q  marks of students[i] are [offsets[i], offsets[i+1])
+#   days     i  day ordinals                present B  bit k (LSB first) set when mark k is 'P'
+#   extra    j  [[sid, date, status]] for keys whose date is not YYYY-MM-DD
+#   day_list i  sorted day ordinals          day_pres B / day_mark B  one bitmap per day
+#            (bit sid set, `width` bytes each, in day_list order), so the attendance
+#            index is built without visiting every mark; files without them still load
+# exams: one row per record, in store order, subjects interned
+#   ids q, student q, subject I (index into subjects), marks d, max d, date i (day ordinal, 0 if not ISO)
+#   subjects j  subject names               extra j  {row: {field: value}} for anything the columns cannot hold
+#   by_stu q / stu_off q / stu_rows q       rows of by_stu[i] are stu_rows[stu_off[i]:stu_off[i+1]]
+# fees: payment lines {student_id: [{date, amount}]} (archived years, see archive.py), grouped by student
+#   students q / offsets q as for attendance, lines kept in their stored order
+#   date i (day ordinal, 0 if not ISO), amount d   extra j  {row: {field: value}} as for exams
+#
+# Files are read through mmap, so one student's marks or exams can be read as
+# slices without decoding the rest of the file. Whole-store loads read the file
+# into memory instead, so no mapping is left open on a file compaction replaces.
+MAGIC = b'SMSC'
+VERSION = 1
+KINDS = {'attendance': 1, 'exams': 2, 'fees': 3}
+_HEADER = struct.Struct('<4sHHI')
+_SECTION = struct.Struct('<8s2sQQ')
+
+def _check_byteorder():
+    if sys.byteorder != 'little':
+        raise OSError('columnar files are only supported on little-endian machines')
+
+def write(path, kind, sections):
+    # sections: [(name, typecode, array / bytes / JSON-able)]; written atomically
+    _check_byteorder()
+    payloads = []
+    for name, typecode, value in sections:
+        if typecode == 'j':
+            data = json.dumps(value).encode()
+        elif isinstance(value, array):
+            data = value.tobytes()
+        else:
+            data = bytes(value)
+        payloads.append((name, typecode, data))
+    pos = _HEADER.size + _SECTION.size * len(payloads)
+    table, body = [], bytearray()
+    for name, typecode, data in payloads:
+        pad = -(pos + len(body)) % 8
+        body += b'\0' * pad
+        table.append(_SECTION.pack(name.encode(), typecode.encode().ljust(2), pos + len(body), len(data)))
+        body += data
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(_HEADER.pack(MAGIC, VERSION, KINDS[kind], len(payloads)))
+        f.write(b''.join(table))
+        f.write(body)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+class ColumnFile:
+    def __init__(self, path, kind, mapped=True):
+        _check_byteorder()
+        self.path = path
+        with open(path, 'rb') as f:
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if mapped else f.read()
+        magic, version, file_kind, count = _HEADER.unpack_from(self.mm, 0)
+        if magic != MAGIC:
+            raise ValueError(f'{path} is not a columnar file')
+        if version > VERSION:
+            raise ValueError(f'{path} has format version {version}; this program reads up to {VERSION}')
+        if file_kind != KINDS[kind]:
+            raise ValueError(f'{path} does not hold {kind}')
+        self.sections = {}
+        for i in range(count):
+            name, typecode, offset, length = _SECTION.unpack_from(self.mm, _HEADER.size + i * _SECTION.size)
+            self.sections[name.rstrip(b'\0').decode()] = (typecode.decode().strip(), offset, length)
+
+    def column(self, name):
+        # zero-copy view over the mapped file
+        typecode, offset, length = self.sections[name]
+        return memoryview(self.mm)[offset:offset + length].cast(typecode)
+
+    def json(self, name):
+        _, offset, length = self.sections[name]
+        return json.loads(self.mm[offset:offset + length])
+
+def _ordinal(d):
+    try:
+        return date.fromisoformat(d).toordinal()
+    except (TypeError, ValueError):
+        return 0
+
+def _iso_days(ordinals):
+    return {o: date.fromordinal(o).isoformat() for o in set(ordinals)}
+
+def _pack_bits(flags):
+    # '1'/'0' text, mark k -> bit k (LSB first)
+    n = len(flags)
+    return int(flags[::-1] or '0', 2).to_bytes((n + 7) // 8, 'little')
+
+def _unpack_bits(bits, n):
+    return format(int.from_bytes(bits, 'little'), f'0{len(bits) * 8}b')[::-1][:n]
+
+# ---------- attendance ----------
+def write_attendance(path, attendance):
+    by_student, extra, ords = {}, [], {}
+    for (sid, d), status in attendance.items():
+        o = ords.get(d)
+        if o is None:
+            # only canonical dates go in the columns; anything else ('20240105') comes back verbatim from extra
+            o = _ordinal(d)
+            o = ords[d] = o if o and date.fromordinal(o).isoformat() == d else 0
+        if not o or status not in ('P', 'A'):
+            extra.append([sid, d, status])
+        else:
+            by_student.setdefault(sid, []).append((o, status))
+    width = (max(by_student) >> 3) + 1 if by_student else 0
+    day_list = array('i', sorted({o for marks in by_student.values() for o, _ in marks}))
+    at = {o: i * width for i, o in enumerate(day_list)}
+    day_present, day_marked = bytearray(width * len(day_list)), bytearray(width * len(day_list))
+    students, offsets, days, flags = array('q'), array('q', [0]), array('i'), []
+    for sid in sorted(by_student):
+        marks = sorted(by_student[sid])
+        students.append(sid)
+        days.extend(o for o, _ in marks)
+        flags.append(''.join('1' if s == 'P' else '0' for _, s in marks))
+        offsets.append(len(days))
+        byte, bit = sid >> 3, 1 << (sid & 7)
+        for o, s in marks:
+            day_marked[at[o] + byte] |= bit
+            if s == 'P':
+                day_present[at[o] + byte] |= bit
+    write(path, 'attendance', [('students', 'q', students), ('offsets', 'q', offsets), ('days', 'i', days),
+                               ('present', 'B', _pack_bits(''.join(flags))), ('extra', 'j', extra),
+                               ('day_list', 'i', day_list), ('day_pres', 'B', day_present),
+                               ('day_mark', 'B', day_marked)])
+
+class AttendanceColumns(ColumnFile):
+    def __init__(self, path, mapped=True):
+        super().__init__(path, 'attendance', mapped)
+        self.students = self.column('students')
+        self.offsets = self.column('offsets')
+        self.days = self.column('days')
+
+    def _span(self, sid):
+        i = bisect_left(self.students, sid)
+        if i == len(self.students) or self.students[i] != sid:
+            return 0, 0
+        return self.offsets[i], self.offsets[i + 1]
+
+    def _statuses(self, lo, hi):
+        # 'P'/'A' text for marks [lo, hi)
+        present = self.column('present')
+        first, last = lo // 8, (hi + 7) // 8
+        bits = _unpack_bits(present[first:last].tobytes(), (last - first) * 8)
+        return bits[lo - first * 8:hi - first * 8].translate(str.maketrans('01', 'AP'))
+
+    def history(self, sid, start=None, end=None):
+        # [(iso date, status)] for start <= date <= end, reading only that student's slice
+        lo, hi = self._span(sid)
+        days = self.days[lo:hi]
+        a = bisect_left(days, date.fromisoformat(start).toordinal()) if start else 0
+        b = bisect_right(days, date.fromisoformat(end).toordinal()) if end else len(days)
+        text = self._statuses(lo + a, lo + b)
+        return [(date.fromordinal(o).isoformat(), s) for o, s in zip(days[a:b], text)]
+
+    def to_dict(self):
+        text = self._statuses(0, len(self.days))
+        iso = _iso_days(self.days)
+        out = {}
+        for i, sid in enumerate(self.students):
+            lo, hi = self.offsets[i], self.offsets[i + 1]
+            out.update(zip([(sid, iso[o]) for o in self.days[lo:hi]], text[lo:hi]))
+        for sid, d, status in self.json('extra'):
+            out[(sid, d)] = status
+        return out
+
+    def index_parts(self):
+        # (by_student, present, marked) in indexes.AttendanceIndex's shapes, copied out of
+        # the columns; None for files written before the per-day bitmaps
+        if 'day_list' not in self.sections:
+            return None
+        days = array('i')
+        days.frombytes(self.days.tobytes())
+        text = self._statuses(0, len(days)).encode()
+        by_student = {}
+        for i, sid in enumerate(self.students):
+            lo, hi = self.offsets[i], self.offsets[i + 1]
+            by_student[sid] = (days[lo:hi], bytearray(text[lo:hi]))
+        day_list = self.column('day_list')
+        width = len(self.column('day_mark')) // len(day_list) if len(day_list) else 0
+        maps = []
+        for name in ('day_pres', 'day_mark'):
+            bits = self.column(name)
+            maps.append({o: bytearray(bits[i * width:(i + 1) * width]) for i, o in enumerate(day_list)})
+        return by_student, maps[0], maps[1]
+
+    def __len__(self):
+        return len(self.days)
+
+# ---------- exams ----------
+EXAM_FIELDS = ('id', 'student_id', 'subject', 'marks', 'max_marks', 'date')
+
+def write_exams(path, exams):
+    ids, student, subject, marks, maxes, dates = (array(t) for t in 'qqIddi')
+    subjects, codes, extra = [], {}, {}
+    for row, e in enumerate(exams):
+        ids.append(e['id'])
+        student.append(e['student_id'])
+        code = codes.get(e['subject'])
+        if code is None:
+            code = codes[e['subject']] = len(subjects)
+            subjects.append(e['subject'])
+        subject.append(code)
+        marks.append(e['marks'])
+        maxes.append(e['max_marks'])
+        o = _ordinal(e['date'])
+        dates.append(o)
+        # anything that would not come back identical from the columns
+        odd = {k: v for k, v in e.items() if k not in EXAM_FIELDS}
+        if not o or date.fromordinal(o).isoformat() != e['date']:
+            odd['date'] = e['date']
+        for k in ('marks', 'max_marks'):
+            if type(e[k]) is not float:
+                odd[k] = e[k]
+        if odd:
+            extra[row] = odd
+    rows = sorted(range(len(exams)), key=student.__getitem__)
+    by_stu, stu_off, stu_rows = array('q'), array('q'), array('q', rows)
+    for i, row in enumerate(rows):
+        if not by_stu or by_stu[-1] != student[row]:
+            by_stu.append(student[row])
+            stu_off.append(i)
+    stu_off.append(len(rows))
+    write(path, 'exams', [('ids', 'q', ids), ('student', 'q', student), ('subject', 'I', subject),
+                          ('marks', 'd', marks), ('max', 'd', maxes), ('date', 'i', dates),
+                          ('subjects', 'j', subjects), ('extra', 'j', extra),
+                          ('by_stu', 'q', by_stu), ('stu_off', 'q', stu_off), ('stu_rows', 'q', stu_rows)])
+
+class ExamColumns(ColumnFile):
+    def __init__(self, path, mapped=True):
+        super().__init__(path, 'exams', mapped)
+        self.ids = self.column('ids')
+        self.student = self.column('student')
+        self.subject = self.column('subject')
+        self.marks = self.column('marks')
+        self.max_marks = self.column('max')
+        self.dates = self.column('date')
+        self.subjects = self.json('subjects')
+        self.extra = {int(k): v for k, v in self.json('extra').items()}
+
+    def record(self, row, iso=None):
+        o = self.dates[row]
+        rec = {'id': self.ids[row], 'student_id': self.student[row], 'subject': self.subjects[self.subject[row]],
+               'marks': self.marks[row], 'max_marks': self.max_marks[row],
+               'date': (iso[o] if iso else date.fromordinal(o).isoformat()) if o else ''}
+        if row in self.extra:
+            rec.update(self.extra[row])
+        return rec
+
+    def for_student(self, sid):
+        by_stu = self.column('by_stu')
+        i = bisect_left(by_stu, sid)
+        if i == len(by_stu) or by_stu[i] != sid:
+            return []
+        off = self.column('stu_off')
+        return [self.record(row) for row in self.column('stu_rows')[off[i]:off[i + 1]]]
+
+    def to_list(self):
+        iso = _iso_days(o for o in self.dates if o)
+        return [self.record(row, iso) for row in range(len(self.ids))]
+
+    def __len__(self):
+        return len(self.ids)
+
+# ---------- fee payments ----------
+def write_fees(path, payments):
+    students, offsets, dates, amounts, extra = array('q'), array('q', [0]), array('i'), array('d'), {}
+    for sid in sorted(payments):
+        students.append(sid)
+        for h in payments[sid]:
+            o = _ordinal(h['date'])
+            dates.append(o)
+            amounts.append(h['amount'])
+            odd = {k: v for k, v in h.items() if k not in ('date', 'amount')}
+            if not o or date.fromordinal(o).isoformat() != h['date']:
+                odd['date'] = h['date']
+            if type(h['amount']) is not float:
+                odd['amount'] = h['amount']
+            if odd:
+                extra[len(dates) - 1] = odd
+        offsets.append(len(dates))
+    write(path, 'fees', [('students', 'q', students), ('offsets', 'q', offsets), ('date', 'i', dates),
+                         ('amount', 'd', amounts), ('extra', 'j', extra)])
+
+class FeeColumns(ColumnFile):
+    def __init__(self, path, mapped=True):
+        super().__init__(path, 'fees', mapped)
+        self.students = self.column('students')
+        self.offsets = self.column('offsets')
+        self.dates = self.column('date')
+        self.amounts = self.column('amount')
+        self.extra = {int(k): v for k, v in self.json('extra').items()}
+
+    def _lines(self, lo, hi, iso=None):
+        out = []
+        for row in range(lo, hi):
+            o = self.dates[row]
+            h = {'date': (iso[o] if iso else date.fromordinal(o).isoformat()) if o else '', 'amount': self.amounts[row]}
+            if row in self.extra:
+                h.update(self.extra[row])
+            out.append(h)
+        return out
+
+    def history(self, sid):
+        # one student's payment lines, reading only their slice
+        i = bisect_left(self.students, sid)
+        if i == len(self.students) or self.students[i] != sid:
+            return []
+        return self._lines(self.offsets[i], self.offsets[i + 1])
+
+    def to_dict(self):
+        iso = _iso_days(o for o in self.dates if o)
+        return {sid: self._lines(self.offsets[i], self.offsets[i + 1], iso) for i, sid in enumerate(self.students)}
+
+    def __len__(self):
+        return len(self.dates)
+
+# ---------- store level ----------
+WRITERS = {'attendance': write_attendance, 'exams': write_exams, 'fees': write_fees}
+READERS = {'attendance': AttendanceColumns, 'exams': ExamColumns, 'fees': FeeColumns}
+
+def save(name, path, data):
+    WRITERS[name](path, data)
+
+def open_file(name, path):
+    # the whole file read into memory, for store loads
+    return READERS[name](path, mapped=False)
+
+def to_store(name, f):
+    return f.to_list() if name == 'exams' else f.to_dict()
+
+def load(name, path):
+    return to_store(name, open_file(name, path))
+
+if __name__ == '__main__':
+    import argparse
+    import storage
+
+    ap = argparse.ArgumentParser(description='Convert data/attendance and data/exams between .pkl and .col')
+    ap.add_argument('command', choices=['to-columnar', 'to-pickle', 'info'])
+    ap.add_argument('stores', nargs='*', help=f"default: {' '.join(storage.COLUMNAR)}")
+    args = ap.parse_args()
+    args.stores = args.stores or list(storage.COLUMNAR)
+    for name in args.stores:
+        if name not in storage.COLUMNAR:
+            ap.error(f"only {', '.join(storage.COLUMNAR)} have a columnar format")
+    if storage.backend.name != 'pickle':
+        ap.error('columnar files are snapshots of the pickle backend (SMS_BACKEND=pickle)')
+
+    for name in args.stores:
+        col, pkl = storage.COLUMNAR[name], storage.FILES[name]
+        if args.command == 'info':
+            for path in (pkl, col, storage.JOURNALS[name]):
+                if os.path.exists(path):
+                    print(f'{path}: {os.path.getsize(path):,} bytes')
+            continue
+        # fold the journal in first, so the new snapshot alone holds everything
+        data = storage.backend.load(name, storage.EMPTY[name]())
+        if args.command == 'to-columnar':
+            save(name, col, data)
+            check = load(name, col)
+            if check != data:
+                os.remove(col)
+                raise SystemExit(f'{name}: the columnar copy does not match, kept {pkl}')
+            if os.path.exists(pkl):
+                os.remove(pkl)
+        else:
+            storage.save_pickle(pkl, data)
+            if os.path.exists(col):
+                os.remove(col)
+        j = storage.backend.journal(name)
+        j.drop_head(j.size())
+        print(f'{name}: {len(data):,} records -> {col if args.command == "to-columnar" else pkl}')
@@ -1,57 +1,48 @@
 import os
-import pickle
+import threading
+import time
 import tkinter as tk
-from tkinter import ttk, messagebox
+from tkinter import ttk, messagebox, filedialog
 from datetime import date
 
+import profiling
+import storage
+from storage import record, flush, compact_all, writer
+from indexes import day_ordinal
+from records import DEFAULT_USERS, RecordError, ConflictError
+from services import Services, open_db
+from widgets import VirtualTable, AttendanceGrid
+import transfer
+
+STARTUP_T0 = time.perf_counter()
+TIMING = bool(os.environ.get('SMS_TIMING'))  # print startup / store load timings
+
 # ------------------------------
-# Persistent storage via pickle
+# Persistent storage (see storage.py for the pickle / sqlite backends)
 # ------------------------------
-DATA_DIR = 'data'
-FILES = {
-    'users': os.path.join(DATA_DIR, 'users.pkl'),
-    'students': os.path.join(DATA_DIR, 'students.pkl'),
-    'attendance': os.path.join(DATA_DIR, 'attendance.pkl'),
-    'exams': os.path.join(DATA_DIR, 'exams.pkl'),
-    'fees': os.path.join(DATA_DIR, 'fees.pkl'),
-}
-
-os.makedirs(DATA_DIR, exist_ok=True)
-
-def load_pickle(path, default):
-    if not os.path.exists(path):
-        return default
-    try:
-        with open(path, 'rb') as f:
-            return pickle.load(f)
-    except Exception:
-        return default
-
-def save_pickle(path, data):
-    with open(path, 'wb') as f:
-        pickle.dump(data, f)
-
-# Seed default users if not present
-users = load_pickle(FILES['users'], {})
-if not users:
-    users = {
-        'admin': {'password': '1234', 'role': 'admin'},
-        'teacher': {'password': '1234', 'role': 'teacher'},
-    }
-    save_pickle(FILES['users'], users)
-
-students = load_pickle(FILES['students'], [])  # list of dicts: {id, roll, name, clazz, contact}
-attendance = load_pickle(FILES['attendance'], {})  # key: (student_id, 'YYYY-MM-DD') -> 'P'/'A'
-exams = load_pickle(FILES['exams'], [])  # list of dicts: {id, student_id, subject, marks, max_marks, date}
-fees = load_pickle(FILES['fees'], {})  # student_id -> {total, paid, history:[{date, amount}]}
-
-# Helpers to persist whenever data changes
-def persist_all():
-    save_pickle(FILES['users'], users)
-    save_pickle(FILES['students'], students)
-    save_pickle(FILES['attendance'], attendance)
-    save_pickle(FILES['exams'], exams)
-    save_pickle(FILES['fees'], fees)
+db = open_db()
+# stores (loaded on first access):
+#   db.users       username -> {password, role}
+#   db.students    list of dicts: {id, roll, name, clazz, contact}
+#   db.attendance  key: (student_id, 'YYYY-MM-DD') -> 'P'/'A'
+#   db.exams       list of dicts: {id, student_id, subject, marks, max_marks, date}
+#   db.fees        student_id -> {total, paid, history:[{date, amount}], due}
+# derived: db.student_index, db.exam_index, db.attendance_index, db.search_index,
+#          db.exam_analytics, db.attendance_analytics, db.counters, db.fee_ledger, db.archive
+svc = Services(db)  # every change goes through services.py
+
+def seed_users():
+    # Seed default users if not present (a remote client's users live on the server)
+    if storage.backend.name != 'remote' and not db.users:
+        db.users.update({u: dict(v) for u, v in DEFAULT_USERS.items()})
+        record('users', [('set', u, v) for u, v in db.users.items()])
+
+def check_login(username, password):
+    # -> role, or None
+    if hasattr(storage.backend, 'login'):
+        return storage.backend.login(username, password)
+    user = db.users.get(username)
+    return user['role'] if user and user['password'] == password else None
 
 # ------------------------------
 # UI Helpers / Theme
@@ -60,6 +51,10 @@ APP_BG = '#f5f6fa'
 HEADER_BG = '#273c75'
 SIDE_BG = '#dcdde1'
 BTN_BG = '#718093'
+SYNC_MS = 2000  # remote backend: how often to pick up other users' changes
+SEARCH_DELAY_MS = 250  # debounce for search-as-you-type
+SEARCH_LIMIT = 200
+LOADING_HINT_BYTES = 2 * 1024 * 1024  # show a loading indicator for stores bigger than this
 
 class App:
     def __init__(self):
@@ -67,15 +62,33 @@ class App:
         self.root = None
         self.role = None
         self.username = None
-        self._student_auto_id = self.compute_next_student_id()
-        self._exam_auto_id = self.compute_next_exam_id()
+        self._loading = None
+        db.before_load = self.on_store_load
+        db.after_load = self.after_store_load
+        seed_users()
         self.open_login()
 
-    def compute_next_student_id(self):
-        return (max([s['id'] for s in students], default=0) + 1)
-
-    def compute_next_exam_id(self):
-        return (max([e['id'] for e in exams], default=0) + 1)
+    # ---------------- Lazy loading ----------------
+    def on_store_load(self, name, size):
+        if self.root is None or size < LOADING_HINT_BYTES:
+            return
+        try:
+            self._loading = tk.Label(self.content, text=f'Loading {name}...', font=('Arial', 14), bg='white', fg='gray')
+            self._loading.place(relx=0.5, rely=0.5, anchor='center')
+            self.root.update_idletasks()
+        except tk.TclError:
+            self._loading = None
+
+    def after_store_load(self, name, seconds):
+        if self._loading is not None:
+            self._loading.destroy()
+            self._loading = None
+        if TIMING:
+            print(f'[timing] loaded {name} in {seconds * 1000:.1f} ms')
+
+    def report_startup(self):
+        print(f'[timing] login window ready {(time.perf_counter() - STARTUP_T0) * 1000:.1f} ms after start; '
+              f'stores loaded: {", ".join(db.load_times) or "none"}')
 
     # ---------------- Login ----------------
     def open_login(self):
@@ -101,13 +114,20 @@ class App:
         tk.Button(self.login_win, text='Login', font=('Arial', 12, 'bold'), bg=HEADER_BG, fg='white',
                   command=self.handle_login).pack(pady=14)
         self.ent_user.focus_set()
+        if TIMING and self.root is None:  # first start only, not after logout
+            self.login_win.after_idle(self.report_startup)
         self.login_win.mainloop()
 
     def handle_login(self):
         u = self.ent_user.get().strip()
         p = self.ent_pass.get().strip()
-        if u in users and users[u]['password'] == p:
-            self.role = users[u]['role']
+        try:
+            role = check_login(u, p)
+        except ConnectionError as e:
+            messagebox.showerror('Server not reachable', str(e))
+            return
+        if role:
+            self.role = role
             self.username = u
             self.login_win.destroy()
             self.open_dashboard()
@@ -138,14 +158,22 @@ class App:
                 ('Students', self.show_students),
                 ('Attendance', self.show_attendance),
                 ('Exams', self.show_exams),
+                ('Report Cards', self.show_reports),
+                ('Defaulters', self.show_defaulters),
                 ('Fees', self.show_fees),
+                ('Fee Reports', self.show_fee_reports),
+                ('Import / Export', self.show_transfer),
                 ('Logout', self.logout)
             ]
+            if profiling.enabled:
+                items.insert(-1, ('Diagnostics', self.show_diagnostics))
         else:  # teacher
             items = [
                 ('Dashboard', self.show_dashboard),
                 ('Mark Attendance', self.show_attendance),
                 ('Enter Marks', self.show_exams),
+                ('Report Cards', self.show_reports),
+                ('Defaulters', self.show_defaulters),
                 ('View Students', self.show_students_readonly),
                 ('Logout', self.logout)
             ]
@@ -153,65 +181,136 @@ class App:
         for text, cmd in items:
             tk.Button(sidebar, text=text, font=('Arial', 12), bg=BTN_BG, fg='white', relief='flat',
                       padx=10, pady=12, command=cmd).pack(fill='x', pady=3)
+        self.save_status = tk.Label(sidebar, text='', bg=SIDE_BG, fg='gray', font=('Arial', 9))
+        self.save_status.pack(side='bottom', pady=6)
 
+        self.root.protocol('WM_DELETE_WINDOW', self.on_close)
         self.show_dashboard()
+        self.root.after(200, self.poll_writes)
+        self.sync_job = None
+        if storage.backend.name == 'remote':
+            self.root.after(SYNC_MS, self.sync_remote)
         self.root.mainloop()
 
+    def poll_writes(self):
+        # saves run on the storage writer thread; results are picked up here, on the Tk thread
+        ready, errors = writer.poll()
+        for callback, error in ready:
+            callback(error)
+        for error in errors:
+            if isinstance(error, ConflictError):
+                self.sync_remote(again=False)  # brings in the values that won
+                messagebox.showwarning(error.title, str(error))
+            else:
+                messagebox.showerror('Save failed', f'Could not write changes to disk:\n{error}')
+        if writer.error:
+            self.save_status.config(text='Not saved yet, retrying...')
+        else:
+            self.save_status.config(text='Saving...' if writer.busy() else 'All changes saved')
+        self.root.after(200, self.poll_writes)
+
+    def sync_remote(self, again=True):
+        # the request runs on a worker thread so a slow server never freezes the window;
+        # apply_remote() puts its changes into the stores here, on the Tk thread
+        if self.sync_job is None:  # one request at a time
+            job = self.sync_job = {}
+
+            def fetch():
+                try:
+                    job['changes'] = db.fetch_changes()
+                except ConnectionError as e:
+                    job['error'] = e
+
+            threading.Thread(target=fetch, daemon=True).start()
+            self.root.after(50, self.apply_remote)
+        if again:
+            self.root.after(SYNC_MS, self.sync_remote)
+
+    def apply_remote(self):
+        # other users' changes go into the stores and indexes; open views show them once reloaded
+        job = self.sync_job
+        if not job:
+            self.root.after(50, self.apply_remote)
+            return
+        self.sync_job = None
+        if 'error' in job:
+            self.save_status.config(text='Server not reachable')
+            return
+        n = db.sync(job['changes'])
+        if n:
+            self.save_status.config(text='Updated by another user' if n > 0 else 'Server restarted: reloaded')
+
     def clear_content(self):
         for w in self.content.winfo_children():
             w.destroy()
 
     # --------------- Views ---------------
+    @profiling.timed('view')
     def show_dashboard(self):
         self.clear_content()
         tk.Label(self.content, text=f"Welcome, {self.username} 👋", font=('Arial', 18, 'bold'), bg='white').pack(pady=16)
 
-        # Simple stats
-        total_students = len(students)
-        total_exams = len(exams)
-        total_present_today = sum(1 for s in students if attendance.get((s['id'], date.today().isoformat())) == 'P')
+        # maintained counters (metrics.py), not recounted here
+        c = db.counters.snapshot()
+        total_present_today = db.counters.present_count(date.today().isoformat())
 
-        grid = tk.Frame(self.content, bg='white')
-        grid.pack(pady=10)
         def stat_card(parent, title, value):
             card = tk.Frame(parent, bg=APP_BG, bd=0, relief='flat')
             card.pack(side='left', padx=12)
             tk.Label(card, text=title, font=('Arial', 12)).pack(padx=30, pady=(12, 2))
             tk.Label(card, text=str(value), font=('Arial', 20, 'bold')).pack(padx=30, pady=(0, 12))
-        stat_card(grid, 'Total Students', total_students)
-        stat_card(grid, 'Exam Records', total_exams)
+        grid = tk.Frame(self.content, bg='white')
+        grid.pack(pady=10)
+        stat_card(grid, 'Total Students', c['students'])
+        stat_card(grid, 'Exam Records', c['exams'])
         stat_card(grid, 'Present Today', total_present_today)
+        grid = tk.Frame(self.content, bg='white')
+        grid.pack(pady=10)
+        stat_card(grid, 'Fees Billed', f"{c['billed']:,.2f}")
+        stat_card(grid, 'Collected', f"{c['collected']:,.2f}")
+        stat_card(grid, 'Outstanding', f"{c['outstanding']:,.2f} ({c['with_dues']})")
+
+        classes = ', '.join(f'{clazz or "-"}: {n}' for clazz, n in c['classes'].items()) or '-'
+        tk.Label(self.content, text=f'Students per class: {classes}', bg='white', wraplength=700, justify='left').pack(pady=8)
+        tk.Button(self.content, text='Rebuild counters', command=self.rebuild_counters).pack(pady=4)
+
+    def rebuild_counters(self):
+        drift = db.counters.check()
+        if drift:
+            messagebox.showwarning('Counters', 'Corrected:\n' + '\n'.join(f'{k}: {kept} -> {actual}' for k, kept, actual in drift))
+        else:
+            messagebox.showinfo('Counters', 'All counters match the stored data')
+        self.show_dashboard()
 
     # ---------- Students (Admin full / Teacher readonly) ----------
     def _students_table(self, parent, with_actions=True):
         cols = ('id', 'roll', 'name', 'clazz', 'contact')
-        tree = ttk.Treeview(parent, columns=cols, show='headings', height=15)
-        for c in cols:
-            tree.heading(c, text=c.capitalize())
-            tree.column(c, width=130 if c != 'name' else 220)
-        tree.pack(fill='both', expand=True, pady=10)
-        self.refresh_students_table(tree)
+        table = VirtualTable(parent, cols, key=lambda s: s['id'], row=lambda s: tuple(s[c] for c in cols),
+                             widths={'name': 220}, bg='white')
+        table.pack(fill='both', expand=True, pady=10)
+        self.student_table = table
+        self.refresh_students_table(table)
+        self._search_bar(parent, table)
 
         if with_actions:
             btns = tk.Frame(parent, bg='white')
             btns.pack(pady=6)
             tk.Button(btns, text='Add', command=self.add_student_popup).pack(side='left', padx=6)
-            tk.Button(btns, text='Edit', command=lambda: self.edit_student_popup(tree)).pack(side='left', padx=6)
-            tk.Button(btns, text='Delete', command=lambda: self.delete_student(tree)).pack(side='left', padx=6)
-            tk.Button(btns, text='Search', command=lambda: self.search_student_popup(tree)).pack(side='left', padx=6)
-        return tree
+            tk.Button(btns, text='Edit', command=lambda: self.edit_student_popup(table)).pack(side='left', padx=6)
+            tk.Button(btns, text='Delete', command=lambda: self.delete_student(table)).pack(side='left', padx=6)
+        return table
 
-    def refresh_students_table(self, tree):
-        for i in tree.get_children():
-            tree.delete(i)
-        for s in students:
-            tree.insert('', 'end', values=(s['id'], s['roll'], s['name'], s['clazz'], s['contact']))
+    @profiling.timed('view')
+    def refresh_students_table(self, table):
+        table.set_rows(db.students)
 
+    @profiling.timed('view')
     def show_students(self):
         self.clear_content()
         tk.Label(self.content, text='Manage Students', font=('Arial', 16, 'bold'), bg='white').pack(pady=10)
         self._students_table(self.content, with_actions=True)
 
+    @profiling.timed('view')
     def show_students_readonly(self):
         self.clear_content()
         tk.Label(self.content, text='Students', font=('Arial', 16, 'bold'), bg='white').pack(pady=10)
@@ -222,15 +321,10 @@ class App:
         win.title('Add Student')
         self._student_form(win)
 
-    def edit_student_popup(self, tree):
-        sel = tree.selection()
-        if not sel:
-            messagebox.showwarning('Select', 'Please select a student to edit')
-            return
-        item = tree.item(sel[0])['values']
-        sid = item[0]
-        data = next((s for s in students if s['id'] == sid), None)
+    def edit_student_popup(self, table):
+        data = table.selected()
         if not data:
+            messagebox.showwarning('Select', 'Please select a student to edit')
             return
         win = tk.Toplevel(self.root)
         win.title('Edit Student')
@@ -250,71 +344,65 @@ class App:
             ent_roll.insert(0, data['roll']); ent_name.insert(0, data['name']); ent_class.insert(0, data['clazz']); ent_contact.insert(0, data['contact'])
 
         def save_student():
-            roll = ent_roll.get().strip(); name = ent_name.get().strip(); clazz = ent_class.get().strip(); contact = ent_contact.get().strip()
-            if not roll or not name:
-                messagebox.showerror('Validation', 'Roll No and Name are required')
+            fields = {'roll': ent_roll.get(), 'name': ent_name.get(), 'clazz': ent_class.get(), 'contact': ent_contact.get()}
+            try:
+                stu = svc.students.update(data['id'], fields) if data else svc.students.add(fields)
+            except RecordError as e:
+                messagebox.showerror(e.title, str(e))
                 return
-            # unique roll
-            if data:
-                # editing
-                for s in students:
-                    if s['roll'] == roll and s['id'] != data['id']:
-                        messagebox.showerror('Duplicate', 'Roll No already exists')
-                        return
-                data.update({'roll': roll, 'name': name, 'clazz': clazz, 'contact': contact})
-            else:
-                if any(s['roll'] == roll for s in students):
-                    messagebox.showerror('Duplicate', 'Roll No already exists')
-                    return
-                new_stu = {'id': self._student_auto_id, 'roll': roll, 'name': name, 'clazz': clazz, 'contact': contact}
-                students.append(new_stu)
-                if new_stu['id'] not in fees:
-                    fees[new_stu['id']] = {'total': 0.0, 'paid': 0.0, 'history': []}
-                self._student_auto_id += 1
-            persist_all()
+            if self.student_table.winfo_exists():
+                self.student_table.insert_row(stu)  # updates the row when it is already listed
             messagebox.showinfo('Saved', 'Student saved successfully')
             win.destroy()
-            self.show_students()
 
         tk.Button(frm, text='Save', command=save_student).grid(row=4, column=0, columnspan=2, pady=10)
 
-    def delete_student(self, tree):
-        sel = tree.selection()
-        if not sel:
+    def delete_student(self, table):
+        stu = table.selected()
+        if not stu:
             messagebox.showwarning('Select', 'Please select a student to delete')
             return
-        item = tree.item(sel[0])['values']
-        sid = item[0]
+        sid = stu['id']
         if messagebox.askyesno('Confirm', 'Delete selected student?'):
-            global students
-            students[:] = [s for s in students if s['id'] != sid]
-            # cascade delete attendance/exams/fees entries
-            keys = [k for k in list(attendance.keys()) if k[0] == sid]
-            for k in keys:
-                del attendance[k]
-            global exams
-            exams[:] = [e for e in exams if e['student_id'] != sid]
-            if sid in fees:
-                del fees[sid]
-            persist_all()
-            self.show_students()
-
-    def search_student_popup(self, tree):
-        win = tk.Toplevel(self.root)
-        win.title('Search Student')
-        tk.Label(win, text='Name or Roll contains:').pack(side='left', padx=6, pady=10)
-        ent = tk.Entry(win)
+            try:
+                svc.students.delete(sid)  # cascades to attendance / exams / fees
+            except RecordError as e:
+                messagebox.showerror(e.title, str(e))
+                return
+            table.remove_row(sid)
+
+    def _search_bar(self, parent, table):
+        bar = tk.Frame(parent, bg='white')
+        bar.pack(fill='x', padx=10, before=table)
+        tk.Label(bar, text='Search (name, roll, contact, class):', bg='white').pack(side='left', padx=6)
+        query = tk.StringVar()
+        ent = tk.Entry(bar, textvariable=query, width=30)
         ent.pack(side='left', padx=6)
+        info = tk.Label(bar, text='', bg='white', fg='gray')
+        info.pack(side='left', padx=6)
+        pending = [None]
+
         def do_search():
-            query = ent.get().lower().strip()
-            for i in tree.get_children():
-                tree.delete(i)
-            for s in students:
-                if query in s['name'].lower() or query in s['roll'].lower():
-                    tree.insert('', 'end', values=(s['id'], s['roll'], s['name'], s['clazz'], s['contact']))
-        tk.Button(win, text='Search', command=do_search).pack(side='left', padx=6)
+            pending[0] = None
+            if not query.get().strip():
+                table.set_rows(db.students)
+                info.config(text='')
+                return
+            if not db.search_index.built:
+                info.config(text='Indexing students...')
+                info.update_idletasks()
+            hits = db.search_index.search(query.get(), SEARCH_LIMIT)
+            table.set_rows(db.student_index.get(sid) for sid in hits)
+            info.config(text=f'top {len(hits)} matches' if len(hits) == SEARCH_LIMIT else f'{len(hits)} matches')
+
+        def on_key(_):
+            if pending[0]:
+                bar.after_cancel(pending[0])
+            pending[0] = bar.after(SEARCH_DELAY_MS, do_search)
+        ent.bind('<KeyRelease>', on_key)
 
     # ---------- Attendance ----------
+    @profiling.timed('view')
     def show_attendance(self):
         self.clear_content()
         tk.Label(self.content, text='Attendance', font=('Arial', 16, 'bold'), bg='white').pack(pady=10)
@@ -323,50 +411,56 @@ class App:
         tk.Label(top, text='Date (YYYY-MM-DD):', bg='white').pack(side='left', padx=6)
         self.att_date_var = tk.StringVar(value=date.today().isoformat())
         tk.Entry(top, textvariable=self.att_date_var, width=12).pack(side='left', padx=6)
+        tk.Label(top, text='Class:', bg='white').pack(side='left', padx=6)
+        self.att_class_var = tk.StringVar(value='All')
+        cb = ttk.Combobox(top, textvariable=self.att_class_var, values=['All'] + db.student_index.classes(), width=10, state='readonly')
+        cb.pack(side='left', padx=6)
+        cb.bind('<<ComboboxSelected>>', lambda e: self.refresh_attendance_list())
         tk.Button(top, text='Load', command=self.refresh_attendance_list).pack(side='left', padx=6)
         tk.Button(top, text='Save All', command=self.save_attendance_all).pack(side='left', padx=6)
 
-        self.att_list = tk.Frame(self.content, bg='white')
-        self.att_list.pack(fill='both', expand=True, pady=8)
-        self.att_vars = {}  # sid -> tk.StringVar('P'/'A')
+        bulk = tk.Frame(self.content, bg='white'); bulk.pack(pady=2)
+        tk.Button(bulk, text='All Present', command=lambda: self.att_grid.mark_all('P')).pack(side='left', padx=6)
+        tk.Button(bulk, text='All Absent', command=lambda: self.att_grid.mark_all('A')).pack(side='left', padx=6)
+        tk.Button(bulk, text='Invert', command=lambda: self.att_grid.invert()).pack(side='left', padx=6)
+        tk.Label(bulk, text='Double-click / Space toggles, P / A marks selected rows, Ctrl+A selects all',
+                 bg='white', fg='gray').pack(side='left', padx=6)
+
+        self.att_grid = AttendanceGrid(self.content, bg='white')
+        self.att_grid.pack(fill='both', expand=True, pady=8)
         self.refresh_attendance_list()
 
+    @profiling.timed('view')
     def refresh_attendance_list(self):
-        for w in self.att_list.winfo_children():
-            w.destroy()
-        self.att_vars = {}
         d = self.att_date_var.get().strip()
         if not d:
             d = date.today().isoformat()
             self.att_date_var.set(d)
-        header = tk.Frame(self.att_list, bg='white'); header.pack(fill='x')
-        tk.Label(header, text='Roll', width=10, anchor='w', bg='white', font=('Arial', 10, 'bold')).pack(side='left')
-        tk.Label(header, text='Name', width=28, anchor='w', bg='white', font=('Arial', 10, 'bold')).pack(side='left')
-        tk.Label(header, text='Status', width=12, anchor='w', bg='white', font=('Arial', 10, 'bold')).pack(side='left')
-        for s in students:
-            row = tk.Frame(self.att_list, bg='white'); row.pack(fill='x', pady=1)
-            tk.Label(row, text=s['roll'], width=10, anchor='w', bg='white').pack(side='left')
-            tk.Label(row, text=s['name'], width=28, anchor='w', bg='white').pack(side='left')
-            var = tk.StringVar(value=attendance.get((s['id'], d), 'A'))
-            self.att_vars[s['id']] = var
-            cb = ttk.Combobox(row, values=['P', 'A'], textvariable=var, width=5, state='readonly')
-            cb.pack(side='left', padx=6)
+        clazz = self.att_class_var.get()
+        try:
+            rows, status = svc.attendance.day(d, None if clazz == 'All' else clazz)
+        except RecordError as e:
+            messagebox.showerror(e.title, str(e))
+            return
+        self.att_grid.load(rows, status)
 
     def save_attendance_all(self):
-        d = self.att_date_var.get().strip()
-        for sid, var in self.att_vars.items():
-            attendance[(sid, d)] = var.get()
-        persist_all()
+        try:
+            svc.attendance.mark(self.att_date_var.get().strip(), self.att_grid.status)
+        except RecordError as e:
+            messagebox.showerror(e.title, str(e))
+            return
         messagebox.showinfo('Saved', 'Attendance saved')
 
     # ---------- Exams / Marks ----------
+    @profiling.timed('view')
     def show_exams(self):
         self.clear_content()
         tk.Label(self.content, text='Exams / Marks', font=('Arial', 16, 'bold'), bg='white').pack(pady=10)
 
         top = tk.Frame(self.content, bg='white'); top.pack(pady=6)
         tk.Label(top, text='Student:').grid(row=0, column=0, padx=4, pady=4)
-        stu_names = [f"{s['id']} - {s['name']}" for s in students]
+        stu_names = [f"{s['id']} - {s['name']}" for s in db.students]
         self.exam_stu_var = tk.StringVar()
         ttk.Combobox(top, textvariable=self.exam_stu_var, values=stu_names, width=28, state='readonly').grid(row=0, column=1, padx=4, pady=4)
         tk.Label(top, text='Subject:').grid(row=0, column=2, padx=4, pady=4)
@@ -380,10 +474,9 @@ class App:
         tk.Button(top, text='Add/Update', command=self.add_exam_record).grid(row=0, column=10, padx=6)
 
         # table
-        self.exam_table = ttk.Treeview(self.content, columns=('id', 'student_id', 'name', 'subject', 'marks', 'max', 'date'), show='headings', height=14)
-        for c, w in zip(('id', 'student_id', 'name', 'subject', 'marks', 'max', 'date'), (60, 80, 160, 120, 80, 80, 100)):
-            self.exam_table.heading(c, text=c.capitalize())
-            self.exam_table.column(c, width=w)
+        cols = ('id', 'student_id', 'name', 'subject', 'marks', 'max', 'date')
+        self.exam_table = VirtualTable(self.content, cols, key=lambda e: e['id'], row=self.exam_row, height=14,
+                                       widths=dict(zip(cols, (60, 80, 160, 120, 80, 80, 100))), bg='white')
         self.exam_table.pack(fill='both', expand=True, pady=8)
         self.refresh_exam_table()
 
@@ -392,38 +485,147 @@ class App:
         if not stu_label:
             messagebox.showerror('Select', 'Select a student')
             return
-        sid = int(stu_label.split(' - ')[0])
-        subject = self.exam_sub_var.get().strip()
+        fields = {'student_id': stu_label.split(' - ')[0], 'subject': self.exam_sub_var.get(), 'marks': self.exam_marks_var.get(),
+                  'max_marks': self.exam_max_var.get(), 'date': self.exam_date_var.get()}
         try:
-            marks = float(self.exam_marks_var.get())
-            maxm = float(self.exam_max_var.get())
-        except ValueError:
-            messagebox.showerror('Validation', 'Marks and Max must be numbers')
+            rec = svc.exams.add(fields)
+        except RecordError as e:
+            messagebox.showerror(e.title, str(e))
             return
-        dt = self.exam_date_var.get().strip() or date.today().isoformat()
-        rec = {'id': self._exam_auto_id, 'student_id': sid, 'subject': subject, 'marks': marks, 'max_marks': maxm, 'date': dt}
-        exams.append(rec)
-        self._exam_auto_id += 1
-        persist_all()
-        self.refresh_exam_table()
+        self.exam_table.insert_row(rec)
         messagebox.showinfo('Saved', 'Exam record saved')
 
+    @profiling.timed('view')
     def refresh_exam_table(self):
-        for i in self.exam_table.get_children():
-            self.exam_table.delete(i)
+        self.exam_table.set_rows(db.exams)
+
+    def exam_row(self, e):
         # Show joined with name
-        id_to_name = {s['id']: s['name'] for s in students}
-        for e in exams:
-            self.exam_table.insert('', 'end', values=(e['id'], e['student_id'], id_to_name.get(e['student_id'], '?'), e['subject'], e['marks'], e['max_marks'], e['date']))
+        s = db.student_index.get(e['student_id'])
+        return (e['id'], e['student_id'], s['name'] if s else '?', e['subject'], e['marks'], e['max_marks'], e['date'])
+
+    # ---------- Report cards / class statistics ----------
+    @profiling.timed('view')
+    def show_reports(self, year=None):
+        # year: a closed academic year (see archive.py), None for the current data
+        self.clear_content()
+        self.report_year = year
+        tk.Label(self.content, text='Report Cards', font=('Arial', 16, 'bold'), bg='white').pack(pady=10)
+
+        top = tk.Frame(self.content, bg='white'); top.pack(pady=6)
+        tk.Label(top, text='Student:').grid(row=0, column=0, padx=4, pady=4)
+        stu_names = [f"{s['id']} - {s['name']}" for s in db.students]
+        self.report_stu_var = tk.StringVar()
+        ttk.Combobox(top, textvariable=self.report_stu_var, values=stu_names, width=28, state='readonly').grid(row=0, column=1, padx=4, pady=4)
+        if db.archive.years:
+            tk.Label(top, text='Year:').grid(row=0, column=2, padx=4, pady=4)
+            year_var = tk.StringVar(value=year or 'Current')
+            years = ttk.Combobox(top, textvariable=year_var, values=['Current'] + db.archive.years, width=10, state='readonly')
+            years.grid(row=0, column=3, padx=4, pady=4)
+            years.bind('<<ComboboxSelected>>', lambda _: self.show_reports(None if year_var.get() == 'Current' else year_var.get()))
+
+        self.report_info = tk.Label(self.content, text='Select a student to view the report card', bg='white', font=('Arial', 12))
+        self.report_info.pack(pady=6)
+        self.report_table = ttk.Treeview(self.content, columns=('subject', 'marks', 'max', 'percent'), show='headings', height=8)
+        for c, w in (('subject', 160), ('marks', 90), ('max', 90), ('percent', 90)):
+            self.report_table.heading(c, text=c.capitalize())
+            self.report_table.column(c, width=w)
+        self.report_table.pack(pady=6)
+        self.report_stu_var.trace_add('write', lambda *_: self.refresh_report_card())
+
+        ea = svc.exams.analytics(year)
+        subjects = ', '.join(f'{s}: {avg:.1f}%' for s, avg in sorted(ea.subject_averages().items())) or '-'
+        classes = ', '.join(f'{c}: {avg:.1f}%' for c, avg in sorted(ea.class_averages().items())) or '-'
+
+        def names(ranked):
+            return ', '.join(f"{db.student_index.get(sid)['name'] if db.student_index.get(sid) else sid} ({score:.1f}%)"
+                             for sid, score in ranked) or '-'
+        stats = tk.Frame(self.content, bg='white'); stats.pack(fill='x', padx=16, pady=8)
+        for row, (title, text) in enumerate((('Subject averages', subjects), ('Class averages', classes),
+                                             ('Top 5', names(ea.top(5))), ('Bottom 5', names(ea.bottom(5))))):
+            tk.Label(stats, text=title + ':', bg='white', font=('Arial', 10, 'bold')).grid(row=row, column=0, sticky='nw', padx=4, pady=2)
+            tk.Label(stats, text=text, bg='white', wraplength=640, justify='left').grid(row=row, column=1, sticky='w', padx=4, pady=2)
+
+    @profiling.timed('view')
+    def refresh_report_card(self):
+        self.report_table.delete(*self.report_table.get_children())
+        label = self.report_stu_var.get()
+        if not label:
+            return
+        card = svc.exams.report_card(int(label.split(' - ')[0]), self.report_year)
+        for s in card['subjects']:
+            self.report_table.insert('', 'end', values=(s['subject'], s['marks'], s['max_marks'], f"{s['percentage']:.1f}"))
+        if card['percentage'] is None:
+            self.report_info.config(text='No exam records for this student')
+            return
+        text = (f"Overall: {card['percentage']:.1f}%   Rank: {card['rank']} of {card['out_of']}   "
+                f"Percentile: {card['percentile']:.0f}")
+        if card.get('class_average') is not None:
+            text += f"   Class average: {card['class_average']:.1f}%"
+        self.report_info.config(text=text)
+
+    # ---------- Attendance defaulters ----------
+    @profiling.timed('view')
+    def show_defaulters(self):
+        self.clear_content()
+        tk.Label(self.content, text='Attendance Defaulters', font=('Arial', 16, 'bold'), bg='white').pack(pady=10)
+
+        top = tk.Frame(self.content, bg='white'); top.pack(pady=4)
+        self.def_start_var = tk.StringVar(value=date(date.today().year, 1, 1).isoformat())
+        self.def_end_var = tk.StringVar(value=date.today().isoformat())
+        self.def_threshold_var = tk.StringVar(value='75')
+        self.def_class_var = tk.StringVar(value='All')
+        for text, var, width in (('From:', self.def_start_var, 12), ('To:', self.def_end_var, 12), ('Below %:', self.def_threshold_var, 5)):
+            tk.Label(top, text=text, bg='white').pack(side='left', padx=4)
+            tk.Entry(top, textvariable=var, width=width).pack(side='left', padx=4)
+        tk.Label(top, text='Class:', bg='white').pack(side='left', padx=4)
+        ttk.Combobox(top, textvariable=self.def_class_var, values=['All'] + db.student_index.classes(), width=10,
+                     state='readonly').pack(side='left', padx=4)
+        tk.Button(top, text='Show', command=self.refresh_defaulters).pack(side='left', padx=6)
+
+        self.def_info = tk.Label(self.content, text='', bg='white', font=('Arial', 11))
+        self.def_info.pack(pady=4)
+        self.def_table = VirtualTable(self.content, ('roll', 'name', 'clazz', 'present', 'percent', 'streak'),
+                                      key=lambda r: r[0], row=self.defaulter_row,
+                                      widths={'name': 200, 'present': 90, 'percent': 80, 'streak': 80}, bg='white')
+        self.def_table.pack(fill='both', expand=True, pady=8)
+        self.refresh_defaulters()
+
+    def defaulter_row(self, r):
+        sid, percent, present, marked, streak = r
+        s = db.student_index.get(sid)
+        return (s['roll'] if s else '?', s['name'] if s else sid, s['clazz'] if s else '?',
+                f'{present}/{marked}', f'{percent:.1f}', streak)
+
+    @profiling.timed('view')
+    def refresh_defaulters(self):
+        start, end = self.def_start_var.get().strip(), self.def_end_var.get().strip()
+        if (start and day_ordinal(start) is None) or (end and day_ordinal(end) is None):
+            messagebox.showerror('Validation', 'Dates must be YYYY-MM-DD')
+            return
+        try:
+            threshold = float(self.def_threshold_var.get())
+        except ValueError:
+            messagebox.showerror('Validation', 'Threshold must be a number')
+            return
+        clazz = None if self.def_class_var.get() == 'All' else self.def_class_var.get()
+        aa = db.attendance_analytics
+        streaks = aa.absence_streaks(start, end, clazz)
+        self.def_table.set_rows((*r, streaks.get(r[0], 0)) for r in aa.defaulters(threshold, start, end, clazz))
+        summary = aa.summary(start, end, clazz, threshold)
+        rate = '-' if summary['average_rate'] is None else f"{summary['average_rate']:.1f}%"
+        self.def_info.config(text=f"{summary['days']} days marked   Average daily attendance: {rate}   "
+                                  f"{summary['defaulters']} of {summary['students']} students below {threshold:g}%")
 
     # ---------- Fees ----------
+    @profiling.timed('view')
     def show_fees(self):
         self.clear_content()
         tk.Label(self.content, text='Fees', font=('Arial', 16, 'bold'), bg='white').pack(pady=10)
 
         top = tk.Frame(self.content, bg='white'); top.pack(pady=6)
         tk.Label(top, text='Student:').grid(row=0, column=0, padx=4, pady=4)
-        stu_names = [f"{s['id']} - {s['name']}" for s in students]
+        stu_names = [f"{s['id']} - {s['name']}" for s in db.students]
         self.fee_stu_var = tk.StringVar()
         ttk.Combobox(top, textvariable=self.fee_stu_var, values=stu_names, width=28, state='readonly').grid(row=0, column=1, padx=4, pady=4)
         tk.Label(top, text='Total Fee:').grid(row=0, column=2, padx=4, pady=4)
@@ -432,15 +634,16 @@ class App:
         tk.Label(top, text='Pay Amount:').grid(row=0, column=5, padx=4, pady=4)
         self.pay_amt_var = tk.StringVar(); tk.Entry(top, textvariable=self.pay_amt_var, width=10).grid(row=0, column=6, padx=4, pady=4)
         tk.Button(top, text='Add Payment', command=self.add_payment).grid(row=0, column=7, padx=6)
+        tk.Label(top, text='Due by:').grid(row=1, column=2, padx=4, pady=4)
+        self.fee_due_var = tk.StringVar(); tk.Entry(top, textvariable=self.fee_due_var, width=10).grid(row=1, column=3, padx=4, pady=4)
 
         self.fee_info = tk.Label(self.content, text='Select a student to view fee details', bg='white', font=('Arial', 12))
         self.fee_info.pack(pady=6)
 
-        self.fee_table = ttk.Treeview(self.content, columns=('date', 'amount'), show='headings', height=12)
-        self.fee_table.heading('date', text='Date')
-        self.fee_table.heading('amount', text='Amount')
-        self.fee_table.column('date', width=120)
-        self.fee_table.column('amount', width=120)
+        # statement lines are (position, {date, amount, paid, balance})
+        self.fee_table = VirtualTable(self.content, ('date', 'amount', 'paid', 'balance'), key=lambda r: r[0],
+                                      row=lambda r: (r[1]['date'], r[1]['amount'], f"{r[1]['paid']:,.2f}", f"{r[1]['balance']:,.2f}"),
+                                      widths={'date': 120, 'amount': 120, 'paid': 120, 'balance': 120}, height=12, bg='white')
         self.fee_table.pack(pady=6)
 
         # Update fee panel when student selection changes
@@ -453,15 +656,11 @@ class App:
         if not label:
             messagebox.showerror('Select', 'Select a student')
             return
-        sid = int(label.split(' - ')[0])
         try:
-            total = float(self.total_fee_var.get())
-        except ValueError:
-            messagebox.showerror('Validation', 'Total must be a number')
+            svc.fees.set_total(int(label.split(' - ')[0]), self.total_fee_var.get(), self.fee_due_var.get())
+        except RecordError as e:
+            messagebox.showerror(e.title, str(e))
             return
-        acc = fees.setdefault(sid, {'total': 0.0, 'paid': 0.0, 'history': []})
-        acc['total'] = total
-        persist_all()
         self.refresh_fee_view()
         messagebox.showinfo('Saved', 'Total fee set')
 
@@ -470,44 +669,240 @@ class App:
         if not label:
             messagebox.showerror('Select', 'Select a student')
             return
-        sid = int(label.split(' - ')[0])
         try:
-            amt = float(self.pay_amt_var.get())
-        except ValueError:
-            messagebox.showerror('Validation', 'Amount must be a number')
+            svc.fees.pay(int(label.split(' - ')[0]), self.pay_amt_var.get())
+        except RecordError as e:
+            messagebox.showerror(e.title, str(e))
             return
-        acc = fees.setdefault(sid, {'total': 0.0, 'paid': 0.0, 'history': []})
-        acc['paid'] += amt
-        acc['history'].append({'date': date.today().isoformat(), 'amount': amt})
-        persist_all()
         self.refresh_fee_view()
         messagebox.showinfo('Saved', 'Payment added')
 
+    @profiling.timed('view')
     def refresh_fee_view(self):
-        # clear table
-        for i in self.fee_table.get_children():
-            self.fee_table.delete(i)
         label = self.fee_stu_var.get()
         if not label:
+            self.fee_table.set_rows([])
             self.fee_info.config(text='Select a student to view fee details')
             return
         sid = int(label.split(' - ')[0])
-        acc = fees.setdefault(sid, {'total': 0.0, 'paid': 0.0, 'history': []})
-        bal = acc['total'] - acc['paid']
-        self.fee_info.config(text=f"Total: {acc['total']}   Paid: {acc['paid']}   Balance: {bal}")
-        for h in acc['history']:
-            self.fee_table.insert('', 'end', values=(h['date'], h['amount']))
+        acc = svc.fees.account(sid)
+        text = f"Total: {acc['total']}   Paid: {acc['paid']}   Balance: {svc.fees.balance(sid)}"
+        if acc.get('due'):
+            text += f"   Due by: {acc['due']}"
+        self.fee_info.config(text=text)
+        self.fee_due_var.set(acc.get('due') or '')
+        self.fee_table.set_rows(enumerate(svc.fees.statement(sid)))
+
+    # ---------- Fee ledger: class fees, outstanding / overdue, daily collections ----------
+    @profiling.timed('view')
+    def show_fee_reports(self):
+        self.clear_content()
+        tk.Label(self.content, text='Fee Reports', font=('Arial', 16, 'bold'), bg='white').pack(pady=10)
+        classes = db.student_index.classes()
+
+        top = tk.Frame(self.content, bg='white'); top.pack(pady=4)
+        self.assign_class_var = tk.StringVar(value=classes[0] if classes else '')
+        self.assign_total_var = tk.StringVar()
+        self.assign_due_var = tk.StringVar()
+        tk.Label(top, text='Class:', bg='white').pack(side='left', padx=4)
+        ttk.Combobox(top, textvariable=self.assign_class_var, values=classes, width=10, state='readonly').pack(side='left', padx=4)
+        for text, var in (('Total Fee:', self.assign_total_var), ('Due by:', self.assign_due_var)):
+            tk.Label(top, text=text, bg='white').pack(side='left', padx=4)
+            tk.Entry(top, textvariable=var, width=10).pack(side='left', padx=4)
+        tk.Button(top, text='Assign to Class', command=self.assign_class_fee).pack(side='left', padx=6)
+
+        mid = tk.Frame(self.content, bg='white'); mid.pack(pady=4)
+        self.owing_class_var = tk.StringVar(value='All')
+        self.overdue_only_var = tk.BooleanVar(value=False)
+        self.collect_start_var = tk.StringVar(value=date.today().replace(day=1).isoformat())
+        self.collect_end_var = tk.StringVar(value=date.today().isoformat())
+        tk.Label(mid, text='Owing in class:', bg='white').pack(side='left', padx=4)
+        ttk.Combobox(mid, textvariable=self.owing_class_var, values=['All'] + classes, width=10, state='readonly').pack(side='left', padx=4)
+        tk.Checkbutton(mid, text='Overdue only', variable=self.overdue_only_var, bg='white').pack(side='left', padx=4)
+        for text, var in (('Collections from:', self.collect_start_var), ('To:', self.collect_end_var)):
+            tk.Label(mid, text=text, bg='white').pack(side='left', padx=4)
+            tk.Entry(mid, textvariable=var, width=12).pack(side='left', padx=4)
+        tk.Button(mid, text='Show', command=self.refresh_fee_reports).pack(side='left', padx=6)
+
+        self.fee_report_info = tk.Label(self.content, text='', bg='white', font=('Arial', 11))
+        self.fee_report_info.pack(pady=4)
+        self.owing_table = VirtualTable(self.content, ('roll', 'name', 'clazz', 'total', 'paid', 'balance', 'due', 'late'),
+                                        key=lambda r: r[0], row=self.owing_row, height=10,
+                                        widths={'name': 180, 'clazz': 70, 'due': 100, 'late': 60}, bg='white')
+        self.owing_table.pack(fill='both', expand=True, pady=4)
+        self.collect_table = VirtualTable(self.content, ('date', 'payments', 'amount'), key=lambda r: r[0],
+                                          row=lambda r: (r[0], r[2], f'{r[1]:,.2f}'), height=6, bg='white')
+        self.collect_table.pack(fill='x', pady=4)
+        self.refresh_fee_reports()
+
+    def owing_row(self, r):
+        sid, left, total, paid, due, late = r
+        s = db.student_index.get(sid)
+        return (s['roll'] if s else '?', s['name'] if s else sid, s['clazz'] if s else '?',
+                f'{total:,.2f}', f'{paid:,.2f}', f'{left:,.2f}', due or '-', f'{late}d' if late else '')
+
+    @profiling.timed('view')
+    def refresh_fee_reports(self):
+        start, end = self.collect_start_var.get().strip(), self.collect_end_var.get().strip()
+        if (start and day_ordinal(start) is None) or (end and day_ordinal(end) is None):
+            messagebox.showerror('Validation', 'Dates must be YYYY-MM-DD')
+            return
+        clazz = None if self.owing_class_var.get() == 'All' else self.owing_class_var.get()
+        owing = db.fee_ledger.outstanding(clazz, self.overdue_only_var.get())
+        days = db.fee_ledger.collections(start, end)
+        self.owing_table.set_rows(owing)
+        self.collect_table.set_rows(days)
+        self.fee_report_info.config(
+            text=f"{len(owing)} accounts owing {sum(r[1] for r in owing):,.2f}   "
+                 f"Collected {sum(a for _, a, _ in days):,.2f} in {sum(n for _, _, n in days)} payments over {len(days)} days")
+
+    def assign_class_fee(self):
+        clazz = self.assign_class_var.get()
+        if not clazz:
+            messagebox.showerror('Select', 'Select a class')
+            return
+        try:
+            n = svc.fees.assign_class(clazz, self.assign_total_var.get(), self.assign_due_var.get())
+        except RecordError as e:
+            messagebox.showerror(e.title, str(e))
+            return
+        self.refresh_fee_reports()
+        messagebox.showinfo('Saved', f'Total fee set for {n} students in {clazz}')
+
+    # ---------- Bulk import / export ----------
+    @profiling.timed('view')
+    def show_transfer(self):
+        self.clear_content()
+        tk.Label(self.content, text='Import / Export', font=('Arial', 16, 'bold'), bg='white').pack(pady=10)
+
+        top = tk.Frame(self.content, bg='white'); top.pack(pady=6)
+        tk.Label(top, text='Data:', bg='white').pack(side='left', padx=4)
+        self.transfer_kind_var = tk.StringVar(value='students')
+        ttk.Combobox(top, textvariable=self.transfer_kind_var, values=transfer.KINDS, width=12, state='readonly').pack(side='left', padx=4)
+        tk.Button(top, text='Import...', command=self.import_data).pack(side='left', padx=6)
+        tk.Button(top, text='Export...', command=self.export_data).pack(side='left', padx=6)
+
+        cols = ', '.join(c for c in transfer.COLUMNS[self.transfer_kind_var.get()])
+        self.transfer_info = tk.Label(self.content, text=f'CSV (with header) or JSON lines. Columns: {cols}',
+                                      bg='white', font=('Arial', 11))
+        self.transfer_info.pack(pady=6)
+        self.transfer_kind_var.trace_add('write', lambda *_: self.transfer_info.config(
+            text='CSV (with header) or JSON lines. Columns: ' + ', '.join(transfer.COLUMNS[self.transfer_kind_var.get()])))
+
+        tk.Label(self.content, text='Rejected rows', bg='white', font=('Arial', 11, 'bold')).pack()
+        self.reject_table = ttk.Treeview(self.content, columns=('line', 'reason', 'row'), show='headings', height=12)
+        for c, w in (('line', 60), ('reason', 260), ('row', 420)):
+            self.reject_table.heading(c, text=c.capitalize())
+            self.reject_table.column(c, width=w)
+        self.reject_table.pack(fill='both', expand=True, pady=6)
+
+    def import_data(self):
+        kind = self.transfer_kind_var.get()
+        path = filedialog.askopenfilename(title=f'Import {kind}', filetypes=[('CSV / JSON lines', '*.csv *.jsonl *.json'), ('All files', '*')])
+        if not path:
+            return
+
+        def progress(report):
+            self.transfer_info.config(text=f'Importing... {report}')
+            self.transfer_info.update_idletasks()
+        try:
+            report = transfer.import_file(db, kind, path, progress=progress)
+        except (OSError, UnicodeDecodeError) as e:
+            messagebox.showerror('Import failed', str(e))
+            return
+        self.transfer_info.config(text=str(report))
+        self.reject_table.delete(*self.reject_table.get_children())
+        for line, reason, row in report.rejected[:1000]:
+            self.reject_table.insert('', 'end', values=(line, reason, str(row)))
+        messagebox.showinfo('Imported', str(report))
+
+    def export_data(self):
+        kind = self.transfer_kind_var.get()
+        path = filedialog.asksaveasfilename(title=f'Export {kind}', initialfile=f'{kind}.csv', defaultextension='.csv',
+                                            filetypes=[('CSV', '*.csv'), ('JSON lines', '*.jsonl')])
+        if not path:
+            return
+        try:
+            n = transfer.export_file(db, kind, path)
+        except OSError as e:
+            messagebox.showerror('Export failed', str(e))
+            return
+        messagebox.showinfo('Exported', f'{n} rows written to {path}')
+
+    # ---------- Diagnostics (SMS_PROFILE=1 / --profile) ----------
+    def show_diagnostics(self):
+        self.clear_content()
+        tk.Label(self.content, text='Diagnostics', font=('Arial', 16, 'bold'), bg='white').pack(pady=10)
+
+        top = tk.Frame(self.content, bg='white'); top.pack(pady=4)
+        tk.Button(top, text='Refresh', command=self.refresh_diagnostics).pack(side='left', padx=6)
+        tk.Button(top, text='Reset', command=lambda: (profiling.reset(), self.refresh_diagnostics())).pack(side='left', padx=6)
+        tk.Button(top, text='Save to file...', command=self.save_diagnostics).pack(side='left', padx=6)
+        tk.Button(top, text='Profile next action', command=self.arm_profile).pack(side='left', padx=6)
+        self.diag_info = tk.Label(self.content, text='', bg='white', fg='gray')
+        self.diag_info.pack()
+
+        cols = ('kind', 'name', 'count', 'total ms', 'avg ms', 'max ms', 'bytes')
+        self.diag_table = ttk.Treeview(self.content, columns=cols, show='headings', height=12)
+        for c, w in zip(cols, (80, 240, 60, 90, 80, 80, 100)):
+            self.diag_table.heading(c, text=c.capitalize())
+            self.diag_table.column(c, width=w)
+        self.diag_table.pack(fill='both', expand=True, pady=6)
+        self.diag_profile = tk.Text(self.content, height=12, font=('Courier', 9))
+        self.diag_profile.pack(fill='both', expand=True, padx=8, pady=6)
+        self.refresh_diagnostics()
+
+    def refresh_diagnostics(self):
+        self.diag_table.delete(*self.diag_table.get_children())
+        for r in profiling.rows():
+            self.diag_table.insert('', 'end', values=(r['kind'], r['name'], r['count'], f"{r['total_ms']:.1f}",
+                                                      f"{r['avg_ms']:.2f}", f"{r['max_ms']:.1f}", r['bytes'] or ''))
+        self.diag_profile.delete('1.0', 'end')
+        if profiling.last_profile:
+            label, text = profiling.last_profile
+            self.diag_profile.insert('end', f'cProfile of {label}\n{text}')
+
+    def save_diagnostics(self):
+        path = filedialog.asksaveasfilename(title='Save diagnostics', defaultextension='.json',
+                                            filetypes=[('JSON', '*.json')])
+        if path:
+            profiling.dump(path)
+            self.diag_info.config(text=f'Saved to {path}')
+
+    def arm_profile(self):
+        profiling.arm()
+        self.diag_info.config(text='The next screen refresh or change will run under cProfile; come back here to see it')
 
     # ---------- Logout ----------
     def logout(self):
         if messagebox.askyesno('Logout', 'Do you really want to logout?'):
+            if not self.saved_or_confirmed('Log out'):
+                return
             try:
                 self.root.destroy()
             except Exception:
                 pass
             self.role = None
             self.username = None
+            compact_all()  # flushes pending writes first
+            db.counters.save()
             self.open_login()
 
+    def on_close(self):
+        if not self.saved_or_confirmed('Quit'):
+            return
+        db.counters.save()
+        self.root.destroy()
+
+    def saved_or_confirmed(self, action):
+        # waits for queued writes; if they are failing, the user decides whether to go on anyway
+        if flush():
+            return True
+        return messagebox.askyesno('Unsaved changes', f'Some changes could not be saved yet:\n{writer.error}\n\n'
+                                   f'{action} anyway? Changes not saved by then are lost.')
+
 if __name__ == '__main__':
+    import sys
+    if '--profile' in sys.argv[1:]:
+        profiling.enable()
     App()
@@ -0,0 +1,397 @@
+import heapq
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from datetime import date
+
+# ------------------------------
+# In-memory secondary indexes over the loaded stores
+# ------------------------------
+# The stores themselves stay plain lists/dicts (that is what gets persisted);
+# the indexes are rebuilt on load and kept in step by every add/edit/delete.
+
+def attach(db):
+    # registers the indexes on a storage.Database; each is built on first access
+    db.derive('student_index', lambda db: StudentIndex(db.students, archived_student_id(db)))  # id -> record, roll -> id, clazz -> ids
+    db.derive('exam_index', lambda db: ExamIndex(db.exams, archived_exam_id(db)))  # id -> record, student -> exam ids
+    db.derive('attendance_index', attendance_index)  # student -> sorted days, day -> present bitmap
+    db.derive('search_index', lambda db: SearchIndex(db.students))  # trigrams over name/roll/contact/class
+
+def attendance_index(db):
+    # straight from the columnar snapshot the store was loaded from, while it is unchanged since
+    data = db.attendance
+    source = db.columns('attendance')
+    return (source and AttendanceIndex.from_columns(*source)) or AttendanceIndex(data)
+
+def archived_exam_id(db):
+    # highest exam id moved to an archive (see archive.py), so new exams never reuse one
+    return db.archive.max_exam_id if 'archive' in db.derived else 0
+
+def archived_student_id(db):
+    # likewise for students: an archived year may still hold a deleted student's records
+    return db.archive.max_student_id if 'archive' in db.derived else 0
+
+class StudentIndex:
+    def __init__(self, students=(), min_id=0):
+        self.min_id = min_id  # ids up to here appear in archived years and are not reused
+        self.rebuild(students)
+
+    def rebuild(self, students):
+        self.by_id = {}     # id -> student record (the same dict that lives in `students`)
+        self.by_roll = {}   # roll -> id
+        self.by_class = {}  # clazz -> set of ids
+        self.max_id = self.min_id
+        for s in students:
+            self.add(s)
+
+    def add(self, s):
+        self.by_id[s['id']] = s
+        self.max_id = max(self.max_id, s['id'])
+        self.by_roll[s['roll']] = s['id']
+        self.by_class.setdefault(s['clazz'], set()).add(s['id'])
+
+    def remove(self, sid):
+        s = self.by_id.pop(sid, None)
+        if s is None:
+            return None
+        if self.by_roll.get(s['roll']) == sid:
+            del self.by_roll[s['roll']]
+        ids = self.by_class.get(s['clazz'])
+        if ids is not None:
+            ids.discard(sid)
+            if not ids:
+                del self.by_class[s['clazz']]
+        return s
+
+    def update(self, s, **fields):
+        # roll / clazz may change, so re-key the record rather than patching in place
+        self.remove(s['id'])
+        s.update(fields)
+        self.add(s)
+
+    def get(self, sid):
+        return self.by_id.get(sid)
+
+    def by_roll_no(self, roll):
+        sid = self.by_roll.get(roll)
+        return None if sid is None else self.by_id[sid]
+
+    def roll_taken(self, roll, exclude_id=None):
+        owner = self.by_roll.get(roll)
+        return owner is not None and owner != exclude_id
+
+    def in_class(self, clazz):
+        return [self.by_id[i] for i in sorted(self.by_class.get(clazz, ()))]
+
+    def classes(self):
+        return sorted(self.by_class)
+
+    def next_id(self):
+        return self.max_id + 1
+
+    def __len__(self):
+        return len(self.by_id)
+
+class ExamIndex:
+    def __init__(self, exams=(), min_id=0):
+        self.min_id = min_id  # ids up to here belong to archived years and are not reused
+        self.rebuild(exams)
+
+    def rebuild(self, exams):
+        self.by_id = {}       # exam id -> record
+        self.by_student = {}  # student id -> [exam ids]
+        self.max_id = self.min_id
+        for e in exams:
+            self.add(e)
+
+    def add(self, e):
+        if e['id'] in self.by_id:
+            return
+        self.by_id[e['id']] = e
+        self.by_student.setdefault(e['student_id'], []).append(e['id'])
+        self.max_id = max(self.max_id, e['id'])
+
+    def remove(self, eid):
+        e = self.by_id.pop(eid, None)
+        if e is not None:
+            ids = self.by_student[e['student_id']]
+            ids.remove(eid)
+            if not ids:
+                del self.by_student[e['student_id']]
+        return e
+
+    def remove_student(self, sid):
+        # returns the ids of the student's exam records
+        ids = self.by_student.pop(sid, [])
+        for i in ids:
+            self.by_id.pop(i, None)
+        return ids
+
+    def for_student(self, sid):
+        return [self.by_id[i] for i in self.by_student.get(sid, ())]
+
+    def next_id(self):
+        return self.max_id + 1
+
+    def __len__(self):
+        return len(self.by_id)
+
+def day_ordinal(d):
+    # strict 'YYYY-MM-DD' only: other spellings fromisoformat takes ('20240105', '2024-W01-5')
+    # would put the same day under a second store key
+    if not isinstance(d, str) or len(d) != 10 or d[4] != '-' or d[7] != '-':
+        return None
+    try:
+        return date.fromisoformat(d).toordinal()
+    except ValueError:
+        return None
+
+def bit_members(bits):
+    # ids of the set bits of a bitmap (bit k of byte i is id 8 * i + k), lowest first
+    return [i << 3 | k for i, byte in enumerate(bits) if byte for k in range(8) if byte >> k & 1]
+
+def bit_count(bits):
+    return int.from_bytes(bits, 'little').bit_count()
+
+def set_bit(bitmaps, o, sid, on):
+    # sets / clears bit sid of bitmaps[o] in place, growing (or creating) the bitmap as needed
+    byte = sid >> 3
+    bits = bitmaps.get(o)
+    if bits is None or len(bits) <= byte:
+        if not on:
+            return
+        if bits is None:
+            bits = bitmaps[o] = bytearray(byte + 1)
+        else:
+            bits.extend(bytes(byte + 1 - len(bits)))
+    if on:
+        bits[byte] |= 1 << (sid & 7)
+    else:
+        bits[byte] &= ~(1 << (sid & 7)) & 0xFF
+
+class AttendanceIndex:
+    # Built alongside the flat {(student_id, 'YYYY-MM-DD'): 'P'/'A'} store, which
+    # stays the on-disk format. Student ids double as bit positions in the per-day
+    # bitmaps, which are bytearrays updated in place.
+    def __init__(self, attendance=None):
+        self.rebuild(attendance or {})
+
+    def rebuild(self, attendance):
+        self.by_student = {}  # sid -> (array of day ordinals, sorted; bytearray of b'P'/b'A')
+        self.present = {}     # day ordinal -> bitmap of present students
+        self.marked = {}      # day ordinal -> bitmap of students with any mark that day
+        self.unparsed = {}    # sid -> {raw date string} for keys that are not ISO dates
+        # one pass over the store: each distinct date string is parsed once, marks are
+        # grouped per student, then every student's (short) list is sorted on its own
+        ords, rows = {}, {}
+        for (sid, d), status in attendance.items():
+            o = ords.get(d, -1)
+            if o == -1:
+                o = ords[d] = day_ordinal(d)
+            if o is None:
+                self.unparsed.setdefault(sid, set()).add(d)
+            else:
+                rows.setdefault(sid, []).append((o, status))
+        size = (max(rows) >> 3) + 1 if rows else 0
+        for o in set(ords.values()) - {None}:
+            self.present[o] = bytearray(size)
+            self.marked[o] = bytearray(size)
+        present, marked = self.present, self.marked
+        for sid, row in rows.items():
+            row.sort()
+            byte, bit = sid >> 3, 1 << (sid & 7)
+            for o, status in row:
+                marked[o][byte] |= bit
+                if status == 'P':
+                    present[o][byte] |= bit
+            self.by_student[sid] = (array('i', [o for o, _ in row]), bytearray(''.join(s for _, s in row).encode()))
+
+    @classmethod
+    def from_columns(cls, cols, batches=()):
+        # the same index from a columnar.AttendanceColumns file's per-day bitmaps, plus the
+        # journal batches replayed over it; None for files without them
+        parts = cols.index_parts()
+        if parts is None:
+            return None
+        idx = cls.__new__(cls)
+        idx.by_student, idx.present, idx.marked = parts
+        idx.unparsed = {}
+        for sid, d, status in cols.json('extra'):
+            idx.set(sid, d, status)
+        for ops in batches:
+            for op in ops:
+                if op[0] == 'set':
+                    idx.set(*op[1], op[2])
+                else:
+                    idx.discard(*op[1])
+        return idx
+
+    def set(self, sid, d, status):
+        o = day_ordinal(d)
+        if o is None:
+            self.unparsed.setdefault(sid, set()).add(d)
+            return
+        days, marks = self.by_student.setdefault(sid, (array('i'), bytearray()))
+        i = bisect_left(days, o)
+        if i < len(days) and days[i] == o:
+            marks[i] = ord(status)
+        else:
+            days.insert(i, o)
+            marks.insert(i, ord(status))
+        set_bit(self.marked, o, sid, True)
+        set_bit(self.present, o, sid, status == 'P')
+
+    def discard(self, sid, d):
+        o = day_ordinal(d)
+        if o is None:
+            self.unparsed.get(sid, set()).discard(d)
+            return
+        days, marks = self.by_student.get(sid, ((), b''))
+        i = bisect_left(days, o)
+        if i < len(days) and days[i] == o:
+            del days[i], marks[i]
+            if not days:
+                del self.by_student[sid]
+            set_bit(self.marked, o, sid, False)
+            set_bit(self.present, o, sid, False)
+
+    def remove_student(self, sid):
+        # returns the store keys that belonged to the student; day_ordinal only parses
+        # canonical dates, so isoformat() gives back the stored key string
+        days, _ = self.by_student.pop(sid, ((), b''))
+        keys = []
+        for o in days:
+            set_bit(self.marked, o, sid, False)
+            set_bit(self.present, o, sid, False)
+            keys.append((sid, date.fromordinal(o).isoformat()))
+        keys.extend((sid, d) for d in self.unparsed.pop(sid, ()))
+        return keys
+
+    def status(self, sid, d):
+        o = day_ordinal(d)
+        days, marks = self.by_student.get(sid, ((), b''))
+        i = bisect_left(days, o) if o is not None else len(days)
+        return chr(marks[i]) if i < len(days) and days[i] == o else None
+
+    def present_count(self, d):
+        return bit_count(self.present.get(day_ordinal(d), b''))
+
+    def marked_count(self, d):
+        return bit_count(self.marked.get(day_ordinal(d), b''))
+
+    def present_on(self, d):
+        return bit_members(self.present.get(day_ordinal(d), b''))
+
+    def history(self, sid, start=None, end=None):
+        # [(iso date, status)] for start <= date <= end, touching only that slice
+        days, marks = self.by_student.get(sid, ((), b''))
+        lo = bisect_left(days, day_ordinal(start)) if start else 0
+        hi = bisect_right(days, day_ordinal(end)) if end else len(days)
+        return [(date.fromordinal(days[i]).isoformat(), chr(marks[i])) for i in range(lo, hi)]
+
+SEARCH_FIELDS = ('name', 'roll', 'contact', 'clazz')
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+class SearchIndex:
+    # Trigram postings over name/roll/contact/class for substring search, plus a sorted
+    # token list for 1-2 character (prefix) queries. Updated per add/edit/delete.
+    # Built from `students` on the first search, so startup never pays for it.
+    def __init__(self, students=()):
+        self.source = students
+        self.built = False
+
+    def rebuild(self, students):
+        self.built = True
+        self.text = {}    # sid -> lowercased searchable text
+        self.names = {}   # sid -> lowercased name, for ranking
+        self.rolls = {}   # sid -> lowercased roll
+        self.grams = {}   # trigram -> set of sids
+        self.tokens = []  # sorted (token, sid)
+        for s in students:
+            self._add(s, self.tokens.append)
+        self.tokens.sort()
+
+    def _fields(self, s):
+        return [str(s.get(f, '')).lower() for f in SEARCH_FIELDS]
+
+    def add(self, s):
+        if not self.built:
+            return  # picked up from the source list when first built
+        self._add(s, lambda entry: insort(self.tokens, entry))
+
+    def _add(self, s, put_token):
+        sid = s['id']
+        fields = self._fields(s)
+        text = '\x00'.join(fields)
+        self.text[sid] = text
+        self.names[sid] = fields[0]
+        self.rolls[sid] = fields[1]
+        for g in trigrams(text):
+            self.grams.setdefault(g, set()).add(sid)
+        for tok in {t for f in fields for t in f.split()}:
+            put_token((tok, sid))
+
+    def remove(self, sid):
+        if not self.built:
+            return
+        text = self.text.pop(sid, None)
+        if text is None:
+            return
+        del self.names[sid], self.rolls[sid]
+        for g in trigrams(text):
+            ids = self.grams[g]
+            ids.discard(sid)
+            if not ids:
+                del self.grams[g]
+        for tok in {t for f in text.split('\x00') for t in f.split()}:
+            i = bisect_left(self.tokens, (tok, sid))
+            if i < len(self.tokens) and self.tokens[i] == (tok, sid):
+                del self.tokens[i]
+
+    def update(self, s):
+        self.remove(s['id'])
+        self.add(s)
+
+    def _prefix(self, q):
+        lo = bisect_left(self.tokens, (q,))
+        hi = bisect_left(self.tokens, (q + '\uffff',), lo)
+        return {sid for _, sid in self.tokens[lo:hi]}
+
+    def search(self, query, limit=50):
+        # -> ranked sids: exact roll, name prefix, word prefix, then any substring
+        q = query.lower().strip()
+        if not q:
+            return []
+        if not self.built:
+            self.rebuild(self.source)
+        if len(q) < 3:
+            hits = self._prefix(q)
+        else:
+            postings = sorted((self.grams.get(g, ()) for g in trigrams(q)), key=len)
+            if not postings[0]:
+                return []
+            hits = [sid for sid in set(postings[0]).intersection(*postings[1:]) if q in self.text[sid]]
+
+        tiers = ([], [], [], [])
+        for sid in hits:
+            text = self.text[sid]
+            if self.rolls[sid] == q:
+                tiers[0].append(sid)
+            elif text.startswith(q):
+                tiers[1].append(sid)
+            elif '\x00' + q in text or ' ' + q in text:
+                tiers[2].append(sid)
+            else:
+                tiers[3].append(sid)
+        out = []
+        for tier in tiers:
+            if len(out) >= limit:
+                break
+            out.extend(heapq.nsmallest(limit - len(out), tier, key=lambda sid: (self.names[sid], sid)))
+        return out
+
+    def __len__(self):
+        if not self.built:
+            self.rebuild(self.source)
+        return len(self.text)
@@ -0,0 +1,182 @@
+from bisect import bisect_left, bisect_right, insort
+from datetime import date
+
+from analytics import ordinal_range
+from indexes import day_ordinal
+from metrics import balance
+
+# ------------------------------
+# Fee ledger: payments indexed by day and by student, cached balances
+# ------------------------------
+# Built from db.fees on first use. Each account's total, paid amount and due
+# date are cached, and every payment line is indexed under its day with running
+# per-day totals, so the outstanding / overdue lists and daily collections
+# never replay account histories. Code that changes an account calls
+# account_changed() / account_removed(), which re-index only that student.
+# Collections over a range that reaches a closed academic year also read that
+# year's archived payments (see archive.py).
+
+def attach(db):
+    # registers on a storage.Database next to the indexes (see indexes.attach)
+    db.derive('fee_ledger', lambda db: FeeLedger(db))
+
+class FeeLedger:
+    def __init__(self, db):
+        self.db = db  # db.fees is only read when the ledger is first queried
+        self.built = False
+
+    def rebuild(self):
+        self.built = True
+        self.accounts = {}    # sid -> (total, paid, due day ordinal or None)
+        self.payments = {}    # sid -> [(day ordinal, amount)] as last indexed
+        self.by_day = {}      # day ordinal -> {sid: [amount, payments]}
+        self.day_totals = {}  # day ordinal -> [amount, payments]
+        self.days = []        # sorted day ordinals that have payments
+        self.archived = {}    # closed year -> {day ordinal: [amount, payments]}
+        for sid, acc in self.db.fees.items():
+            self._index(sid, acc)
+
+    def _ensure(self):
+        if not self.built:
+            self.rebuild()
+
+    def _index(self, sid, acc):
+        self.accounts[sid] = (acc['total'], acc['paid'], day_ordinal(acc.get('due')) if acc.get('due') else None)
+        lines = []
+        for h in acc['history']:
+            o = day_ordinal(h['date'])
+            if o is not None:
+                lines.append((o, h['amount']))
+                self._day(o, sid, h['amount'], 1)
+        self.payments[sid] = lines
+
+    def _unindex(self, sid):
+        for o, amount in self.payments.pop(sid, ()):
+            self._day(o, sid, amount, -1)
+        self.accounts.pop(sid, None)
+
+    def _day(self, o, sid, amount, n):
+        # n = 1 adds a payment, -1 takes it back out
+        totals = self.day_totals.get(o)
+        if totals is None:
+            totals = self.day_totals[o] = [0.0, 0]
+            self.by_day[o] = {}
+            insort(self.days, o)
+        totals[0] += n * amount
+        totals[1] += n
+        mine = self.by_day[o].setdefault(sid, [0.0, 0])
+        mine[0] += n * amount
+        mine[1] += n
+        if not mine[1]:
+            del self.by_day[o][sid]
+        if not totals[1]:
+            del self.day_totals[o], self.by_day[o]
+            del self.days[bisect_left(self.days, o)]
+
+    # ---------- mutations (no-ops until first built) ----------
+    def account_changed(self, sid, acc):
+        if self.built:
+            self._unindex(sid)
+            self._index(sid, acc)
+
+    def account_removed(self, sid):
+        if self.built:
+            self._unindex(sid)
+
+    # ---------- queries ----------
+    def balance(self, sid):
+        self._ensure()
+        total, paid, _ = self.accounts.get(sid, (0.0, 0.0, None))
+        return total - paid
+
+    def outstanding(self, clazz=None, overdue=False, as_of=None):
+        # -> [(sid, balance, total, paid, due date, days overdue)], largest balance first;
+        # overdue=True keeps only accounts whose due date is before as_of (default today)
+        self._ensure()
+        today = day_ordinal(as_of) if as_of else date.today().toordinal()
+        sids = self.db.student_index.by_class.get(clazz, ()) if clazz else self.accounts
+        rows = []
+        for sid in sids:
+            acc = self.accounts.get(sid)
+            if acc is None:
+                continue
+            total, paid, due = acc
+            left = balance(total, paid)
+            late = today - due if left > 0 and due is not None and due < today else 0
+            if left > 0 and (late or not overdue):
+                rows.append((sid, left, total, paid, date.fromordinal(due).isoformat() if due else '', late))
+        return sorted(rows, key=lambda r: (-r[1], r[0]))
+
+    def payments_on(self, d):
+        # -> [(sid, amount)] paid on that day, from the day index
+        self._ensure()
+        return sorted((sid, amount) for sid, (amount, _) in self.by_day.get(day_ordinal(d), {}).items())
+
+    def _archived_days(self, year):
+        if year not in self.archived:
+            days = {}
+            for lines in self.db.archive.store(year, 'fees').values():
+                for h in lines:
+                    o = day_ordinal(h['date'])
+                    if o is not None:
+                        totals = days.setdefault(o, [0.0, 0])
+                        totals[0] += h['amount']
+                        totals[1] += 1
+            self.archived[year] = days
+        return self.archived[year]
+
+    def collections(self, start=None, end=None):
+        # -> [(iso date, amount, payments)] per day with payments in [start, end]
+        self._ensure()
+        lo, hi = ordinal_range(start, end)
+        days = {}
+        archive = self.db.archive if 'archive' in self.db.derived else None
+        for year in archive.years_between(lo, hi) if archive else ():
+            for o, (amount, n) in self._archived_days(year).items():
+                if lo <= o <= hi:
+                    totals = days.setdefault(o, [0.0, 0])
+                    totals[0] += amount
+                    totals[1] += n
+        for o in self.days[bisect_left(self.days, lo):bisect_right(self.days, hi)]:
+            totals = days.setdefault(o, [0.0, 0])
+            totals[0] += self.day_totals[o][0]
+            totals[1] += self.day_totals[o][1]
+        return [(date.fromordinal(o).isoformat(), amount, n) for o, (amount, n) in sorted(days.items())]
+
+    def summary(self, start=None, end=None):
+        days = self.collections(start, end)
+        owing = self.outstanding()
+        return {'days': len(days), 'payments': sum(n for _, _, n in days), 'collected': sum(a for _, a, _ in days),
+                'outstanding': sum(r[1] for r in owing), 'accounts_due': len(owing),
+                'overdue': sum(1 for r in owing if r[5])}
+
+def statement(acc, history):
+    # acc: the live account; history: the student's payment lines, oldest first (FeeService.history)
+    # -> [{date, amount, paid, balance}] with the running paid amount and balance after each line
+    total, paid = acc['total'], acc['paid']
+    paid -= sum(h['amount'] for h in history)  # anything paid without a line (e.g. an imported total)
+    out = []
+    for h in history:
+        paid += h['amount']
+        out.append({'date': h['date'], 'amount': h['amount'], 'paid': paid, 'balance': total - paid})
+    return out
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    from services import open_db
+
+    ap = argparse.ArgumentParser(description='Outstanding / overdue fees and daily collections')
+    ap.add_argument('command', choices=['outstanding', 'overdue', 'collections'])
+    ap.add_argument('--clazz', help='limit to one class (outstanding / overdue)')
+    ap.add_argument('--as-of', help='YYYY-MM-DD, default today (overdue)')
+    ap.add_argument('--start', help='YYYY-MM-DD (collections)')
+    ap.add_argument('--end', help='YYYY-MM-DD (collections)')
+    args = ap.parse_args()
+    db = open_db()
+    ledger = db.fee_ledger
+    if args.command == 'collections':
+        out = {'summary': ledger.summary(args.start, args.end), 'days': ledger.collections(args.start, args.end)}
+    else:
+        out = ledger.outstanding(args.clazz, args.command == 'overdue', args.as_of)
+    print(json.dumps(out, indent=2))
@@ -0,0 +1,164 @@
+import os
+
+from storage import DATA_DIR, fingerprint, flush, load_pickle, save_pickle
+
+# ------------------------------
+# Dashboard counters
+# ------------------------------
+# Totals shown on the dashboard, counted once from the stores on first use and
+# then kept in step by the code that changes the stores (student add/delete,
+# class change, exam entry, fee total / payment, attendance marks), so the
+# dashboard never scans. save() keeps them in data/counters.pkl with a
+# fingerprint of the store files; while those files are unchanged the next
+# start reads the counters from there instead of loading the stores to count.
+# check() recounts from the stores and reports any counter that had drifted.
+COUNTERS_PATH = os.path.join(DATA_DIR, 'counters.pkl')
+COUNTED = ('students', 'exams', 'attendance', 'fees')  # the stores the counters come from
+STATE = ('students', 'by_class', 'exams', 'accounts', 'billed', 'collected', 'outstanding', 'with_dues', 'present')
+
+def attach(db):
+    # registers on a storage.Database next to the indexes (see indexes.attach)
+    db.derive('counters', lambda db: Counters(db))
+
+def balance(total, paid):
+    return max(total - paid, 0.0)
+
+class Counters:
+    def __init__(self, db):
+        self.db = db  # stores are only read when the counters are first needed
+        self.built = False
+
+    def rebuild(self):
+        self.built = True
+        # changes made in this process are on disk once flushed, so they show in the fingerprint
+        saved = load_pickle(COUNTERS_PATH, None)
+        stamp = fingerprint(COUNTED) if saved and flush() else None
+        if stamp is not None and saved.get('fingerprint') == stamp:
+            for k in STATE:
+                setattr(self, k, saved['counters'][k])
+            return
+        self.recount()
+
+    def recount(self):
+        self.built = True
+        self.students = 0
+        self.by_class = {}     # clazz -> number of students
+        self.exams = len(self.db.exams)
+        self.accounts = {}     # sid -> (total, paid) as last counted
+        self.billed = 0.0      # sum of fee totals
+        self.collected = 0.0   # sum of payments
+        self.outstanding = 0.0 # sum of unpaid balances
+        self.with_dues = 0     # accounts with a balance left
+        self.present = {}      # 'YYYY-MM-DD' -> students marked present that day
+        for s in self.db.students:
+            self._student(s['clazz'], 1)
+        for sid, acc in self.db.fees.items():
+            self._fee(sid, acc)
+        for (_, d), status in self.db.attendance.items():
+            if status == 'P':
+                self.present[d] = self.present.get(d, 0) + 1
+
+    def save(self):
+        # after the pending writes are on disk, so the fingerprint is of the data counted;
+        # nothing is saved while writes are failing, and the next start recounts
+        if not self.built or not flush():
+            return
+        stamp = fingerprint(COUNTED)
+        if stamp is not None:
+            save_pickle(COUNTERS_PATH, {'fingerprint': stamp, 'counters': {k: getattr(self, k) for k in STATE}})
+
+    def _ensure(self):
+        if not self.built:
+            self.rebuild()
+
+    def _student(self, clazz, n):
+        self.students += n
+        left = self.by_class.get(clazz, 0) + n
+        if left:
+            self.by_class[clazz] = left
+        else:
+            self.by_class.pop(clazz, None)
+
+    def _account(self, sid, sign):
+        total, paid = self.accounts.get(sid, (0.0, 0.0))
+        self.billed += sign * total
+        self.collected += sign * paid
+        self.outstanding += sign * balance(total, paid)
+        self.with_dues += sign * (balance(total, paid) > 0)
+
+    def _fee(self, sid, acc):
+        self._account(sid, -1)
+        self.accounts[sid] = (acc['total'], acc['paid'])
+        self._account(sid, 1)
+
+    # ---------- mutations (no-ops until first built) ----------
+    def student_added(self, s):
+        if self.built:
+            self._student(s['clazz'], 1)
+
+    def student_removed(self, s):
+        if self.built:
+            self._student(s['clazz'], -1)
+
+    def class_changed(self, old, new):
+        if self.built and old != new:
+            self._student(old, -1)
+            self._student(new, 1)
+
+    def exams_added(self, n=1):
+        if self.built:
+            self.exams += n
+
+    def exams_removed(self, n=1):
+        if self.built:
+            self.exams -= n
+
+    def fee_changed(self, sid, acc):
+        if self.built:
+            self._fee(sid, acc)
+
+    def fee_removed(self, sid):
+        if self.built:
+            self._account(sid, -1)
+            self.accounts.pop(sid, None)
+
+    def attendance_changed(self, d, old, new):
+        # old / new: the mark's status before and after ('P', 'A', or None when there is none)
+        if self.built and (old == 'P') != (new == 'P'):
+            n = self.present.get(d, 0) + (1 if new == 'P' else -1)
+            if n:
+                self.present[d] = n
+            else:
+                self.present.pop(d, None)
+
+    # ---------- queries ----------
+    def snapshot(self):
+        self._ensure()
+        return {'students': self.students, 'exams': self.exams, 'billed': self.billed, 'collected': self.collected,
+                'outstanding': self.outstanding, 'with_dues': self.with_dues, 'classes': dict(sorted(self.by_class.items()))}
+
+    def present_count(self, d):
+        self._ensure()
+        return self.present.get(d, 0)
+
+    def check(self):
+        # recounts from the stores; -> [(counter, maintained, actual)] for those that differed
+        before = {**self.snapshot(), 'present': dict(self.present)}
+        self.recount()
+        after = {**self.snapshot(), 'present': dict(self.present)}
+        drift = []
+        for k, actual in after.items():
+            kept = before[k]
+            if isinstance(actual, float) and abs(kept - actual) < 0.005:
+                continue  # running float sums, not a real difference
+            if kept != actual:
+                drift.append((k, kept, actual))
+        return drift
+
+if __name__ == '__main__':
+    import json
+    from services import open_db
+
+    db = open_db()
+    counters = db.counters
+    print(json.dumps(counters.snapshot(), indent=2))
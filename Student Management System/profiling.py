@@ -0,0 +1,104 @@
+import atexit
+import cProfile
+import io
+import json
+import os
+import pstats
+import threading
+import time
+from functools import wraps
+
+# ------------------------------
+# Opt-in instrumentation
+# ------------------------------
+# Off unless SMS_PROFILE=1 (or gui.py --profile). When on, store loads, derived
+# view builds, saves (with bytes written), view refreshes and mutations are
+# counted and timed. SMS_PROFILE_OUT=<file> also dumps the numbers there at exit.
+# arm() runs the next timed call under cProfile.
+enabled = bool(os.environ.get('SMS_PROFILE'))
+PROFILE_LINES = 30
+
+_lock = threading.Lock()
+stats = {}            # (kind, name) -> [count, seconds, max seconds, bytes]
+armed = None          # None, or the .prof path ('' for none) for the next timed call
+last_profile = None   # (label, pstats text) of the last captured call
+
+def enable(on=True):
+    global enabled
+    enabled = on
+
+def add(kind, name, seconds, nbytes=0):
+    if not enabled:
+        return
+    with _lock:
+        s = stats.get((kind, name))
+        if s is None:
+            s = stats[(kind, name)] = [0, 0.0, 0.0, 0]
+        s[0] += 1
+        s[1] += seconds
+        s[2] = max(s[2], seconds)
+        s[3] += nbytes or 0
+
+def timed(kind, name=None):
+    # decorator; costs one flag check per call while profiling is off
+    def wrap(fn):
+        label = name or fn.__qualname__
+        @wraps(fn)
+        def inner(*args, **kw):
+            if not enabled:
+                return fn(*args, **kw)
+            global armed
+            with _lock:
+                path, armed = armed, None
+            t0 = time.perf_counter()
+            try:
+                if path is None:
+                    return fn(*args, **kw)
+                return _capture(label, path, fn, args, kw)
+            finally:
+                add(kind, label, time.perf_counter() - t0)
+        return inner
+    return wrap
+
+def arm(path=''):
+    # cProfile the next timed call (a view refresh or a mutation); path also keeps the .prof file
+    global armed
+    with _lock:
+        armed = path
+
+def _capture(label, path, fn, args, kw):
+    global last_profile
+    prof = cProfile.Profile()
+    try:
+        return prof.runcall(fn, *args, **kw)
+    finally:
+        out = io.StringIO()
+        pstats.Stats(prof, stream=out).sort_stats('cumulative').print_stats(PROFILE_LINES)
+        last_profile = (label, out.getvalue())
+        if path:
+            prof.dump_stats(path)
+
+def rows():
+    # -> [{kind, name, count, total_ms, avg_ms, max_ms, bytes}], most total time first
+    with _lock:
+        items = [(k, list(v)) for k, v in stats.items()]
+    out = [{'kind': kind, 'name': name, 'count': n, 'total_ms': secs * 1000, 'avg_ms': secs * 1000 / n,
+            'max_ms': peak * 1000, 'bytes': nbytes} for (kind, name), (n, secs, peak, nbytes) in items]
+    return sorted(out, key=lambda r: -r['total_ms'])
+
+def reset():
+    global last_profile
+    with _lock:
+        stats.clear()
+    last_profile = None
+
+def dump(path):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'when': time.strftime('%Y-%m-%dT%H:%M:%S'), 'rows': rows(),
+                   'profile': last_profile and {'call': last_profile[0], 'stats': last_profile[1]}}, f, indent=2)
+    return path
+
+@atexit.register
+def _dump_at_exit():
+    if enabled and os.environ.get('SMS_PROFILE_OUT'):
+        dump(os.environ['SMS_PROFILE_OUT'])
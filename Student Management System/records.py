@@ -0,0 +1,127 @@
+import math
+from datetime import date
+
+from indexes import day_ordinal
+
+# ------------------------------
+# Record shapes and the validation rules shared by the forms and bulk import
+# ------------------------------
+class RecordError(Exception):
+    # `title` is what the GUI shows as the message box title
+    title = 'Error'
+
+class ValidationError(RecordError, ValueError):
+    title = 'Validation'
+
+class DuplicateError(ValidationError):
+    title = 'Duplicate'
+
+class NotFoundError(RecordError, LookupError):
+    title = 'Not found'
+
+class ConflictError(RecordError):
+    # another user changed the record first (remote backend, see server.py)
+    title = 'Conflict'
+
+class OfflineError(RecordError):
+    # the data server could not be asked for a new record id (remote backend)
+    title = 'Server not reachable'
+
+# seeded when there are no users yet (gui.py, server.py)
+DEFAULT_USERS = {
+    'admin': {'password': '1234', 'role': 'admin'},
+    'teacher': {'password': '1234', 'role': 'teacher'},
+}
+
+def new_fee_account():
+    # 'due': 'YYYY-MM-DD' the total is due by, or None
+    return {'total': 0.0, 'paid': 0.0, 'history': [], 'due': None}
+
+def _text(v):
+    return '' if v is None else str(v).strip()
+
+def _number(v, message):
+    # finite numbers only: 'nan' / 'inf' parse as floats but break every sum they reach
+    try:
+        n = float(v)
+    except (TypeError, ValueError):
+        raise ValidationError(message) from None
+    if not math.isfinite(n):
+        raise ValidationError(message)
+    return n
+
+def clean_amount(v, name):
+    n = _number(v, f'{name} must be a number')
+    if n < 0:
+        raise ValidationError(f'{name} cannot be negative')
+    return n
+
+def clean_date(v, default=None):
+    # -> 'YYYY-MM-DD'; blank means `default`
+    d = _text(v)
+    if not d:
+        return default
+    if day_ordinal(d) is None:
+        raise ValidationError('Date must be YYYY-MM-DD')
+    return d
+
+def clean_student(fields, student_index, sid=None):
+    # -> {roll, name, clazz, contact}; sid is the student being edited, if any
+    rec = {k: _text(fields.get(k)) for k in ('roll', 'name', 'clazz', 'contact')}
+    if not rec['roll'] or not rec['name']:
+        raise ValidationError('Roll No and Name are required')
+    if student_index.roll_taken(rec['roll'], sid):
+        raise DuplicateError('Roll No already exists')
+    return rec
+
+def clean_student_id(v, student_index):
+    # an imported student's own id -> int; None when blank (the next free id is given).
+    # Ids in use, or kept by an archived year (see archive.py), are refused.
+    if not _text(v):
+        return None
+    try:
+        sid = int(_text(v))
+    except ValueError:
+        raise ValidationError('id must be a number') from None
+    if sid <= 0:
+        raise ValidationError('id must be a positive number')
+    if student_index.get(sid) is not None or sid <= student_index.min_id:
+        raise DuplicateError(f'Student id {sid} is already used')
+    return sid
+
+def clean_exam(fields, student_index):
+    # -> {student_id, subject, marks, max_marks, date}
+    sid = resolve_student(fields, student_index)
+    return {'student_id': sid, 'subject': _text(fields.get('subject')),
+            'marks': _number(fields.get('marks'), 'Marks and Max must be numbers'),
+            'max_marks': _number(fields.get('max_marks'), 'Marks and Max must be numbers'),
+            'date': clean_date(fields.get('date'), date.today().isoformat())}
+
+def clean_attendance(fields, student_index):
+    # -> ((student_id, date), status)
+    sid = resolve_student(fields, student_index)
+    d = clean_date(fields.get('date'))
+    if d is None:
+        raise ValidationError('Date must be YYYY-MM-DD')
+    return (sid, d), clean_status(fields.get('status'))
+
+def clean_status(v):
+    status = _text(v).upper()
+    if status not in ('P', 'A'):
+        raise ValidationError('Status must be P or A')
+    return status
+
+def resolve_student(fields, student_index):
+    # rows may name the student by id or by roll number
+    if _text(fields.get('student_id')):
+        try:
+            sid = int(_text(fields['student_id']))
+        except ValueError:
+            raise ValidationError('student_id must be a number') from None
+        if student_index.get(sid) is None:
+            raise ValidationError(f'Unknown student id {sid}')
+        return sid
+    stu = student_index.by_roll_no(_text(fields.get('roll')))
+    if stu is None:
+        raise ValidationError('Unknown student (give student_id or roll)')
+    return stu['id']
@@ -0,0 +1,262 @@
+import hmac
+import json
+import os
+import secrets
+import threading
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import archive
+import storage
+from records import DEFAULT_USERS
+from storage import DATA_DIR, STORES, EMPTY, LIST_STORES, encode_key, decode_key, load_store, record
+
+# ------------------------------
+# Local data server: one process owns data/, GUI clients share it over HTTP
+# ------------------------------
+# Clients (SMS_BACKEND=remote, see storage.RemoteBackend) load stores from here
+# and send their changes as op batches. Every record carries a version (the
+# sequence number of its last change); an op whose expected version is not the
+# current one was based on a stale copy and is rejected instead of overwriting
+# someone else's change. Clients poll /changes to pick up each other's writes.
+#
+# Every request carries 'Authorization: Bearer <token>' (SMS_TOKEN on both sides;
+# without it the server makes one up, keeps it in data/server.token and prints
+# it). The users store is never served or written over HTTP: clients check a
+# login with POST /login instead.
+#
+#   GET  /stores/<name>               rows and non-zero versions of a store (not users)
+#   POST /stores/<name>               {client, epoch, ops, expected} -> {applied, conflicts}
+#   GET  /changes?since=N&client=ID   changes after N made by other clients
+#   POST /ids/<name>                  {count, floor} -> {epoch, first}: ids for new students / exams
+#   POST /login                       {username, password} -> {role}, role None if they do not match
+#   GET  /health
+PORT = 8765
+WORKERS = 16
+LOG_SIZE = 100000  # changes kept for /changes; a client further behind reloads
+SERVED = tuple(name for name in STORES if name != 'users')  # stores clients may read and write
+TOKEN_PATH = os.path.join(DATA_DIR, 'server.token')
+
+def server_token():
+    # SMS_TOKEN, else the one made up on first start and kept next to the data
+    token = os.environ.get('SMS_TOKEN')
+    if token:
+        return token
+    if os.path.exists(TOKEN_PATH):
+        with open(TOKEN_PATH, encoding='utf-8') as f:
+            return f.read().strip()
+    token = secrets.token_urlsafe(24)
+    fd = os.open(TOKEN_PATH, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(token + '\n')
+    return token
+
+class DataStore:
+    def __init__(self):
+        self.lock = threading.Lock()  # requests run on a pool; store updates are serialized
+        self.epoch = uuid.uuid4().hex
+        self.seq = 0
+        self.stores = {}    # name -> {key: value}; list stores are keyed by id here
+        self.versions = {name: {} for name in STORES}  # name -> {key: seq of last change}
+        self.log = deque(maxlen=LOG_SIZE)  # (seq, name, encoded op, client)
+        self.next_ids = {}  # list store -> first id not handed out yet
+        users = self._store('users')
+        if not users:
+            users.update({u: dict(v) for u, v in DEFAULT_USERS.items()})
+            record('users', [('set', u, v) for u, v in users.items()])
+
+    def _store(self, name):
+        if name not in self.stores:
+            data = load_store(name, EMPTY[name]())
+            self.stores[name] = {r['id']: r for r in data} if name in LIST_STORES else data
+        return self.stores[name]
+
+    def snapshot(self, name):
+        with self.lock:
+            store = self._store(name)
+            rows = [[encode_key(name, k), v] for k, v in store.items()]
+            versions = [[encode_key(name, k), v] for k, v in self.versions[name].items()]
+            seq = self.seq
+        # values are replaced, never mutated in place, so they can be encoded outside the lock
+        return {'epoch': self.epoch, 'seq': seq, 'rows': rows, 'versions': versions}
+
+    def apply(self, name, client, epoch, ops, expected):
+        applied, conflicts, kept = [], [], []
+        with self.lock:
+            store = self._store(name)
+            versions = self.versions[name]
+            for op, want in zip(ops, expected):
+                key = decode_key(name, op[1])
+                current = versions.get(key, 0)
+                if epoch != self.epoch or want != current:
+                    conflicts.append([op[1], current, store.get(key)])
+                    continue
+                self.seq += 1
+                versions[key] = self.seq
+                if op[0] == 'set':
+                    store[key] = op[2]
+                    kept.append(('set', key, op[2]))
+                else:
+                    store.pop(key, None)
+                    kept.append(('del', key))
+                self.log.append((self.seq, name, op, client))
+                applied.append([op[1], self.seq])
+            record(name, kept)  # queued for the writer thread in the order they were applied
+        return {'applied': applied, 'conflicts': conflicts}
+
+    def reserve(self, name, count, floor):
+        # a block of `count` unused ids; every client takes new record ids from its own blocks
+        with self.lock:
+            if name not in self.next_ids:
+                # ids kept by closed years (see archive.py) are not handed out again either
+                closed = archive.Archive(None)
+                kept = closed.max_student_id if name == 'students' else closed.max_exam_id
+                self.next_ids[name] = max(max(self._store(name), default=0), kept) + 1
+            first = max(self.next_ids[name], floor)
+            self.next_ids[name] = first + count
+        return {'epoch': self.epoch, 'first': first}
+
+    def login(self, username, password):
+        with self.lock:
+            user = self._store('users').get(username)
+        ok = user is not None and hmac.compare_digest(str(user['password']).encode(), str(password).encode())
+        return {'role': user['role'] if ok else None}
+
+    def changes(self, since, client):
+        with self.lock:
+            if self.log and since < self.log[0][0] - 1:
+                return {'epoch': self.epoch, 'seq': self.seq, 'reset': True, 'changes': []}
+            out = [[seq, name, op] for seq, name, op, who in self.log if seq > since and who != client]
+            return {'epoch': self.epoch, 'seq': self.seq, 'reset': False, 'changes': out}
+
+class Handler(BaseHTTPRequestHandler):
+    server_version = 'sms-server'
+
+    def log_message(self, fmt, *args):
+        if self.server.verbose:
+            super().log_message(fmt, *args)
+
+    def _send(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _route(self):
+        url = urlparse(self.path)
+        return url.path.strip('/').split('/'), parse_qs(url.query)
+
+    def _authorized(self):
+        given = self.headers.get('Authorization', '')
+        if hmac.compare_digest(given.encode(), f'Bearer {self.server.token}'.encode()):
+            return True
+        self._send(401, {'error': 'missing or wrong token (SMS_TOKEN)'})
+        return False
+
+    def _body(self):
+        return json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        parts, query = self._route()
+        data = self.server.data
+        if parts == ['health']:
+            self._send(200, {'epoch': data.epoch, 'seq': data.seq})
+        elif len(parts) == 2 and parts[0] == 'stores' and parts[1] in SERVED:
+            self._send(200, data.snapshot(parts[1]))
+        elif parts == ['changes']:
+            try:
+                since = int(query.get('since', ['0'])[0])
+            except ValueError:
+                return self._send(400, {'error': 'since must be a number'})
+            self._send(200, data.changes(since, query.get('client', [''])[0]))
+        else:
+            self._send(404, {'error': 'not found'})
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        parts, _ = self._route()
+        if parts == ['login']:
+            try:
+                body = self._body()
+                username, password = body['username'], body['password']
+            except (ValueError, KeyError, TypeError):
+                return self._send(400, {'error': 'expected {username, password}'})
+            return self._send(200, self.server.data.login(username, password))
+        if len(parts) == 2 and parts[0] == 'ids' and parts[1] in LIST_STORES:
+            try:
+                body = self._body()
+                count, floor = int(body['count']), int(body['floor'])
+                if not 0 < count <= 10000:
+                    raise ValueError
+            except (ValueError, KeyError, TypeError):
+                return self._send(400, {'error': 'expected {count, floor}'})
+            return self._send(200, self.server.data.reserve(parts[1], count, floor))
+        if not (len(parts) == 2 and parts[0] == 'stores' and parts[1] in SERVED):
+            return self._send(404, {'error': 'not found'})
+        try:
+            body = self._body()
+            ops, expected = body['ops'], body['expected']
+            if len(ops) != len(expected) or any(op[0] not in ('set', 'del') for op in ops):
+                raise ValueError
+        except (ValueError, KeyError, TypeError, IndexError):
+            return self._send(400, {'error': 'expected {client, epoch, ops, expected}'})
+        self._send(200, self.server.data.apply(parts[1], body.get('client'), body.get('epoch'), ops, expected))
+
+class PooledHTTPServer(HTTPServer):
+    # like ThreadingHTTPServer, but with a fixed pool instead of a thread per request
+    def __init__(self, address, handler, workers=WORKERS, verbose=False, token=None):
+        super().__init__(address, handler)
+        self.pool = ThreadPoolExecutor(workers, thread_name_prefix='sms-http')
+        self.data = DataStore()
+        self.verbose = verbose
+        self.token = token or server_token()
+
+    def process_request(self, request, client_address):
+        self.pool.submit(self._handle, request, client_address)
+
+    def _handle(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait=True)
+        storage.flush()
+
+if __name__ == '__main__':
+    import argparse
+    import signal
+    import sys
+
+    ap = argparse.ArgumentParser(description='Serve data/ to GUI clients started with SMS_BACKEND=remote')
+    ap.add_argument('--host', default='127.0.0.1',
+                    help='default: this machine only. 0.0.0.0 accepts other machines; only do that on a trusted network')
+    ap.add_argument('--port', type=int, default=PORT)
+    ap.add_argument('--workers', type=int, default=WORKERS)
+    ap.add_argument('-v', '--verbose', action='store_true', help='log every request')
+    args = ap.parse_args()
+    if storage.backend.name == 'remote':
+        ap.error('the server stores data itself: run it with SMS_BACKEND=pickle or sqlite')
+
+    httpd = PooledHTTPServer((args.host, args.port), Handler, args.workers, args.verbose)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))  # still flushes queued writes below
+    print(f'Serving data/ ({storage.backend.name}) on http://{args.host}:{args.port}  (Ctrl+C to stop)')
+    print(f'Clients need SMS_TOKEN={httpd.token}')
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
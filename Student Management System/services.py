@@ -0,0 +1,529 @@
+from datetime import date
+
+from storage import Database, apply_ops, record
+import analytics
+import archive
+import indexes
+import ledger
+import metrics
+from indexes import day_ordinal
+from profiling import timed
+from records import (RecordError, ValidationError, NotFoundError, new_fee_account, clean_student, clean_student_id,
+                     clean_exam, clean_amount, clean_date, clean_status)
+
+# ------------------------------
+# Headless services: the business rules behind the GUI
+# ------------------------------
+# Each service validates its input, updates the in-memory stores together with
+# every index / counter derived from them, and queues the write. Problems are
+# raised as records.RecordError subclasses (ValidationError, DuplicateError,
+# NotFoundError); nothing here touches Tk, so the same calls work from the
+# GUI, the command line and scripts.
+#
+# The mutations take an optional `batch` ({} from the caller): their writes are
+# then gathered there instead of queued one by one, and record_batch() queues
+# them together. Bulk imports (see transfer.py) commit once per chunk this way.
+
+def open_db():
+    # a storage.Database with the indexes, analytics, counters, fee ledger and archived years attached
+    db = Database()
+    indexes.attach(db)
+    analytics.attach(db)
+    metrics.attach(db)
+    ledger.attach(db)
+    archive.attach(db)
+    db.replay = lambda name, ops: replay(db, name, ops)
+    return db
+
+def _record(name, ops, batch=None):
+    if batch is None:
+        record(name, ops)
+        return
+    pending = batch.setdefault(name, {})
+    for op in ops:
+        pending[op[1]] = op  # a later op on the same key replaces the earlier one
+
+def record_batch(batch):
+    for name, pending in batch.items():
+        record(name, list(pending.values()))
+    batch.clear()
+
+# ---------- other clients' changes (remote backend) ----------
+# Database.sync() hands each loaded store's new ops to replay(), which applies
+# them through the same index / counter hooks as the services above, so nothing
+# is rebuilt. Views not built yet are left alone: they are built from the
+# store, these changes included, on first use.
+
+def _view(db, attr):
+    return db.__dict__.get(attr)
+
+def replay(db, name, ops):
+    if name in REPLAY:
+        REPLAY[name](db, ops)
+    else:
+        apply_ops(name, getattr(db, name), [ops])  # nothing is derived from it
+
+def _class_changed(db, sid, clazz):
+    # clazz: the student's new class, '?' once deleted
+    if _view(db, 'attendance_analytics'):
+        db.attendance_analytics.invalidate()  # per-class results are cached
+    if _view(db, 'exam_analytics'):
+        db.exam_analytics.class_changed(sid, clazz)
+    if _view(db, 'archive'):
+        db.archive.class_changed(sid, clazz)
+
+def _replay_students(db, ops):
+    index, search, counters = _view(db, 'student_index'), _view(db, 'search_index'), _view(db, 'counters')
+    by_id = index.by_id if index else {s['id']: s for s in db.students}
+    gone = set()
+    for op in ops:
+        sid, old = op[1], by_id.get(op[1])
+        if op[0] == 'set' and old is None:
+            stu = op[2]
+            db.students.append(stu)
+            if index:
+                index.add(stu)
+            else:
+                by_id[sid] = stu
+            if search:
+                search.add(stu)
+            if counters:
+                counters.student_added(stu)
+        elif op[0] == 'set':
+            stu = op[2]
+            if stu['clazz'] != old['clazz']:
+                if counters:
+                    counters.class_changed(old['clazz'], stu['clazz'])
+                _class_changed(db, sid, stu['clazz'])
+            if index:
+                index.update(old, **stu)  # the record in db.students changes in place
+            else:
+                old.update(stu)
+            if search:
+                search.update(old)
+        elif old is not None:
+            gone.add(sid)
+            if index:
+                index.remove(sid)
+            else:
+                del by_id[sid]
+            if search:
+                search.remove(sid)
+            if counters:
+                counters.student_removed(old)
+            _class_changed(db, sid, '?')  # their marks and exams follow in the other stores' ops
+    if gone:
+        db.students[:] = [s for s in db.students if s['id'] not in gone]
+
+def _replay_attendance(db, ops):
+    index, counters = _view(db, 'attendance_index'), _view(db, 'counters')
+    days = set()
+    for op in ops:
+        (sid, d), old = op[1], db.attendance.get(op[1])
+        if op[0] == 'set':
+            db.attendance[op[1]] = op[2]
+            if index:
+                index.set(sid, d, op[2])
+        else:
+            db.attendance.pop(op[1], None)
+            if index:
+                index.discard(sid, d)
+        if counters:
+            counters.attendance_changed(d, old, op[2] if op[0] == 'set' else None)
+        days.add(d)
+    if _view(db, 'attendance_analytics'):
+        db.attendance_analytics.invalidate(days)
+
+def _replay_exams(db, ops):
+    index, analytics, counters = _view(db, 'exam_index'), _view(db, 'exam_analytics'), _view(db, 'counters')
+    by_id = index.by_id if index else {e['id']: e for e in db.exams}
+    gone, students = set(), set()
+    for op in ops:
+        eid, old = op[1], by_id.get(op[1])
+        if op[0] == 'set' and old is None:
+            rec = op[2]
+            db.exams.append(rec)
+            if index:
+                index.add(rec)
+            else:
+                by_id[eid] = rec
+            if analytics:
+                analytics.add(rec)
+            if counters:
+                counters.exams_added()
+        elif op[0] == 'set':
+            # the server kept another client's exam under this id
+            if index:
+                index.remove(eid)
+            old.clear()
+            old.update(op[2])
+            if index:
+                index.add(old)
+            analytics = None
+            db.drop_derived('exam_analytics')
+        elif old is not None:
+            gone.add(eid)
+            students.add(old['student_id'])
+            if index:
+                index.remove(eid)
+            else:
+                del by_id[eid]
+            if counters:
+                counters.exams_removed()
+    if gone:
+        db.exams[:] = [e for e in db.exams if e['id'] not in gone]
+        if analytics:
+            # exams only leave with their student (see StudentService.delete)
+            left = index.by_student if index else {e['student_id'] for e in db.exams}
+            if any(sid in left for sid in students):
+                db.drop_derived('exam_analytics')
+            else:
+                for sid in students:
+                    analytics.remove_student(sid)
+
+def _replay_fees(db, ops):
+    counters, ledger = _view(db, 'counters'), _view(db, 'fee_ledger')
+    for op in ops:
+        sid = op[1]
+        if op[0] == 'set':
+            db.fees[sid] = op[2]
+            if counters:
+                counters.fee_changed(sid, op[2])
+            if ledger:
+                ledger.account_changed(sid, op[2])
+        elif db.fees.pop(sid, None) is not None:
+            if counters:
+                counters.fee_removed(sid)
+            if ledger:
+                ledger.account_removed(sid)
+
+REPLAY = {'students': _replay_students, 'attendance': _replay_attendance, 'exams': _replay_exams,
+          'fees': _replay_fees}
+
+class Services:
+    def __init__(self, db):
+        self.db = db
+        self.students = StudentService(db)
+        self.attendance = AttendanceService(db)
+        self.exams = ExamService(db)
+        self.fees = FeeService(db)
+
+def _students(db, clazz=None):
+    q = db.queries('students')
+    if q:
+        return q.find_students(clazz=clazz) if clazz else q.find_students()
+    return db.student_index.in_class(clazz) if clazz else db.students
+
+class StudentService:
+    def __init__(self, db):
+        self.db = db
+
+    def get(self, sid):
+        stu = self.db.student_index.get(sid)
+        if stu is None:
+            raise NotFoundError(f'No student with id {sid}')
+        return stu
+
+    def list(self, clazz=None):
+        return _students(self.db, clazz)
+
+    def search(self, query, limit=50):
+        return [self.db.student_index.get(sid) for sid in self.db.search_index.search(query, limit)]
+
+    @timed('mutation')
+    def add(self, fields, batch=None, keep_id=False):
+        # keep_id: use fields['id'] when given (bulk import), so records that refer to it still match
+        db = self.db
+        sid = clean_student_id(fields.get('id'), db.student_index) if keep_id else None
+        fields = clean_student(fields, db.student_index)  # checked before an id is taken
+        stu = {'id': sid or db.new_id('students', db.student_index), **fields}
+        db.students.append(stu)
+        db.student_index.add(stu)
+        db.search_index.add(stu)
+        db.counters.student_added(stu)
+        _record('students', [('set', stu['id'], stu)], batch)
+        if stu['id'] not in db.fees:
+            db.fees[stu['id']] = new_fee_account()
+            db.counters.fee_changed(stu['id'], db.fees[stu['id']])
+            db.fee_ledger.account_changed(stu['id'], db.fees[stu['id']])
+            _record('fees', [('set', stu['id'], db.fees[stu['id']])], batch)
+        return stu
+
+    @timed('mutation')
+    def update(self, sid, fields):
+        db = self.db
+        stu = self.get(sid)
+        fields = clean_student({**stu, **fields}, db.student_index, sid)
+        if fields['clazz'] != stu['clazz']:
+            db.attendance_analytics.invalidate()  # per-class results are cached
+            db.counters.class_changed(stu['clazz'], fields['clazz'])
+            db.exam_analytics.class_changed(sid, fields['clazz'])
+            db.archive.class_changed(sid, fields['clazz'])
+        db.student_index.update(stu, **fields)
+        db.search_index.update(stu)
+        record('students', [('set', sid, stu)])
+        return stu
+
+    @timed('mutation')
+    def delete(self, sid):
+        # removes the student with their attendance, exam and fee records
+        db = self.db
+        stu = self.get(sid)
+        db.student_index.remove(sid)
+        db.search_index.remove(sid)
+        db.students.remove(stu)
+        db.counters.student_removed(stu)
+        record('students', [('del', sid)])
+        keys = db.attendance_index.remove_student(sid)
+        for k in keys:
+            db.counters.attendance_changed(k[1], db.attendance.pop(k, None), None)
+        record('attendance', [('del', k) for k in keys])
+        db.attendance_analytics.invalidate()
+        exam_ids = db.exam_index.remove_student(sid)
+        if exam_ids:
+            gone = set(exam_ids)
+            db.exams[:] = [e for e in db.exams if e['id'] not in gone]
+            db.exam_analytics.remove_student(sid)
+            db.counters.exams_removed(len(exam_ids))
+            record('exams', [('del', i) for i in exam_ids])
+        db.archive.class_changed(sid, '?')  # archived exams stay, counted as no class
+        if sid in db.fees:
+            del db.fees[sid]
+            db.counters.fee_removed(sid)
+            db.fee_ledger.account_removed(sid)
+            record('fees', [('del', sid)])
+        return stu
+
+class AttendanceService:
+    def __init__(self, db):
+        self.db = db
+
+    def day(self, d, clazz=None):
+        # -> (students, {sid: status}) for the class list on that day; unmarked counts as absent
+        d = clean_date(d, date.today().isoformat())
+        rows = _students(self.db, clazz)
+        q = self.db.queries('attendance')
+        marks = q.attendance_for(day=d) if q else self.db.attendance
+        return rows, {s['id']: marks.get((s['id'], d), 'A') for s in rows}
+
+    @timed('mutation')
+    def mark(self, d, statuses, batch=None):
+        # statuses: {sid: 'P'/'A'}; only changed marks are written. -> number changed
+        db = self.db
+        d = clean_date(d)
+        if d is None:
+            raise ValidationError('Date must be YYYY-MM-DD')
+        db.archive.check_open(d)
+        statuses = {sid: clean_status(status) for sid, status in statuses.items()}
+        for sid in statuses:
+            if db.student_index.get(sid) is None:
+                raise NotFoundError(f'No student with id {sid}')
+        ops = []
+        for sid, status in statuses.items():
+            old = db.attendance.get((sid, d))
+            if old != status:
+                db.attendance[(sid, d)] = status
+                db.attendance_index.set(sid, d, status)
+                db.counters.attendance_changed(d, old, status)
+                ops.append(('set', (sid, d), status))
+        _record('attendance', ops, batch)
+        if ops:
+            db.attendance_analytics.invalidate([d])
+        return len(ops)
+
+    def history(self, sid, start=None, end=None):
+        # closed years are read from their archives only when the range reaches them
+        q = self.db.queries('attendance')
+        if q:
+            live = sorted((d, status) for (_, d), status in q.attendance_for(student_id=sid).items()
+                          if day_ordinal(d) is not None and (not start or d >= start) and (not end or d <= end))
+        else:
+            live = self.db.attendance_index.history(sid, start, end)
+        return self.db.archive.attendance_history(sid, start, end) + live
+
+class ExamService:
+    def __init__(self, db):
+        self.db = db
+
+    @timed('mutation')
+    def add(self, fields, batch=None):
+        db = self.db
+        fields = clean_exam(fields, db.student_index)
+        db.archive.check_open(fields['date'])
+        rec = {'id': db.new_id('exams', db.exam_index), **fields}
+        db.exams.append(rec)
+        db.exam_index.add(rec)
+        db.exam_analytics.add(rec)
+        db.counters.exams_added()
+        _record('exams', [('set', rec['id'], rec)], batch)
+        return rec
+
+    # year: a closed academic year (see archive.py); None is the live data
+    def for_student(self, sid, year=None):
+        if year:
+            return self.db.archive.exams_for_student(sid, year)
+        q = self.db.queries('exams')
+        return q.exams_for(sid) if q else self.db.exam_index.for_student(sid)
+
+    def analytics(self, year=None):
+        return self.db.archive.exam_analytics(year) if year else self.db.exam_analytics
+
+    def report_card(self, sid, year=None):
+        return self.analytics(year).report_card(sid)
+
+class FeeService:
+    def __init__(self, db):
+        self.db = db
+
+    def account(self, sid):
+        # a student without an account yet reads as an empty one
+        q = self.db.queries('fees')
+        return (q.fee_account(sid) if q else self.db.fees.get(sid)) or new_fee_account()
+
+    def _account(self, sid):
+        if self.db.student_index.get(sid) is None:
+            raise NotFoundError(f'No student with id {sid}')
+        return self.db.fees.setdefault(sid, new_fee_account())
+
+    def _changed(self, sid, acc):
+        self.db.counters.fee_changed(sid, acc)
+        self.db.fee_ledger.account_changed(sid, acc)
+
+    def _save(self, sid, acc, batch=None):
+        self._changed(sid, acc)
+        _record('fees', [('set', sid, acc)], batch)
+        return acc
+
+    @timed('mutation')
+    def set_total(self, sid, total, due=None, batch=None):
+        # due: 'YYYY-MM-DD' the total is due by; None (for either) keeps the current one
+        total = None if total is None else clean_amount(total, 'Total')
+        due = clean_date(due)
+        acc = self._account(sid)
+        if total is not None:
+            acc['total'] = total
+        if due:
+            acc['due'] = due
+        return self._save(sid, acc, batch)
+
+    @timed('mutation')
+    def assign_class(self, clazz, total, due=None):
+        # sets the same total (and due date) on every account in the class, saved as one batch. -> accounts changed
+        total = clean_amount(total, 'Total')
+        due = clean_date(due)
+        students = self.db.student_index.in_class(clazz)
+        if not students:
+            raise NotFoundError(f'No students in class {clazz}')
+        ops = []
+        for s in students:
+            acc = self.db.fees.setdefault(s['id'], new_fee_account())
+            acc['total'] = total
+            if due:
+                acc['due'] = due
+            self._changed(s['id'], acc)
+            ops.append(('set', s['id'], acc))
+        record('fees', ops)
+        return len(ops)
+
+    @timed('mutation')
+    def pay(self, sid, amount, d=None, batch=None):
+        amount = clean_amount(amount, 'Amount')
+        d = clean_date(d, date.today().isoformat())
+        self.db.archive.check_open(d)
+        acc = self._account(sid)
+        acc['paid'] += amount
+        acc['history'].append({'date': d, 'amount': amount})
+        return self._save(sid, acc, batch)
+
+    def history(self, sid, acc=None):
+        # payments of closed years first, then the live account's
+        return self.db.archive.fee_history(sid) + (acc or self.account(sid))['history']
+
+    def statement(self, sid):
+        # history with the running paid amount and balance after each payment
+        acc = self.account(sid)
+        return ledger.statement(acc, self.history(sid, acc))
+
+    def balance(self, sid):
+        if self.db.loaded('fees'):
+            return self.db.fee_ledger.balance(sid)
+        acc = self.account(sid)
+        return acc['total'] - acc['paid']
+
+if __name__ == '__main__':
+    import argparse
+    import json
+    import sys
+    from storage import flush, writer
+
+    ap = argparse.ArgumentParser(description='Student / attendance / exam / fee operations without the GUI')
+    sub = ap.add_subparsers(dest='command', required=True)
+    p = sub.add_parser('add-student')
+    for f in ('roll', 'name', 'clazz', 'contact'):
+        p.add_argument('--' + f, default='')
+    p = sub.add_parser('update-student')
+    p.add_argument('student_id', type=int)
+    for f in ('roll', 'name', 'clazz', 'contact'):
+        p.add_argument('--' + f)
+    p = sub.add_parser('delete-student')
+    p.add_argument('student_id', type=int)
+    p = sub.add_parser('mark')
+    p.add_argument('date')
+    p.add_argument('marks', nargs='+', metavar='SID=P|A')
+    p = sub.add_parser('add-exam')
+    p.add_argument('student_id')
+    p.add_argument('subject')
+    p.add_argument('marks')
+    p.add_argument('max_marks')
+    p.add_argument('--date', default='')
+    p = sub.add_parser('set-fee')
+    p.add_argument('student_id', type=int)
+    p.add_argument('total')
+    p.add_argument('--due')
+    p = sub.add_parser('assign-fee')
+    p.add_argument('clazz')
+    p.add_argument('total')
+    p.add_argument('--due')
+    p = sub.add_parser('pay')
+    p.add_argument('student_id', type=int)
+    p.add_argument('amount')
+    p.add_argument('--date')
+    p = sub.add_parser('show')
+    p.add_argument('student_id', type=int)
+    args = ap.parse_args()
+
+    svc = Services(open_db())
+    try:
+        if args.command == 'add-student':
+            out = svc.students.add(vars(args))
+        elif args.command == 'update-student':
+            out = svc.students.update(args.student_id, {f: getattr(args, f) for f in ('roll', 'name', 'clazz', 'contact')
+                                                         if getattr(args, f) is not None})
+        elif args.command == 'delete-student':
+            out = svc.students.delete(args.student_id)
+        elif args.command == 'mark':
+            try:
+                marks = {int(sid): status for sid, status in (m.split('=', 1) for m in args.marks)}
+            except ValueError:
+                raise ValidationError('Marks are given as SID=P or SID=A') from None
+            out = {'changed': svc.attendance.mark(args.date, marks)}
+        elif args.command == 'add-exam':
+            out = svc.exams.add(vars(args))
+        elif args.command == 'set-fee':
+            out = svc.fees.set_total(args.student_id, args.total, args.due)
+        elif args.command == 'assign-fee':
+            out = {'accounts': svc.fees.assign_class(args.clazz, args.total, args.due)}
+        elif args.command == 'pay':
+            out = svc.fees.pay(args.student_id, args.amount, args.date)
+        else:
+            out = {'student': svc.students.get(args.student_id),
+                   'fees': {**svc.fees.account(args.student_id), 'history': svc.fees.statement(args.student_id)},
+                   'report_card': svc.exams.report_card(args.student_id),
+                   'attendance': svc.attendance.history(args.student_id)}
+    except RecordError as e:
+        print(f'{e.title}: {e}', file=sys.stderr)
+        sys.exit(1)
+    if not flush():
+        print(f'Not saved: {writer.error}', file=sys.stderr)
+        sys.exit(1)
+    print(json.dumps(out, indent=2, default=str))
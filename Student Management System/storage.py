@@ -0,0 +1,841 @@
+import atexit
+import copy
+import json
+import os
+import pickle
+import sqlite3
+import struct
+import threading
+import time
+import urllib.error
+import urllib.request
+import uuid
+import zlib
+
+import columnar
+import profiling
+from records import ConflictError, OfflineError
+
+# ------------------------------
+# Persistent storage
+# ------------------------------
+# Every store is loaded as a list/dict and changed through batches of ops:
+# ('set', key, value) / ('del', key). Two backends implement that surface:
+#   pickle - <name>.pkl snapshot + <name>.journal of changed records; startup
+#            replays snapshot + journal, a background compaction folds the
+#            journal back into the snapshot once it grows past COMPACT_BYTES.
+#            attendance / exams may use a columnar <name>.col snapshot instead
+#            (see columnar.py); it is used whenever it exists.
+#   sqlite - data/sms.db with indexes on roll, clazz, student_id and date;
+#            created from the existing .pkl files on first use. Single-student
+#            and single-day reads are answered from it until the store is loaded.
+#   remote - a replica of the stores held by server.py (SMS_SERVER, default
+#            http://127.0.0.1:8765, and its SMS_TOKEN); writes are checked against
+#            per-record versions. The users store stays on the server (see login()).
+# Pick one with SMS_BACKEND=pickle|sqlite|remote (default pickle).
+# Writes go through a background Writer thread so the UI never waits on disk.
+DATA_DIR = 'data'
+STORES = ('users', 'students', 'attendance', 'exams', 'fees')
+FILES = {name: os.path.join(DATA_DIR, f'{name}.pkl') for name in STORES}
+JOURNALS = {name: os.path.join(DATA_DIR, f'{name}.journal') for name in STORES}
+COLUMNAR = {name: os.path.join(DATA_DIR, f'{name}.col') for name in ('attendance', 'exams')}
+SQLITE_PATH = os.path.join(DATA_DIR, 'sms.db')
+EMPTY = {'users': dict, 'students': list, 'attendance': dict, 'exams': list, 'fees': dict}
+
+# list stores hold dicts keyed by their 'id' field, the others are plain dicts
+LIST_STORES = {'students', 'exams'}
+
+COMPACT_BYTES = 4 * 1024 * 1024
+_FRAME = struct.Struct('<II')  # payload length, crc32 of payload
+
+os.makedirs(DATA_DIR, exist_ok=True)
+
+def file_stamps(paths):
+    # (path, size, mtime) of each file, to tell whether it changed since
+    out = []
+    for p in paths:
+        try:
+            st = os.stat(p)
+            out.append((p, st.st_size, st.st_mtime_ns))
+        except FileNotFoundError:
+            out.append((p, None, None))
+    return tuple(out)
+
+def load_pickle(path, default):
+    if not os.path.exists(path):
+        return default
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except Exception:
+        return default
+
+def save_pickle(path, data):
+    # write-then-rename so a crash never leaves a half written snapshot behind
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def apply_ops(name, data, batches):
+    if name in LIST_STORES:
+        by_id = {r['id']: r for r in data}
+        for ops in batches:
+            for op in ops:
+                if op[0] == 'set':
+                    by_id[op[1]] = op[2]
+                else:
+                    by_id.pop(op[1], None)
+        data[:] = by_id.values()
+    else:
+        for ops in batches:
+            for op in ops:
+                if op[0] == 'set':
+                    data[op[1]] = op[2]
+                else:
+                    data.pop(op[1], None)
+    return data
+
+class Journal:
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.compacting = False
+        self.written = 0  # bytes appended by this process
+        self._fh = None
+
+    def read(self, limit=None):
+        # returns the decoded batches and the offset of the last intact frame;
+        # a torn or corrupt tail (crash mid-append) is simply not replayed
+        if not os.path.exists(self.path):
+            return [], 0
+        with open(self.path, 'rb') as f:
+            buf = f.read() if limit is None else f.read(limit)
+        batches, pos = [], 0
+        while pos + _FRAME.size <= len(buf):
+            length, crc = _FRAME.unpack_from(buf, pos)
+            start = pos + _FRAME.size
+            end = start + length
+            if end > len(buf) or zlib.crc32(buf[start:end]) != crc:
+                break
+            try:
+                batches.append(pickle.loads(buf[start:end]))
+            except Exception:
+                break
+            pos = end
+        return batches, pos
+
+    def open(self, good_offset):
+        with self.lock:
+            if self._fh:
+                self._fh.close()
+            self._fh = open(self.path, 'ab')
+            if self._fh.tell() > good_offset:
+                self._fh.truncate(good_offset)
+            self._fh.seek(0, os.SEEK_END)
+
+    def size(self):
+        return self._fh.tell() if self._fh else 0
+
+    def append(self, ops):
+        payload = pickle.dumps(ops, pickle.HIGHEST_PROTOCOL)
+        if self._fh is None:
+            self.open(self.read()[1])
+        with self.lock:
+            self._fh.write(_FRAME.pack(len(payload), zlib.crc32(payload)) + payload)
+            self.written += _FRAME.size + len(payload)
+            self._fh.flush()
+            os.fsync(self._fh.fileno())
+            return self._fh.tell()
+
+    def drop_head(self, offset):
+        # keep only what was appended after `offset` (entries folded into the snapshot)
+        with self.lock:
+            with open(self.path, 'rb') as f:
+                f.seek(offset)
+                tail = f.read()
+            tmp = self.path + '.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(tail)
+                f.flush()
+                os.fsync(f.fileno())
+            self._fh.close()
+            os.replace(tmp, self.path)
+            self._fh = open(self.path, 'ab')
+
+def iter_records(name, data):
+    # (key, value) pairs in the same shape the ops use
+    if name in LIST_STORES:
+        return ((r['id'], r) for r in data)
+    return data.items()
+
+# ---------- pickle backend ----------
+class PickleBackend:
+    name = 'pickle'
+
+    def __init__(self):
+        self.journals = {}
+        self.data = {}
+
+    def journal(self, name):
+        if name not in self.journals:
+            self.journals[name] = Journal(JOURNALS[name])
+        return self.journals[name]
+
+    def snapshot(self, name, default):
+        if name in COLUMNAR and os.path.exists(COLUMNAR[name]):
+            return columnar.load(name, COLUMNAR[name])
+        return load_pickle(FILES[name], default)
+
+    def load(self, name, default):
+        cols = None
+        if name in COLUMNAR and os.path.exists(COLUMNAR[name]):
+            cols = columnar.open_file(name, COLUMNAR[name])
+            data = columnar.to_store(name, cols)
+        else:
+            data = load_pickle(FILES[name], default)
+        j = self.journal(name)
+        batches, good = j.read()
+        j.open(good)
+        self.data[name] = apply_ops(name, data, batches)
+        if cols:
+            col_sources[name] = (self.data[name], cols, batches)
+        return self.data[name]
+
+    def size_hint(self, name):
+        # bytes that a load of `name` will have to read
+        return sum(os.path.getsize(p) for p in (FILES[name], JOURNALS[name], COLUMNAR.get(name, '')) if os.path.exists(p))
+
+    def fingerprint(self, names):
+        return file_stamps(p for name in names for p in (FILES[name], JOURNALS[name], COLUMNAR.get(name)) if p)
+
+    def apply(self, name, ops):
+        # -> bytes written
+        j = self.journal(name)
+        before = j.written
+        if j.append(ops) > COMPACT_BYTES and not j.compacting:
+            j.compacting = True
+            threading.Thread(target=self.compact, args=(name,), daemon=True).start()
+        return j.written - before
+
+    def compact(self, name):
+        # rebuilt from disk only, so it never races with the UI mutating live objects.
+        # If we die after the snapshot is replaced but before the journal is trimmed,
+        # replaying the old entries again is harmless: every op is an idempotent set/del.
+        j = self.journal(name)
+        t0 = time.perf_counter()
+        try:
+            with j.lock:
+                offset = j.size()
+            batches, good = j.read(offset)
+            data = apply_ops(name, self.snapshot(name, EMPTY[name]()), batches)
+            if name in COLUMNAR and os.path.exists(COLUMNAR[name]):
+                path = COLUMNAR[name]
+                columnar.save(name, path, data)
+            else:
+                path = FILES[name]
+                save_pickle(path, data)
+            j.drop_head(good)
+            profiling.add('compact', name, time.perf_counter() - t0, os.path.getsize(path))
+        finally:
+            j.compacting = False
+
+    def compact_all(self):
+        for name, j in list(self.journals.items()):
+            if j.size() and not j.compacting:
+                j.compacting = True
+                self.compact(name)
+
+# ---------- sqlite backend ----------
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (username TEXT PRIMARY KEY, password TEXT, role TEXT);
+CREATE TABLE IF NOT EXISTS students (id INTEGER PRIMARY KEY, roll TEXT, name TEXT, clazz TEXT, contact TEXT);
+CREATE INDEX IF NOT EXISTS students_roll ON students(roll);
+CREATE INDEX IF NOT EXISTS students_clazz ON students(clazz);
+CREATE TABLE IF NOT EXISTS attendance (student_id INTEGER, date TEXT, status TEXT,
+                                       PRIMARY KEY (student_id, date)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS attendance_date ON attendance(date);
+CREATE TABLE IF NOT EXISTS exams (id INTEGER PRIMARY KEY, student_id INTEGER, subject TEXT,
+                                  marks REAL, max_marks REAL, date TEXT);
+CREATE INDEX IF NOT EXISTS exams_student ON exams(student_id);
+CREATE INDEX IF NOT EXISTS exams_date ON exams(date);
+CREATE TABLE IF NOT EXISTS fees (student_id INTEGER PRIMARY KEY, total REAL, paid REAL, due TEXT);
+CREATE TABLE IF NOT EXISTS fee_payments (student_id INTEGER, seq INTEGER, date TEXT, amount REAL,
+                                         PRIMARY KEY (student_id, seq)) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS fee_payments_date ON fee_payments(date);
+"""
+
+# columns added since a table was first created: (table, column, type), added to
+# older databases when they are opened
+ADDED_COLUMNS = [('fees', 'due', 'TEXT')]
+
+STUDENT_COLS = ('id', 'roll', 'name', 'clazz', 'contact')
+EXAM_COLS = ('id', 'student_id', 'subject', 'marks', 'max_marks', 'date')
+
+class SQLiteBackend:
+    name = 'sqlite'
+
+    def __init__(self, path=SQLITE_PATH, fill=True):
+        # fill: copy the existing .pkl stores into a database that is being created
+        fresh = not os.path.exists(path)
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+        with self.conn:
+            for table, column, kind in ADDED_COLUMNS:
+                if column not in {row[1] for row in self.conn.execute(f'PRAGMA table_info({table})')}:
+                    self.conn.execute(f'ALTER TABLE {table} ADD COLUMN {column} {kind}')
+        if fill and fresh and any(os.path.exists(p) for p in FILES.values()):
+            migrate(PickleBackend(), self)
+
+    def fingerprint(self, names):
+        return file_stamps((self.path, self.path + '-wal'))
+
+    def load(self, name, default):
+        with self.lock:
+            cur = self.conn.cursor()
+            if name == 'users':
+                rows = cur.execute('SELECT username, password, role FROM users')
+                data = {u: {'password': p, 'role': r} for u, p, r in rows}
+            elif name == 'students':
+                data = [dict(zip(STUDENT_COLS, r)) for r in cur.execute('SELECT * FROM students ORDER BY id')]
+            elif name == 'attendance':
+                data = {(sid, d): st for sid, d, st in cur.execute('SELECT student_id, date, status FROM attendance')}
+            elif name == 'exams':
+                data = [dict(zip(EXAM_COLS, r)) for r in cur.execute('SELECT * FROM exams ORDER BY id')]
+            else:
+                data = {sid: {'total': t, 'paid': p, 'history': [], 'due': due}
+                        for sid, t, p, due in cur.execute('SELECT student_id, total, paid, due FROM fees')}
+                for sid, d, amt in cur.execute('SELECT student_id, date, amount FROM fee_payments ORDER BY student_id, seq'):
+                    if sid in data:
+                        data[sid]['history'].append({'date': d, 'amount': amt})
+        return data if data else default
+
+    def size_hint(self, name):
+        table = 'fee_payments' if name == 'fees' else name
+        with self.lock:
+            return self.conn.execute(f'SELECT COUNT(*) FROM {table}').fetchone()[0] * 64
+
+    def apply(self, name, ops):
+        with self.lock, self.conn:
+            cur = self.conn.cursor()
+            for op in ops:
+                if op[0] == 'set':
+                    self._put(cur, name, op[1], op[2])
+                else:
+                    self._delete(cur, name, op[1])
+
+    def _put(self, cur, name, key, v):
+        if name == 'users':
+            cur.execute('INSERT OR REPLACE INTO users VALUES (?, ?, ?)', (key, v['password'], v['role']))
+        elif name == 'students':
+            cur.execute('INSERT OR REPLACE INTO students VALUES (?, ?, ?, ?, ?)', tuple(v[c] for c in STUDENT_COLS))
+        elif name == 'attendance':
+            cur.execute('INSERT OR REPLACE INTO attendance VALUES (?, ?, ?)', (key[0], key[1], v))
+        elif name == 'exams':
+            cur.execute('INSERT OR REPLACE INTO exams VALUES (?, ?, ?, ?, ?, ?)', tuple(v[c] for c in EXAM_COLS))
+        else:
+            cur.execute('INSERT OR REPLACE INTO fees (student_id, total, paid, due) VALUES (?, ?, ?, ?)',
+                        (key, v['total'], v['paid'], v.get('due')))
+            cur.execute('DELETE FROM fee_payments WHERE student_id = ?', (key,))
+            cur.executemany('INSERT INTO fee_payments VALUES (?, ?, ?, ?)',
+                            [(key, i, h['date'], h['amount']) for i, h in enumerate(v['history'])])
+
+    def _delete(self, cur, name, key):
+        if name == 'users':
+            cur.execute('DELETE FROM users WHERE username = ?', (key,))
+        elif name == 'attendance':
+            cur.execute('DELETE FROM attendance WHERE student_id = ? AND date = ?', key)
+        elif name == 'fees':
+            cur.execute('DELETE FROM fees WHERE student_id = ?', (key,))
+            cur.execute('DELETE FROM fee_payments WHERE student_id = ?', (key,))
+        else:
+            cur.execute(f'DELETE FROM {name} WHERE id = ?', (key,))
+
+    def compact_all(self):
+        with self.lock:
+            self.conn.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+
+    # queries: answered from the indexes, nothing else is read into memory.
+    # Used through Database.queries() while the store is not loaded.
+    def find_students(self, **where):
+        cols = [c for c in where if c in STUDENT_COLS]
+        sql = 'SELECT * FROM students'
+        if cols:
+            sql += ' WHERE ' + ' AND '.join(f'{c} = ?' for c in cols)
+        with self.lock:
+            rows = self.conn.execute(sql + ' ORDER BY id', [where[c] for c in cols]).fetchall()
+        return [dict(zip(STUDENT_COLS, r)) for r in rows]
+
+    def attendance_for(self, student_id=None, day=None):
+        conds, args = [], []
+        if student_id is not None:
+            conds.append('student_id = ?'); args.append(student_id)
+        if day is not None:
+            conds.append('date = ?'); args.append(day)
+        sql = 'SELECT student_id, date, status FROM attendance'
+        if conds:
+            sql += ' WHERE ' + ' AND '.join(conds)
+        with self.lock:
+            return {(sid, d): st for sid, d, st in self.conn.execute(sql, args)}
+
+    def exams_for(self, student_id):
+        with self.lock:
+            rows = self.conn.execute('SELECT * FROM exams WHERE student_id = ? ORDER BY id', (student_id,)).fetchall()
+        return [dict(zip(EXAM_COLS, r)) for r in rows]
+
+    def fee_account(self, student_id):
+        with self.lock:
+            row = self.conn.execute('SELECT total, paid, due FROM fees WHERE student_id = ?', (student_id,)).fetchone()
+            if row is None:
+                return None
+            hist = self.conn.execute('SELECT date, amount FROM fee_payments WHERE student_id = ? ORDER BY seq',
+                                     (student_id,)).fetchall()
+        return {'total': row[0], 'paid': row[1], 'history': [{'date': d, 'amount': a} for d, a in hist], 'due': row[2]}
+
+def migrate(src, dst):
+    # one-shot copy of every store, one transaction per store
+    for name in STORES:
+        data = src.load(name, EMPTY[name]())
+        dst.apply(name, [('set', k, v) for k, v in iter_records(name, data)])
+
+# ---------- remote backend (client of server.py) ----------
+SERVER_URL = 'http://127.0.0.1:8765'
+HTTP_TIMEOUT = 30
+ID_BLOCK = 100  # new student / exam ids reserved from the server at a time
+
+def encode_key(name, key):
+    return list(key) if name == 'attendance' else key  # (sid, date) keys travel as JSON arrays
+
+def decode_key(name, key):
+    return tuple(key) if name == 'attendance' else key
+
+IN_FLIGHT = object()  # RemoteBackend.expected: based on our own write still being sent
+
+class RemoteBackend:
+    # Optimistic concurrency: every write says which version of each record it was
+    # based on, and the server rejects it if another client has written that record
+    # since. Rejected records come back with the server's value, and Database.sync()
+    # puts them (and everybody else's changes) into the local stores.
+    name = 'remote'
+
+    def __init__(self, url=None):
+        self.url = (url or os.environ.get('SMS_SERVER', SERVER_URL)).rstrip('/')
+        self.token = os.environ.get('SMS_TOKEN', '')
+        self.client = uuid.uuid4().hex
+        self.lock = threading.Lock()
+        self.epoch = None    # changes when the server restarts; all versions are void then
+        self.seq = None      # last change seen
+        self.versions = {}   # (store, key) -> version last seen
+        self.expected = {}   # (store, key) -> version a queued write is based on, or IN_FLIGHT
+        self.sending = set() # (store, key) of writes sent and not answered yet
+        self.rejected = []   # (store, op) server values for rejected writes, until the next sync
+        self.restarted = False
+        self.ids = {}        # list store -> [next id, end of block, epoch] reserved from the server
+
+    def _call(self, method, path, data=None):
+        req = urllib.request.Request(self.url + path, data=data, method=method,
+                                     headers={'Content-Type': 'application/json', 'Authorization': f'Bearer {self.token}'})
+        try:
+            with urllib.request.urlopen(req, timeout=HTTP_TIMEOUT) as resp:
+                return json.loads(resp.read())
+        except urllib.error.HTTPError as e:
+            if e.code == 401:
+                raise ConnectionError(f'Data server {self.url} refused the token: set SMS_TOKEN to the one it printed') from None
+            raise ConnectionError(f'Data server {self.url} failed: {e}') from None
+        except (urllib.error.URLError, OSError) as e:
+            raise ConnectionError(f'Data server {self.url} is not reachable: {e}') from None
+
+    def load(self, name, default):
+        r = self._call('GET', f'/stores/{name}')
+        with self.lock:
+            if self.epoch != r['epoch']:
+                # a restart between loads leaves the stores loaded earlier stale
+                self.restarted = self.epoch is not None
+                self.epoch, self.seq, self.versions = r['epoch'], r['seq'], {}
+            for key, v in r['versions']:
+                self.versions[(name, decode_key(name, key))] = v
+        rows = [(decode_key(name, k), v) for k, v in r['rows']]
+        if name in LIST_STORES:
+            return [v for _, v in rows]
+        data = default
+        data.update(rows)
+        return data
+
+    def size_hint(self, name):
+        return 0
+
+    def stamp(self, name, key):
+        # called by Writer.submit, i.e. when the change is made, not when it is sent
+        with self.lock:
+            k = (name, key)
+            if k not in self.expected:
+                # a change on top of our own write that is still on its way is based on the
+                # version that write gets, known once the server answers (see apply)
+                self.expected[k] = IN_FLIGHT if k in self.sending else self.versions.get(k, 0)
+
+    def apply(self, name, ops):
+        with self.lock:
+            keys = [(name, op[1]) for op in ops]
+            expected = [self.expected.pop(k, self.versions.get(k, 0)) for k in keys]
+            self.sending.update(keys)
+            epoch = self.epoch
+        sent = dict(zip(keys, expected))
+        body = {'client': self.client, 'epoch': epoch, 'expected': expected,
+                'ops': [[op[0], encode_key(name, op[1])] + list(op[2:]) for op in ops]}
+        data = json.dumps(body).encode()
+        try:
+            r = self._call('POST', f'/stores/{name}', data)
+        except Exception:
+            # not known to have landed: the retry, and anything queued on top, go out on the same version
+            with self.lock:
+                self.sending.difference_update(keys)
+                for k, v in sent.items():
+                    if self.expected.get(k, IN_FLIGHT) is IN_FLIGHT:
+                        self.expected[k] = v
+            raise
+        with self.lock:
+            self.sending.difference_update(keys)
+            for key, v in r['applied']:
+                k = (name, decode_key(name, key))
+                self.versions[k] = v
+                if self.expected.get(k) is IN_FLIGHT:
+                    self.expected[k] = v
+            for key, v, value in r['conflicts']:
+                key = decode_key(name, key)
+                k = (name, key)
+                self.versions[k] = v
+                if self.expected.get(k) is IN_FLIGHT:
+                    self.expected[k] = sent[k]  # built on the rejected value, so it is rejected as well
+                self.rejected.append((name, ('del', key) if value is None else ('set', key, value)))
+        if r['conflicts']:
+            raise ConflictError(f"{len(r['conflicts'])} change(s) to {name} were not saved: "
+                                'someone else changed the same records first. The latest values have been reloaded.')
+        return len(data)
+
+    def login(self, username, password):
+        # -> role, None when they do not match; the server never sends the users store out
+        data = json.dumps({'username': username, 'password': password}).encode()
+        return self._call('POST', '/login', data)['role']
+
+    def new_id(self, name, floor):
+        # ids of new students / exams come from blocks the server reserves for this client, so
+        # clients adding records at the same time never pick the same one. floor: lowest usable id
+        with self.lock:
+            block = self.ids.get(name)
+            if block and block[2] == self.epoch and max(block[0], floor) < block[1]:
+                block[0] = max(block[0], floor) + 1
+                return block[0] - 1
+        data = json.dumps({'count': ID_BLOCK, 'floor': floor}).encode()
+        try:
+            r = self._call('POST', f'/ids/{name}', data)
+        except ConnectionError as e:
+            raise OfflineError(f'No new id could be reserved: {e}') from None
+        with self.lock:
+            # a block from before a server restart is void: the new server may hand its ids out again
+            self.ids[name] = [r['first'] + 1, r['first'] + ID_BLOCK, r['epoch']]
+        return r['first']
+
+    def changes(self):
+        # -> (reset, [(store, ops)]) since the last call; reset means the server restarted
+        with self.lock:
+            since, epoch = self.seq, self.epoch
+        if epoch is None:
+            return False, []
+        r = self._call('GET', f'/changes?since={since}&client={self.client}')
+        with self.lock:
+            if r['epoch'] != self.epoch or r['reset'] or self.restarted:
+                self.epoch, self.seq, self.versions, self.expected, self.rejected = None, None, {}, {}, []
+                self.restarted = False
+                return True, []
+            # rejected writes first: anything newer for those records follows in the feed
+            batches = [(name, [op]) for name, op in self.rejected]
+            self.rejected = []
+            for seq, name, op in r['changes']:
+                op = [op[0], decode_key(name, op[1])] + op[2:]
+                self.versions[(name, op[1])] = seq
+                batches.append((name, [tuple(op)]))
+            self.seq = r['seq']
+        return False, batches
+
+    def compact_all(self):
+        pass  # the server owns the files
+
+BACKENDS = {'pickle': PickleBackend, 'sqlite': SQLiteBackend, 'remote': RemoteBackend}
+
+def open_backend(kind=None):
+    kind = kind or os.environ.get('SMS_BACKEND', 'pickle')
+    if kind not in BACKENDS:
+        raise ValueError(f'Unknown storage backend: {kind}')
+    return BACKENDS[kind]()
+
+# ---------- background writer ----------
+RETRY_SECONDS = (1, 2, 5, 10, 30)  # waits before retrying a failed write; the last one repeats
+
+class Writer:
+    # One thread owns every write to the backend. Ops queued for the same store and
+    # key are coalesced, so only the latest value of a record is written.
+    # Completed callbacks are handed back via poll(), which the UI drives with after().
+    # A write that fails stays queued (unless a newer op for the same key replaced
+    # it) and is retried with a backoff; a rejected remote write (ConflictError) is
+    # not, the server's value comes back through Database.sync().
+    def __init__(self, open_target):
+        self.open_target = open_target  # -> the backend; called on first use, not at import
+        self.cond = threading.Condition()
+        self.pending = {}    # store -> {key: op}
+        self.callbacks = []  # (ticket, callback(error))
+        self.ready = []      # (callback, error) waiting for poll()
+        self.errors = []     # failures nobody asked a callback for, one per run of failures
+        self.submitted = 0
+        self.flushed = 0
+        self.failures = 0    # failed attempts in a row; 0 once a write goes through
+        self.error = None    # why the last attempt failed, while failures > 0
+        self.hurry = False   # flush() is waiting: retry now instead of after the backoff
+        self.thread = threading.Thread(target=self._run, name='sms-writer', daemon=True)
+        self.thread.start()
+
+    def submit(self, name, ops, callback=None):
+        stamp = getattr(self.open_target(), 'stamp', None)  # remote backend: note the version each change is based on
+        with self.cond:
+            store = self.pending.setdefault(name, {})
+            for op in ops:
+                if stamp:
+                    stamp(name, op[1])
+                store.pop(op[1], None)
+                # snapshot the value now: the UI keeps mutating the live record
+                store[op[1]] = ('set', op[1], copy.deepcopy(op[2])) if op[0] == 'set' else op
+            self.submitted += 1
+            if callback:
+                self.callbacks.append((self.submitted, callback))
+            self.cond.notify_all()
+            return self.submitted
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while not self.pending:
+                    self.cond.wait()
+                batch, self.pending = self.pending, {}
+                upto = self.submitted
+            conflict, error, failed = None, None, {}
+            for name, ops in batch.items():
+                t0 = time.perf_counter()
+                try:
+                    written = self.open_target().apply(name, list(ops.values()))
+                except ConflictError as e:
+                    conflict = conflict or e
+                    written = 0
+                except Exception as e:
+                    error = error or e
+                    failed[name] = ops
+                    written = 0
+                profiling.add('save', name, time.perf_counter() - t0, written)
+            with self.cond:
+                for name, ops in failed.items():
+                    store = self.pending.setdefault(name, {})
+                    for key, op in ops.items():
+                        store.setdefault(key, op)  # an op queued since for the same key is newer
+                if failed:
+                    self.failures += 1
+                    self.error = error
+                    if self.failures == 1:
+                        self.errors.append(error)
+                    if conflict:
+                        self.errors.append(conflict)
+                else:
+                    self.failures, self.error = 0, None
+                    self.flushed = upto
+                    done = [cb for t, cb in self.callbacks if t <= upto]
+                    self.callbacks = [(t, cb) for t, cb in self.callbacks if t > upto]
+                    self.ready.extend((cb, conflict) for cb in done)
+                    if conflict and not done:
+                        self.errors.append(conflict)
+                self.cond.notify_all()
+                if failed:
+                    self.cond.wait_for(lambda: self.hurry, RETRY_SECONDS[min(self.failures, len(RETRY_SECONDS)) - 1])
+                    self.hurry = False
+
+    def busy(self):
+        with self.cond:
+            return self.flushed < self.submitted
+
+    def poll(self):
+        # -> ([(callback, error)], [errors]) collected since the last poll
+        with self.cond:
+            ready, self.ready = self.ready, []
+            errors, self.errors = self.errors, []
+        return ready, errors
+
+    def flush(self, timeout=None):
+        # -> True once everything submitted is written; False on timeout, or as soon as an
+        # attempt fails while waiting (the ops stay queued; self.error says why)
+        with self.cond:
+            failures = self.failures
+            self.hurry = True
+            self.cond.notify_all()
+            self.cond.wait_for(lambda: self.flushed >= self.submitted or self.failures > failures, timeout)
+            self.hurry = False
+            return self.flushed >= self.submitted
+
+# opened on first use, so importing storage (e.g. for `python storage.py migrate`)
+# creates no data files; other modules read it as storage.backend
+_backend = None
+_backend_lock = threading.Lock()
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            _backend = open_backend()
+        return _backend
+
+def __getattr__(name):
+    if name == 'backend':
+        return get_backend()
+    raise AttributeError(f"module 'storage' has no attribute {name!r}")
+
+writer = Writer(get_backend)
+atexit.register(writer.flush)
+
+# name -> (loaded store, the columnar file it was read from, journal batches replayed
+# over it), until the store is next changed; see Database.columns
+col_sources = {}
+
+def load_store(name, default):
+    return get_backend().load(name, default)
+
+def record(name, ops, callback=None):
+    if ops:
+        col_sources.pop(name, None)
+        return writer.submit(name, ops, callback)
+
+def flush(timeout=None):
+    return writer.flush(timeout)
+
+def compact_all():
+    writer.flush()
+    get_backend().compact_all()
+
+def fingerprint(names):
+    # -> a value that changes whenever the stored data of `names` does; None when that
+    # cannot be told (remote server), e.g. for caches of values counted from the stores
+    backend = get_backend()
+    return backend.fingerprint(names) if hasattr(backend, 'fingerprint') else None
+
+# ---------- lazily loaded stores ----------
+class Database:
+    # db.students, db.attendance, ... are loaded on first access, so each view only
+    # pays for the stores it touches. Values derived from stores (indexes) are
+    # registered with derive() and built on first access the same way.
+    def __init__(self):
+        self.derived = {}
+        self.load_times = {}     # store -> seconds spent loading it
+        self.before_load = None  # callback(name, size_hint) e.g. to show a loading indicator
+        self.after_load = None   # callback(name, seconds)
+        self.replay = None       # callback(name, ops) putting other clients' ops into a loaded store and its views
+
+    def derive(self, attr, factory):
+        self.derived[attr] = factory
+
+    def loaded(self, attr):
+        return attr in self.__dict__
+
+    def columns(self, name):
+        # -> (columnar file, journal batches) the loaded store was read from, handed out once so
+        # a view can be built from the columns; None once the store has changed or came from elsewhere
+        source = col_sources.pop(name, None)
+        if source and self.loaded(name) and source[0] is self.__dict__[name]:
+            return source[1:]
+        return None
+
+    def new_id(self, name, index):
+        # -> id for a new record of list store `name`; the remote server hands them out (see
+        # RemoteBackend.new_id), the other backends take the next one after the index's highest
+        backend = get_backend()
+        if hasattr(backend, 'new_id'):
+            return backend.new_id(name, index.min_id + 1)
+        return index.next_id()
+
+    def queries(self, name):
+        # -> the backend, when it can answer a single student's or day's records of `name`
+        # from its indexes (SQLite) and the store is not loaded here; None means read the store
+        backend = get_backend()
+        if self.loaded(name) or not hasattr(backend, 'find_students'):
+            return None
+        flush()  # so it has this process's writes
+        return backend
+
+    def drop_derived(self, *attrs):
+        # the given derived views (default: all) are rebuilt from the stores on next use
+        for attr in attrs or self.derived:
+            self.__dict__.pop(attr, None)
+
+    def __getattr__(self, attr):
+        if attr in STORES:
+            size = get_backend().size_hint(attr) if self.before_load or profiling.enabled else 0
+            if self.before_load:
+                self.before_load(attr, size)
+            t0 = time.perf_counter()
+            value = load_store(attr, EMPTY[attr]())
+            self.load_times[attr] = time.perf_counter() - t0
+            profiling.add('load', attr, self.load_times[attr], size)
+            if self.after_load:
+                self.after_load(attr, self.load_times[attr])
+        elif attr in self.__dict__.get('derived', ()):
+            t0 = time.perf_counter()
+            value = self.derived[attr](self)
+            profiling.add('build', attr, time.perf_counter() - t0)
+        else:
+            raise AttributeError(attr)
+        setattr(self, attr, value)
+        return value
+
+    def fetch_changes(self):
+        # remote backend: -> (reset, {store: ops}) other clients' changes since the last call, the
+        # last op per record only, stores in STORES order. Only talks to the server, so it can run
+        # off the GUI thread; sync() applies the result.
+        backend = get_backend()
+        if not hasattr(backend, 'changes'):
+            return False, {}
+        reset, batches = backend.changes()
+        grouped = {}
+        for name, ops in batches:
+            pending = grouped.setdefault(name, {})
+            for op in ops:
+                pending[op[1]] = op
+        return reset, {name: list(grouped[name].values()) for name in STORES if name in grouped}
+
+    def sync(self, changes=None):
+        # changes: a fetch_changes() result, fetched here when None.
+        # -> number of changes applied, -1 after a server restart (everything reloads on next use)
+        reset, grouped = changes or self.fetch_changes()
+        if reset:
+            for attr in list(STORES) + list(self.derived):
+                self.__dict__.pop(attr, None)
+            return -1
+        n = 0
+        for name, ops in grouped.items():
+            if not self.loaded(name):
+                continue  # read with the changes in it when first used
+            if self.replay:
+                self.replay(name, ops)
+            else:
+                apply_ops(name, self.__dict__[name], [ops])
+                self.drop_derived()
+            n += len(ops)
+        return n
+
+if __name__ == '__main__':
+    import argparse
+    ap = argparse.ArgumentParser(description='Student Management System storage tools')
+    ap.add_argument('command', choices=['migrate'], help='migrate: copy data/*.pkl into data/sms.db')
+    args = ap.parse_args()
+    if os.path.exists(SQLITE_PATH):
+        ap.error(f'{SQLITE_PATH} already exists')
+    migrate(PickleBackend(), SQLiteBackend(fill=False))
+    print(f'Migrated {DATA_DIR}/*.pkl into {SQLITE_PATH}')
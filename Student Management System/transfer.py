@@ -0,0 +1,208 @@
+import csv
+import json
+from datetime import date
+
+from profiling import timed
+from records import RecordError, ValidationError, clean_amount, clean_attendance, clean_date, resolve_student
+from services import StudentService, AttendanceService, ExamService, FeeService, open_db, record_batch
+
+# ------------------------------
+# Bulk import / export of students, exams, attendance and fees
+# ------------------------------
+# Files are CSV (header row) or JSON lines (.jsonl / .json / .ndjson), read and
+# written as streams. Rows are imported through the same services as the forms
+# (see services.py), with their writes committed once per chunk of rows instead
+# of once per row. Students keep the ids they were exported with (a row whose id
+# is taken is rejected), so exams, attendance and fees exported next to them
+# attach to the same students.
+KINDS = ('students', 'exams', 'attendance', 'fees')
+COLUMNS = {
+    'students': ('id', 'roll', 'name', 'clazz', 'contact'),
+    'exams': ('id', 'student_id', 'subject', 'marks', 'max_marks', 'date'),
+    'attendance': ('student_id', 'date', 'status'),
+    # one row per account with its total (and due date), then one row per payment (amount + date)
+    'fees': ('student_id', 'total', 'due', 'amount', 'date'),
+}
+CHUNK_SIZE = 5000
+
+def is_jsonl(path):
+    return path.lower().endswith(('.jsonl', '.json', '.ndjson'))
+
+def read_rows(path):
+    # yields (line number, row dict or None when the line could not be parsed)
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        if not is_jsonl(path):
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+            return
+        for n, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError:
+                row = None
+            yield n, row if isinstance(row, dict) else None
+
+class ImportReport:
+    def __init__(self, kind):
+        self.kind = kind
+        self.imported = 0
+        self.rejected = []  # (line, reason, row)
+
+    def reject(self, line, reason, row):
+        self.rejected.append((line, reason, row))
+
+    def __str__(self):
+        return f'{self.kind}: {self.imported} imported, {len(self.rejected)} rejected'
+
+def _rows(chunk, report):
+    for line, row in chunk:
+        if row is None:
+            report.reject(line, 'Malformed row', row)
+        else:
+            yield line, row
+
+def _import_students(db, chunk, report):
+    students, batch = StudentService(db), {}
+    for line, row in _rows(chunk, report):
+        try:
+            students.add(row, batch, keep_id=True)
+        except RecordError as e:
+            report.reject(line, str(e), row)
+            continue
+        report.imported += 1
+    record_batch(batch)
+
+def _import_exams(db, chunk, report):
+    exams, batch = ExamService(db), {}
+    for line, row in _rows(chunk, report):
+        try:
+            exams.add(row, batch)
+        except RecordError as e:
+            report.reject(line, str(e), row)
+            continue
+        report.imported += 1
+    record_batch(batch)
+
+def _import_attendance(db, chunk, report):
+    # rows are checked one by one, then marked a day at a time
+    by_day = {}
+    for line, row in _rows(chunk, report):
+        try:
+            (sid, d), status = clean_attendance(row, db.student_index)
+            db.archive.check_open(d)
+        except RecordError as e:
+            report.reject(line, str(e), row)
+            continue
+        by_day.setdefault(d, {})[sid] = status
+        report.imported += 1
+    attendance, batch = AttendanceService(db), {}
+    for d, statuses in by_day.items():
+        attendance.mark(d, statuses, batch)
+    record_batch(batch)
+
+def _import_fees(db, chunk, report):
+    fees, batch = FeeService(db), {}
+    for line, row in _rows(chunk, report):
+        # the whole row is checked before the account changes
+        try:
+            sid = resolve_student(row, db.student_index)
+            total, due, amount, d = ('' if row.get(k) is None else str(row[k]).strip()
+                                     for k in ('total', 'due', 'amount', 'date'))
+            if not total and not amount:
+                raise ValidationError('Give a total and/or a payment amount')
+            total = clean_amount(total, 'Total') if total else None
+            due = clean_date(due)
+            amount = clean_amount(amount, 'Amount') if amount else None
+            d = clean_date(d, date.today().isoformat())
+            if amount is not None:
+                db.archive.check_open(d)
+        except RecordError as e:
+            report.reject(line, str(e), row)
+            continue
+        if total is not None or due:
+            fees.set_total(sid, total, due, batch)
+        if amount is not None:
+            fees.pay(sid, amount, d, batch)
+        report.imported += 1
+    record_batch(batch)
+
+IMPORTERS = {'students': _import_students, 'exams': _import_exams,
+             'attendance': _import_attendance, 'fees': _import_fees}
+
+@timed('mutation', 'transfer.import_file')
+def import_file(db, kind, path, chunk_size=CHUNK_SIZE, progress=None):
+    report = ImportReport(kind)
+    chunk = []
+    for item in read_rows(path):
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            IMPORTERS[kind](db, chunk, report)
+            chunk = []
+            if progress:
+                progress(report)
+    if chunk:
+        IMPORTERS[kind](db, chunk, report)
+    return report
+
+def write_rejects(report, path):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        w = csv.writer(f)
+        w.writerow(['line', 'reason', 'row'])
+        for line, reason, row in report.rejected:
+            w.writerow([line, reason, json.dumps(row)])
+
+def _export_rows(db, kind):
+    if kind == 'students':
+        yield from ({c: s[c] for c in COLUMNS['students']} for s in db.students)
+    elif kind == 'exams':
+        yield from ({c: e[c] for c in COLUMNS['exams']} for e in db.exams)
+    elif kind == 'attendance':
+        for (sid, d), status in db.attendance.items():
+            yield {'student_id': sid, 'date': d, 'status': status}
+    else:
+        for sid, acc in db.fees.items():
+            yield {'student_id': sid, 'total': acc['total'], 'due': acc.get('due'), 'amount': None, 'date': None}
+            for h in acc['history']:
+                yield {'student_id': sid, 'total': None, 'due': None, 'amount': h['amount'], 'date': h['date']}
+
+def export_file(db, kind, path):
+    n = 0
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        if is_jsonl(path):
+            for row in _export_rows(db, kind):
+                f.write(json.dumps(row) + '\n')
+                n += 1
+        else:
+            w = csv.DictWriter(f, COLUMNS[kind])
+            w.writeheader()
+            for row in _export_rows(db, kind):
+                w.writerow(row)
+                n += 1
+    return n
+
+if __name__ == '__main__':
+    import argparse
+    from storage import flush, writer
+
+    ap = argparse.ArgumentParser(description='Bulk import / export (CSV or JSON lines)')
+    ap.add_argument('action', choices=['import', 'export'])
+    ap.add_argument('kind', choices=KINDS)
+    ap.add_argument('path')
+    ap.add_argument('--rejects', help='write rejected rows of an import to this CSV file')
+    args = ap.parse_args()
+
+    db = open_db()
+    if args.action == 'export':
+        print(f'{export_file(db, args.kind, args.path)} {args.kind} rows written to {args.path}')
+    else:
+        report = import_file(db, args.kind, args.path, progress=print)
+        if not flush():
+            raise SystemExit(f'Not saved: {writer.error}')
+        print(report)
+        for line, reason, _ in report.rejected[:20]:
+            print(f'  line {line}: {reason}')
+        if args.rejects:
+            write_rejects(report, args.rejects)
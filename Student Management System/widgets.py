@@ -0,0 +1,159 @@
+import tkinter as tk
+from tkinter import ttk
+
+# ------------------------------
+# Reusable widgets for large tables
+# ------------------------------
+PAGE_SIZE = 200
+
+class VirtualTable(tk.Frame):
+    # Treeview that only materializes rows as they are scrolled into view.
+    # Rows are records (dicts); `key` gives a record's stable id, `row` its column values
+    # and the optional `tags` its Treeview tags.
+    # After set_rows(), use insert_row / update_row / remove_row so one change costs one row.
+    def __init__(self, parent, columns, key, row, tags=None, widths=None, height=15, page_size=PAGE_SIZE, **kw):
+        super().__init__(parent, **kw)
+        self.key = key
+        self.row = row
+        self.tags = tags
+        self.page_size = page_size
+        self.keys = []     # every row key, in display order
+        self.records = {}  # key -> record
+        self.shown = 0     # rows [0, shown) exist in the Treeview
+        self.iid_key = {}  # Treeview iid -> key, for the materialized rows
+        self.tree = ttk.Treeview(self, columns=columns, show='headings', height=height)
+        for c in columns:
+            self.tree.heading(c, text=c.capitalize())
+            self.tree.column(c, width=(widths or {}).get(c, 130))
+        sb = ttk.Scrollbar(self, orient='vertical', command=self.tree.yview)
+        self.scrollbar = sb
+        self.tree.configure(yscrollcommand=self._on_scroll)
+        self.tree.pack(side='left', fill='both', expand=True)
+        sb.pack(side='right', fill='y')
+
+    def set_rows(self, records):
+        children = self.tree.get_children()
+        if children:
+            self.tree.delete(*children)
+        self.iid_key = {}
+        self.records = {self.key(r): r for r in records}
+        self.keys = list(self.records)
+        self.shown = 0
+        self._materialize(self.page_size)
+
+    def _materialize(self, upto):
+        upto = min(upto, len(self.keys))
+        for k in self.keys[self.shown:upto]:
+            r = self.records[k]
+            iid = self.tree.insert('', 'end', iid=str(k), values=self.row(r), tags=self.tags(r) if self.tags else ())
+            self.iid_key[iid] = k
+        self.shown = max(self.shown, upto)
+
+    def _on_scroll(self, first, last):
+        self.scrollbar.set(first, last)
+        # fetch the next page once the view nears the end of what is materialized
+        if float(last) > 0.9 and self.shown < len(self.keys):
+            self.after_idle(self._materialize, self.shown + self.page_size)
+
+    def insert_row(self, record):
+        k = self.key(record)
+        if k in self.records:
+            return self.update_row(record)
+        self.records[k] = record
+        self.keys.append(k)
+        if self.shown == len(self.keys) - 1:
+            self._materialize(len(self.keys))
+
+    def update_row(self, record):
+        k = self.key(record)
+        self.records[k] = record
+        if self.tree.exists(str(k)):
+            self.tree.item(str(k), values=self.row(record), tags=self.tags(record) if self.tags else ())
+
+    def remove_row(self, k):
+        if self.records.pop(k, None) is None:
+            return
+        self.keys.remove(k)
+        if self.tree.exists(str(k)):
+            self.tree.delete(str(k))
+            del self.iid_key[str(k)]
+            self.shown -= 1
+
+    def selected(self):
+        sel = self.tree.selection()
+        if not sel:
+            return None
+        return self.records.get(self.iid_key.get(sel[0]))
+
+    def __len__(self):
+        return len(self.keys)
+
+class AttendanceGrid(VirtualTable):
+    # One Treeview for the whole class list; statuses live in a plain dict, not widgets.
+    # Double-click / Space / Enter toggles, P / A mark the selection, Ctrl+A selects loaded rows.
+    COLUMNS = ('roll', 'name', 'clazz', 'status')
+
+    def __init__(self, parent, **kw):
+        self.status = {}  # student id -> 'P' / 'A'
+        super().__init__(parent, self.COLUMNS, key=lambda s: s['id'], row=self._row,
+                         tags=lambda s: (self.status.get(s['id'], 'A'),), widths={'name': 220, 'status': 80}, **kw)
+        t = self.tree
+        t.tag_configure('P', foreground='#44bd32')
+        t.tag_configure('A', foreground='#c23616')
+        t.bind('<Double-1>', self._on_double_click)
+        t.bind('<space>', lambda e: self.toggle())
+        t.bind('<Return>', lambda e: self.toggle())
+        for key, value in (('p', 'P'), ('P', 'P'), ('a', 'A'), ('A', 'A')):
+            t.bind(key, lambda e, v=value: self.mark(v))
+        t.bind('<Control-a>', self._select_all)
+
+    def _row(self, s):
+        return (s['roll'], s['name'], s['clazz'], self.status.get(s['id'], 'A'))
+
+    def load(self, students, status):
+        self.status = status
+        self.set_rows(students)
+
+    def selected_keys(self):
+        return [self.iid_key[i] for i in self.tree.selection() if i in self.iid_key]
+
+    def _redraw(self, keys):
+        for k in keys:
+            if str(k) in self.iid_key:
+                self.update_row(self.records[k])
+
+    def mark(self, value, keys=None):
+        keys = self.selected_keys() if keys is None else keys
+        for k in keys:
+            self.status[k] = value
+        self._redraw(keys)
+
+    def mark_all(self, value):
+        for k in self.keys:
+            self.status[k] = value
+        # only the materialized rows have anything to redraw
+        self._redraw(list(self.iid_key.values()))
+
+    def toggle(self, keys=None):
+        keys = self.selected_keys() if keys is None else keys
+        for k in keys:
+            self.status[k] = 'A' if self.status.get(k, 'A') == 'P' else 'P'
+        self._redraw(keys)
+
+    def invert(self):
+        # flips the selection, or every row in the grid when nothing is selected
+        keys = self.selected_keys()
+        if keys:
+            return self.toggle(keys)
+        for k in self.keys:
+            self.status[k] = 'A' if self.status.get(k, 'A') == 'P' else 'P'
+        self._redraw(list(self.iid_key.values()))
+
+    def _on_double_click(self, event):
+        iid = self.tree.identify_row(event.y)
+        if iid in self.iid_key:
+            self.toggle([self.iid_key[iid]])
+
+    def _select_all(self, event):
+        self.tree.selection_set(list(self.iid_key))
+        return 'break'